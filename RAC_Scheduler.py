@@ -2,6 +2,16 @@
 Combined Scheduler Module
 
 This module creates the schedules for the following functions below.
+Reports that expose a run_report() entry point are run in a warm worker
+process that keeps pandas and the report modules imported between runs,
+instead of starting a new Python interpreter for every run and retry.
+Scheduled jobs are dispatched to a bounded pool of threads, so a long report
+and its retries never hold up the schedule loop or the other jobs. A job is
+never run twice at the same time, and on shutdown the running jobs are
+allowed to finish while the queued ones are cancelled. Reports that depend on
+the CLS extracts are started by a DataArrivalTrigger at their old clock
+time once the files have stopped changing, or earlier if a completion marker
+for the day's files is written.
 
 Author: [Joshua Fritzjunker]
 Email: [Joshua.Fritzjunker@Cnhind.com]
@@ -12,7 +22,11 @@ import schedule
 import time as time_module
 import datetime
 import logging
-import subprocess
+import importlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from retrying import retry
 
 logging.basicConfig(
@@ -25,25 +39,359 @@ logging.basicConfig(
 # Define the path of the file where you want to store the timestamp
 timestamp_file = r"temp\rac_scheduler_timestamp.txt"
 
+# Modules imported once by the report worker when it starts
+WARM_MODULES = ["pandas", "numpy", "xlsxwriter", "RAC_Unit_EOL_Crosstab"]
+
+# Worker processes shared by all report runs, so different reports can run
+# side by side
+REPORT_WORKERS = 2
+
+# Threads that run the scheduled jobs, and the seconds the running jobs are
+# given to finish when the scheduler shuts down
+JOB_WORKERS = 4
+DRAIN_TIMEOUT = 600
+
+# Report worker pool, created on first use
+_report_worker = None
+_report_worker_lock = threading.Lock()
+
+# Job thread pool, created on first use, and the queued or running future of
+# each job by name
+_job_pool = None
+_active_jobs = {}
+_job_lock = threading.Lock()
+
+
+def _warm_up():
+    """
+    Import the heavy modules in the worker process before its first run.
+    """
+    for module_name in WARM_MODULES:
+        importlib.import_module(module_name)
+
+
+def _run_entry_point(module_name, function_name, **kwargs):
+    """
+    Call a report entry point inside the worker process.
+
+    Args:
+        module_name (str): Module that defines the entry point.
+        function_name (str): Name of the entry point function.
+        **kwargs: Keyword arguments of the entry point.
+    """
+    return getattr(importlib.import_module(module_name), function_name)(**kwargs)
+
+
+def get_report_worker():
+    """
+    Return the warm report worker pool, starting it if needed.
+
+    Returns:
+        ProcessPoolExecutor: Pool of REPORT_WORKERS long lived processes.
+    """
+    global _report_worker
+    with _report_worker_lock:
+        if _report_worker is None:
+            _report_worker = ProcessPoolExecutor(
+                max_workers=REPORT_WORKERS, initializer=_warm_up
+            )
+        return _report_worker
+
+
+def shutdown_report_worker(pool=None):
+    """
+    Stop the report worker pool so the next run starts a fresh one.
+
+    Args:
+        pool (ProcessPoolExecutor, optional): Only stop the pool if it is
+            still this one, so a job that saw a broken pool does not stop
+            the replacement another job already started.
+    """
+    global _report_worker
+    with _report_worker_lock:
+        if _report_worker is not None and pool in (None, _report_worker):
+            _report_worker.shutdown(wait=False, cancel_futures=True)
+            _report_worker = None
+
+
+def get_job_pool():
+    """
+    Return the thread pool that runs the scheduled jobs, starting it if needed.
+
+    Returns:
+        ThreadPoolExecutor: Pool of JOB_WORKERS threads.
+    """
+    global _job_pool
+    if _job_pool is None:
+        _job_pool = ThreadPoolExecutor(
+            max_workers=JOB_WORKERS, thread_name_prefix="job"
+        )
+    return _job_pool
+
+
+def queue_depth():
+    """
+    Return the number of dispatched jobs waiting for a free thread.
+    """
+    with _job_lock:
+        return sum(
+            not (future.running() or future.done()) for future in _active_jobs.values()
+        )
+
+
+def _run_job(job, dispatched_at):
+    waited = time_module.monotonic() - dispatched_at
+    if waited >= 1:
+        logging.info(f"{job.__name__} waited {waited:.1f}s for a free job thread")
+    return job()
+
+
+def _job_done(job_name, future):
+    with _job_lock:
+        _active_jobs.pop(job_name, None)
+    if future.cancelled():
+        logging.info(f"{job_name} was cancelled before it started")
+    elif future.exception() is not None:
+        logging.error(f"{job_name} failed: {future.exception()!r}")
+
+
+def dispatch_job(job):
+    """
+    Run a job on the job thread pool, unless a run of it is already queued
+    or running.
+
+    Args:
+        job: Function to run, without arguments.
+
+    Returns:
+        Future: The job's future, or None if the run was skipped.
+    """
+    job_name = job.__name__
+    with _job_lock:
+        if job_name in _active_jobs:
+            logging.warning(f"{job_name} is still running, skipping this run")
+            return None
+        future = get_job_pool().submit(_run_job, job, time_module.monotonic())
+        _active_jobs[job_name] = future
+        depth = sum(not (f.running() or f.done()) for f in _active_jobs.values())
+    future.add_done_callback(lambda f: _job_done(job_name, f))
+    logging.info(f"{job_name} dispatched, job queue depth {depth}")
+    return future
+
+
+def drain_jobs(timeout=DRAIN_TIMEOUT):
+    """
+    Cancel the queued jobs and wait for the running ones to finish.
+
+    Args:
+        timeout (int, optional): Seconds to wait for the running jobs.
+    """
+    global _job_pool
+    if _job_pool is None:
+        return
+    with _job_lock:
+        futures = dict(_active_jobs)
+    running = [name for name, future in futures.items() if future.running()]
+    logging.info(
+        f"Draining jobs: {len(running)} running {running}, "
+        f"{len(futures) - len(running)} queued"
+    )
+    _job_pool.shutdown(wait=False, cancel_futures=True)
+    # wait() is never woken by a future cancelled on shutdown, so only the
+    # jobs that were not cancelled are waited on
+    started = [future for future in futures.values() if not future.cancelled()]
+    _, not_done = wait(started, timeout=timeout)
+    if not_done:
+        logging.warning(f"{len(not_done)} jobs still running after {timeout}s")
+    _job_pool = None
+
 
 @retry(
     stop_max_attempt_number=3,
     wait_exponential_multiplier=1000,
     wait_exponential_max=10000,
 )
-def execute_script(script_name):
+def _execute_report_attempt(module_name, function_name, run_id):
     start_time = datetime.datetime.now()
-    logging.info(f"{script_name} started at {start_time}")
+    logging.info(f"{module_name}.{function_name} started at {start_time}")
+    pool = get_report_worker()
     try:
-        subprocess.run(["python", script_name], check=True)
+        pool.submit(
+            _run_entry_point, module_name, function_name, run_id=run_id
+        ).result()
         end_time = datetime.datetime.now()
         duration = end_time - start_time
-        logging.info(f"{script_name} ended at {end_time} after running for {duration}")
-    except subprocess.CalledProcessError as e:
-        logging.warning(f"Error executing {script_name}: {e}")
+        logging.info(
+            f"{module_name}.{function_name} ended at {end_time} after running for {duration}"
+        )
+    except BrokenProcessPool as e:
+        # The worker died, so the retry runs in a fresh process
+        logging.warning(f"Report worker stopped while running {module_name}: {e}")
+        shutdown_report_worker(pool)
+        raise
+    except Exception as e:
+        logging.warning(f"Error executing {module_name}.{function_name}: {e}")
         raise  # Important: you need to re-raise the exception to trigger the retry
 
 
+def execute_report(module_name, function_name="run_report"):
+    """
+    Run a report entry point in the report worker, retrying it on failure.
+
+    The attempts share one run_id, so a retry resumes the run's checkpoint
+    while the next scheduled run starts from the current extracts.
+
+    Args:
+        module_name (str): Module that defines the entry point.
+        function_name (str, optional): Entry point, called with run_id.
+    """
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    _execute_report_attempt(module_name, function_name, run_id)
+
+
+class DataArrivalTrigger:
+    """
+    Start a job at its deadline once its source files are stable, or earlier
+    when the job that writes them signals that they are complete.
+
+    The files are polled by modification time and size, starting twice the
+    debounce before the deadline so files that are already stable let the
+    job run right at it. From the deadline on, the job is dispatched as soon
+    as none of the files has changed for debounce seconds, or max_wait
+    seconds after the deadline if they keep changing. If a marker file is
+    given and it was written today, the job is dispatched as soon as the
+    files are stable, before the deadline; the deadline run then only happens
+    if that early run failed or the files changed since. The files themselves are appended to all day,
+    so only the marker tells that a day is complete. The job runs at most once a day at or after the deadline.
+
+    Args:
+        job: Function to dispatch, without arguments.
+        files (list): Paths of the source files to watch.
+        deadline (str): "HH:MM" from which the job runs on the current files.
+        marker (str, optional): Path of a file written once the day's source
+            files are complete. Without one the job only runs at the deadline.
+        debounce (int, optional): Seconds the files must stay unchanged.
+        max_wait (int, optional): Seconds past the deadline to wait for the
+            files to stop changing.
+    """
+
+    def __init__(self, job, files, deadline, marker=None, debounce=120, max_wait=900):
+        self.job = job
+        self.files = list(files)
+        self.deadline = datetime.datetime.strptime(deadline, "%H:%M").time()
+        self.marker = marker
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.last_run_date = None
+        self.early_run_date = None
+        self._signatures = None
+        self._changed_at = None
+        self._run_signatures = None
+
+    def _stat_files(self):
+        signatures = {}
+        for path in self.files:
+            try:
+                stat = os.stat(path)
+                signatures[path] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                # Missing or unreachable, which also counts as changed
+                signatures[path] = None
+        return signatures
+
+    def _marker_written(self, today):
+        if self.marker is None:
+            return False
+        try:
+            written = os.stat(self.marker).st_mtime
+        except OSError:
+            return False
+        return datetime.datetime.fromtimestamp(written).date() == today
+
+    def poll(self, now=None):
+        """
+        Check the files and dispatch the job if it is due.
+
+        Args:
+            now (datetime, optional): Current time, for testing.
+
+        Returns:
+            bool: True if the job was dispatched.
+        """
+        now = now or datetime.datetime.now()
+        today = now.date()
+        if self.last_run_date == today:
+            return False
+        early = self.early_run_date != today and self._marker_written(today)
+        deadline = datetime.datetime.combine(today, self.deadline)
+        past_deadline = now >= deadline
+        watching = now >= deadline - datetime.timedelta(seconds=2 * self.debounce)
+        if not early and not watching:
+            return False
+
+        # Stability is timed from when this process saw the files change, so
+        # the file server's clock does not matter
+        signatures = self._stat_files()
+        if signatures != self._signatures:
+            self._signatures = signatures
+            self._changed_at = now
+        stable_for = (now - self._changed_at).total_seconds()
+        overdue = now >= deadline + datetime.timedelta(seconds=self.max_wait)
+
+        level = logging.INFO
+        if early and stable_for >= self.debounce:
+            reason = (
+                f"{os.path.basename(self.marker)} written and source files "
+                f"unchanged for {stable_for:.0f}s"
+            )
+        elif not past_deadline:
+            return False
+        elif self.early_run_date == today and signatures == self._run_signatures:
+            logging.info(
+                f"{self.job.__name__} not rerun at the {self.deadline:%H:%M} "
+                f"deadline: source files unchanged since today's early run"
+            )
+            self.last_run_date = today
+            return False
+        elif stable_for >= self.debounce:
+            reason = (
+                f"deadline {self.deadline:%H:%M} reached and source files "
+                f"unchanged for {stable_for:.0f}s"
+            )
+        elif overdue:
+            reason = (
+                f"files still changing {self.max_wait}s after the "
+                f"{self.deadline:%H:%M} deadline"
+            )
+            level = logging.WARNING
+        else:
+            return False
+
+        future = dispatch_job(self.job)
+        if future is None:
+            return False
+        logging.log(level, f"{self.job.__name__} triggered: {reason}")
+        if past_deadline:
+            self.last_run_date = today
+        else:
+            # Only a successful early run can stand in for the deadline run
+            self.early_run_date = today
+            self._run_signatures = None
+            future.add_done_callback(
+                lambda f: self._early_run_done(f, today, signatures)
+            )
+        return True
+
+    def _early_run_done(self, future, run_date, signatures):
+        if future.cancelled() or future.exception() is not None:
+            logging.warning(
+                f"{self.job.__name__} early run failed, it runs again at the "
+                f"{self.deadline:%H:%M} deadline"
+            )
+        elif self.early_run_date == run_date:
+            self._run_signatures = signatures
+
+
 # Define all your functions here
 def test_time():
     with open(timestamp_file, "w") as file:
@@ -53,7 +401,7 @@ def test_time():
 
 
 def rac_unit_eol_crosstab():
-    execute_script("RAC_Unit_EOL_Crosstab.py")
+    execute_report("RAC_Unit_EOL_Crosstab")
 
 
 # Schedule your tasks here
@@ -61,31 +409,75 @@ def rac_unit_eol_crosstab():
 DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
 
 # Use a descriptive dictionary for tasks with specific times
-TASK_SCHEDULES = {
-    rac_unit_eol_crosstab: ["15:35"],
+TASK_SCHEDULES = {}
+
+# Folder the CLS extracts are published to
+CLS_DIR = r"\\s1racft1\ftp\PAS\CLS"
+
+# Tasks started when their source files are stable, see DataArrivalTrigger.
+# The CLS extracts are appended to all day and publish no completion marker,
+# so the crosstab runs at its deadline; give a "marker" to let it run earlier.
+TASK_TRIGGERS = {
+    rac_unit_eol_crosstab: {
+        "files": [
+            os.path.join(CLS_DIR, "cls_unit_status.txt"),
+            os.path.join(CLS_DIR, "cls_req_comps.txt"),
+            os.path.join(CLS_DIR, "cls_unit_checklist_summary.txt"),
+        ],
+        "deadline": "15:35",
+        "debounce": 120,
+    },
 }
 
-# Schedule tasks with specific times
-for task, times in TASK_SCHEDULES.items():
-    for time in times:
-        schedule.every().day.at(time).do(task)
+# Seconds between polls of the triggers' source files
+TRIGGER_POLL_SECONDS = 30
 
 
 # For tasks that run every minute or hour for check ins
 def log_alive_status():
-    logging.info("Scheduler is still running...")
+    with _job_lock:
+        running = sorted(_active_jobs)
+    logging.info(
+        f"Scheduler is still running... jobs active {running}, "
+        f"job queue depth {queue_depth()}"
+    )
+
+
+def main():
+    # Schedule tasks with specific times, each run goes to the job pool
+    for task, times in TASK_SCHEDULES.items():
+        for time in times:
+            schedule.every().day.at(time).do(dispatch_job, task)
 
+    # Poll the source files of the data triggered tasks
+    triggers = [
+        DataArrivalTrigger(task, **options) for task, options in TASK_TRIGGERS.items()
+    ]
+    for trigger in triggers:
+        schedule.every(TRIGGER_POLL_SECONDS).seconds.do(trigger.poll)
 
-schedule.every(1).hours.do(log_alive_status)
-schedule.every(1).minutes.do(test_time)
+    # The check ins only take a moment, so they stay on the schedule loop and
+    # keep reporting even when every job thread is busy
+    schedule.every(1).hours.do(log_alive_status)
+    schedule.every(1).minutes.do(test_time)
+
+    logging.info("Scheduler started and running...")
+
+    try:
+        # Start the report worker now so the first run is already warm
+        get_report_worker().submit(_warm_up)
+        while True:
+            schedule.run_pending()
+            time_module.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("Scheduler interrupted and gracefully shutting down...")
+    except Exception as e:
+        logging.error("Exception occurred", exc_info=True)
+    finally:
+        drain_jobs()
+        shutdown_report_worker()
 
-logging.info("Scheduler started and running...")
 
-try:
-    while True:
-        schedule.run_pending()
-        time_module.sleep(1)
-except (KeyboardInterrupt, SystemExit):
-    logging.info("Scheduler interrupted and gracefully shutting down...")
-except Exception as e:
-    logging.error("Exception occurred", exc_info=True)
+# The report worker re-imports this module, so only the parent runs the loop
+if __name__ == "__main__":
+    main()
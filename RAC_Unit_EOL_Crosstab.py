@@ -1,1108 +1,1748 @@
+"""
+RAC Unit EOL Crosstab Module
+
+This module builds the Racine unit end of line report. The work is split
+into stages that each take and return plain DataFrames: load the CLS
+extracts, filter them to the day's units, find the late sign-offs, build
+the crosstabs, render the workbook and deliver it by email. run_report()
+chains the stages for one run, so the scheduler can call it repeatedly from
+a worker process that keeps pandas and the other heavy modules imported.
+backfill_reports() regenerates the reports of past days: the extracts are
+parsed once for the whole range, split by end of line date and the days are
+built in parallel across a process pool.
+
+Running this file directly produces and sends today's report, or with
+--date (and --through) the report of a past day (or range of days).
+"""
+
 # Necessary imports for the routine
+import argparse
 import os
 import pandas as pd
 import numpy as np
+import xlsxwriter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, timedelta, datetime
+from functools import partial
+from html import escape
 from pathlib import Path
+from cls_loader import (
+    PROD_DIR,
+    RowFilter,
+    decategorize,
+    load_datasets,
+    memory_report,
+)
 from email_func_multiple import (
     main,
 )
+from report_config import CONFIG_DIR, current_config
+from report_manifest import prune_reports, record_report
+from run_checkpoint import RunCheckpoint
+from run_metrics import RunMetrics, measure
 
-# Define constants for file locations and column names
+# Reports are written to the Reports folder under the working directory
 CURRENT_DIR = Path.cwd()
-PROD_DIR = Path(r"\\s1racft1\ftp\PAS\CLS")
-
-# Column name definitions
-COLUMN_NAMES = {
-    "cls_unit_status.txt": [
-        "Plant_code",
-        "Unit_serial_number",
-        "Sequence",
-        "Unit_set_date",
-        "Unit_end_of_line_date",
-        "Unit_complete_date",
-        "Assembly_line_number",
-        "Assembly_line_description",
-        "Zone_number",
-        "Zone_description",
-        "Work_station_order",
-        "Work_station_number",
-        "Work_station_description",
-        "Employee_clock_number",
-        "Employee_name",
-        "Validation_date",
-    ],
-    "cls_req_comps.txt": [
-        "Plant_code",
-        "Unit_serial_number",
-        "Alstar_seq",
-        "Assembly_line_number",
-        "Component_code",
-        "Component_descp",
-        "Display_order",
-        "Component_serial_number",
-    ],
-    "cls_unit_checklist_summary.txt": [
-        "Unit_serial_number",
-        "Checklist_id",
-        "Checklist_item_id",
-        "Item_order",
-        "Workstation_id",
-        "Workstation_name",
-        "Check_description",
-        "Status",
-    ],
-    "cls_email_addresses.txt": ["Plant", "Report_code", "Email_address"],
+REPORTS_DIR = CURRENT_DIR / "Reports"
+REPORT_PREFIX = "RAC_Unit_EOL_Report_"
+CONTACTS_FILE = "mycontacts_rac_unit_eol_crosstab.txt"
+THUMBNAIL = r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
+
+# Reports built on each run from a single load of the extracts. Each one mails
+# the contacts with its report code in cls_email_addresses.txt. A report with a
+# plant only keeps that plant's units and contacts, so another plant or report
+# code only adds its own filtering, crosstabs and rendering to a run; None
+# keeps every plant, as the report always has.
+REPORT_DEFINITIONS = {
+    "RAC_Unit_EOL": {
+        "plant": None,
+        "report_code": "UNITEOL",
+        "subject": "Racine Unit End Of Line Report",
+        "report_prefix": REPORT_PREFIX,
+        "contacts_file": CONTACTS_FILE,
+    },
+}
+
+# Work_station_order of the gate stations. A sign-off at an earlier station that
+# is dated after the unit passed a gate is reported as late.
+LATE_SIGNOFF_GATES = [182]
+
+# Datasets loaded for the report
+DATA_FILES = [
+    "cls_unit_status.txt",
+    "cls_req_comps.txt",
+    "cls_unit_checklist_summary.txt",
+    "cls_email_addresses.txt",
+]
+
+# List of columns to potentially drop from the late sign-off sheets
+COLUMNS_TO_DROP = [
+    "Plant_code",
+    "Assembly_line_number",
+    "Assembly_line_description",
+    "Zone_number",
+    "Work_station_order",
+    "Work_station_number",
+    "Unit_end_of_line_date_b",
+]
+
+# Station, component and checklist configuration, see report_config. It holds
+# the report's work stations, the Display_order and Item_order overrides and
+# the product families the units are split into, each with its own crosstab
+# sheets: <family>, <family>_Req_Comps and <family>_Checklist. A serial number
+# belongs to the first family with a prefix it starts with ("" matches every
+# serial number), and the first SERIAL_PREFIX_LENGTH characters are dropped
+# so the crosstab columns sort in build order. A changed file is picked up
+# on the next run.
+CONFIG_FILE = CONFIG_DIR / "rac_unit_eol_crosstab.json"
+SERIAL_PREFIX_LENGTH = 5
+
+# Page layout of each crosstab sheet, in the order the sheets are written
+SHEET_LAYOUTS = {
+    "Tractor": {
+        "label": "Work_station_description",
+        "landscape": True,
+        "print_area": "B1:Q27",
+        "print_scale": 105,
+    },
+    "Cab": {
+        "label": "Work_station_description",
+        "landscape": True,
+        "print_area": "B1:Q27",
+        "print_scale": 105,
+    },
+    "Tractor_Req_Comps": {
+        "label": "Work_station_description",
+        "landscape": False,
+        "print_area": "B1:Q56",
+        "print_scale": 80,
+    },
+    "Cab_Req_Comps": {
+        "label": "Work_station_description",
+        "landscape": False,
+        "print_area": "B1:Q56",
+        "print_scale": 80,
+    },
+    "Cab_Checklist": {
+        "label": "Check_description",
+        "landscape": False,
+        "print_area": "B1:Q56",
+        "print_scale": 80,
+    },
+    "Tractor_Checklist": {
+        "label": "Check_description",
+        "landscape": False,
+        "print_area": "B1:Q56",
+        "print_scale": 80,
+    },
+    "Readiness": {
+        "label": "Unit",
+        "landscape": False,
+        "print_area": "B1:F56",
+        "print_scale": 80,
+    },
+}
+
+# "fast" writes each sheet row by row with shared formats and can stream the
+# workbook with constant_memory; "classic" goes through DataFrame.to_excel
+RENDER_MODE = "fast"
+
+# Output formats produced on each run, see RENDERERS. "html" is sent inline in
+# the email body, the other formats are attached.
+OUTPUT_FORMATS = ["xlsx"]
+
+# Send the report to all contacts in one envelope with a group greeting,
+# instead of one personalised message per contact
+SINGLE_ENVELOPE = False
+
+# Compression of the attachments that are not already compressed ("zip" or
+# "gzip"), None sends them as they are. With a budget in MB, an attachment that
+# would take a message past it fails the send if it is the report, and is left
+# out with a warning otherwise. None attaches every file, whatever its size.
+ATTACHMENT_COMPRESSION = None
+ATTACHMENT_BUDGET_MB = None
+
+# Processes that build the days of a backfill, None uses one per CPU
+BACKFILL_WORKERS = None
+
+# Days of reports kept in REPORTS_DIR, None keeps every report
+REPORT_RETENTION_DAYS = None
+
+# Column widths of the late sign-off sheets
+LATE_SIGNOFF_WIDTHS = {
+    "B:B": 19,
+    "C:C": 9,
+    "D:D": 22,
+    "E:E": 22,
+    "F:F": 22,
+    "G:G": 17,
+    "H:H": 24,
+    "I:I": 24,
+    "J:J": 16,
+    "K:K": 18,
+    "L:L": 18,
 }
 
 
-def load_data(
-    file_name: str, directory: Path = PROD_DIR, sep: str = "|", encoding: str = "latin1"
-) -> pd.DataFrame:
+def get_date_refs(report_date: date = None) -> dict:
     """
-    Load a dataset from a specified file in a given directory.
+    Build the date references for a report run.
 
     Args:
-        file_name (str): Name of the file to load.
-        directory (Path): Directory path where the file is located.
-        sep (str): Column separator in the file.
-        encoding (str): File encoding type.
+        report_date (date, optional): Day the report covers. Defaults to today,
+            evaluated on every call so a long running worker never goes stale.
 
     Returns:
-        pd.DataFrame: Loaded data as a DataFrame. Returns an empty DataFrame if the file is not found.
+        dict: Yesterday, today and tomorrow relative to report_date.
     """
-    file_path = directory / file_name
-    col_names = COLUMN_NAMES.get(file_name, None)
+    today = report_date or date.today()
+    return {
+        "yesterday": today - timedelta(days=1),
+        "today": today,
+        "tomorrow": today + timedelta(days=1),
+    }
 
-    try:
-        return pd.read_csv(
-            file_path, sep=sep, header=None, names=col_names, encoding=encoding
-        )
-    except FileNotFoundError:
-        print(f"Error: {file_path} not found.")
-        return pd.DataFrame()  # Return an empty DataFrame in case of error
 
+def find_late_signoffs(unit_status: pd.DataFrame, gate_orders: list) -> dict:
+    """
+    Find sign-offs that were recorded after the unit had passed a gate station.
 
-# Load all datasets
-data_files = [
-    "cls_unit_status.txt",
-    "cls_req_comps.txt",
-    "cls_unit_checklist_summary.txt",
-    "cls_email_addresses.txt",
-]
-data_frames = {file_name: load_data(file_name) for file_name in data_files}
-
-# Access each dataset by its file name
-unit_status = data_frames["cls_unit_status.txt"]
-req_comps = data_frames["cls_req_comps.txt"]
-unit_checklist_summary = data_frames["cls_unit_checklist_summary.txt"]
-email_addresses = data_frames["cls_email_addresses.txt"]
-
-# Check if each dataset is empty and print the result
-datasets = {
-    "unit_status": unit_status,
-    "req_comps": req_comps,
-    "unit_checklist_summary": unit_checklist_summary,
-    "email_addresses": email_addresses,
-}
+    The gate validation dates are taken with one grouped max over the gate
+    rows and joined back onto every row by serial number, so all gates are
+    checked in a single vectorized pass instead of a per-unit lambda.
 
-for name, df in datasets.items():
-    if df.empty:
-        print(f"{name} is empty.")
-    else:
-        print(f"{name} contains data with {len(df)} rows.")
+    Args:
+        unit_status (pd.DataFrame): Unit status rows with Unit_serial_number,
+            Work_station_order and Validation_date columns.
+        gate_orders (list): Work_station_order of each gate station.
 
-# Filtering on the report code 'UNITEOL' for this report
-email_addresses = email_addresses.loc[
-    email_addresses["Report_code"] == "UNITEOL"
-].dropna()
+    Returns:
+        dict: Gate order -> DataFrame of the rows at earlier stations validated
+        after that gate, with the gate's validation date in a Date_<gate>
+        column. The rows keep the index of unit_status.
+    """
+    gate_columns = [f"Date_{gate}" for gate in gate_orders]
+    with measure("late_signoff/gate_dates", rows_in=len(unit_status)) as step:
+        gate_dates = (
+            unit_status.loc[
+                unit_status["Work_station_order"].isin(gate_orders),
+                ["Unit_serial_number", "Work_station_order", "Validation_date"],
+            ]
+            .groupby(["Unit_serial_number", "Work_station_order"])["Validation_date"]
+            .max()
+            .unstack()
+            .reindex(columns=gate_orders)
+            .set_axis(gate_columns, axis=1)
+            .astype("datetime64[ns]")
+        )
+        with_gates = unit_status.join(gate_dates, on="Unit_serial_number")
+        step["rows_out"] = len(gate_dates)
+
+    late_signoffs = {}
+    for gate, gate_column in zip(gate_orders, gate_columns):
+        with measure(f"late_signoff/{gate_column}", rows_in=len(with_gates)) as step:
+            is_late = (with_gates["Work_station_order"] < gate).fillna(False) & (
+                with_gates["Validation_date"] > with_gates[gate_column]
+            )
+            late_signoffs[gate] = with_gates.loc[
+                is_late, list(unit_status.columns) + [gate_column]
+            ]
+            step["rows_out"] = len(late_signoffs[gate])
+    return late_signoffs
+
+
+def load_stage(
+    date_refs: dict,
+    directory: Path = PROD_DIR,
+    through: date = None,
+    extra_options: dict = None,
+) -> dict:
+    """
+    Load the CLS extracts the report is built from.
 
-# Add 'First_Name' column, select and reorder columns, then export directly
-email_addresses = email_addresses.assign(
-    First_Name=email_addresses["Email_address"].str.split(".", n=1).str[0]
-)[["First_Name", "Email_address"]]
+    Args:
+        date_refs (dict): Date references from get_date_refs.
+        directory (Path, optional): Folder holding the extracts. Defaults to
+            the CLS share.
+        through (date, optional): Last day to keep units of, for a backfill
+            of the days from date_refs["today"] through it. Defaults to
+            date_refs["today"] alone.
+        extra_options (dict, optional): File name -> load_data options to add
+            to or override the report's own.
 
-# Export to a txt file with the specified format
-email_addresses.to_csv(
-    "mycontacts_rac_unit_eol_crosstab.txt", index=False, sep="\t", header=None
-)
-# Set of work station descriptions for faster filtering
-work_station_descriptions = {
-    "TRANNY LOAD",
-    "AXLE OIL FILL",
-    "CHASSIS OVERHEAD",
-    "VERIFY ROPS PLATE",
-    "CAB COMPLETE",
-    "QAA - Inside man",
-    "QAA - Outside man",
-    "QAA - Seat safety switch",
-    "QAA - Bleed Trailer Brake",
-    "CAB LINE TEST",
-    "CAB POWER UP",
-    "QAA - Brake assembly",
-    "QAA - MFD system",
-    "QAA - PTO sys & hydr",
-    "QAA - Hitch sys & hydr",
-    "QAA - Remote system",
-    "QAA - Diff lock",
-    "QAA - Trans drive system",
-    "QAA - Verify PIN",
-    "QAA-BACKUP ALARM FUNCTION",
-    "COC (Cert. of Conformity)",
-    "QAA - Engine Oil Check",
-    "QAA Emergency Brake Test",
-    "Hydraulic Cycle Test",
-    "UNIT BUILT",
-    "FINAL Quality Gate 2",
-    "Hood & Model Decals",
-    "QAA - Susp Axle Calibrtn",
-    "Trans Oil Level Check",
-    "Wash Tractor Complete",
-    "CAB WATER TEST",
-}
+    Returns:
+        dict: File name -> DataFrame for every file in DATA_FILES.
+    """
+    config = current_config(CONFIG_FILE)
+    end_of_line_dates = date_refs["today"]
+    if through is not None:
+        end_of_line_dates = (date_refs["today"], through)
+
+    # Extra load_data options per file
+    load_options = {
+        "cls_unit_status.txt": {
+            # The file is appended to all day, so reruns only parse its new rows
+            "incremental": True,
+            # Stream the file and keep only the day's units at the report's stations
+            "row_filter": RowFilter(
+                isin={"Work_station_description": config.work_stations},
+                dates={"Unit_end_of_line_date": end_of_line_dates},
+            ),
+            "chunksize": 100_000,
+        },
+    }
+    for file_name, options in (extra_options or {}).items():
+        load_options[file_name] = {**load_options.get(file_name, {}), **options}
+
+    # The files are read concurrently since each one is a separate read over SMB
+    data_frames = load_datasets(DATA_FILES, directory, options=load_options)
+
+    # Check if each dataset is empty and print the result
+    for file_name, df in data_frames.items():
+        if df.empty:
+            print(f"{file_name} is empty.")
+        else:
+            print(f"{file_name} contains data with {len(df)} rows.")
 
-# Filter and drop duplicates in a single step
-station_filter = unit_status.loc[
-    unit_status["Work_station_description"].isin(work_station_descriptions),
-    ["Work_station_description"],
-].drop_duplicates()
+    # Print the memory footprint of each dataset and any drift from the schema
+    print(memory_report(data_frames).to_string())
+    return data_frames
 
-# Inner join to get the filtered unit status based on work station descriptions
-filtered_unit_status = pd.merge(
-    unit_status, station_filter, on="Work_station_description", how="inner"
-)
 
-# Format 'Unit_end_of_line_date' column to a datetime object, stripping whitespace
-filtered_unit_status["Unit_end_of_line_date_b"] = pd.to_datetime(
-    filtered_unit_status["Unit_end_of_line_date"].str.strip(), errors="coerce"
-).dt.date
+def filter_stage(data_frames: dict, plant: str = None) -> dict:
+    """
+    Narrow the extracts down to the units in the day's unit status rows.
 
-# Define dictionary of date references for easy access and printing
-date_refs = {
-    "yesterday": date.today() - timedelta(days=1),
-    "today": date.today(),
-    "tomorrow": date.today() + timedelta(days=1),
-}
+    The station and date filters are applied while cls_unit_status.txt is
+    streamed, so this stage only has to match the other extracts on plant
+    and serial number. The loaded frames are not modified, so several
+    reports can be filtered from the same load.
 
-# Print date references for verification
-for name, date_val in date_refs.items():
-    print(f"{name.capitalize()} : {date_val}")
+    Args:
+        data_frames (dict): Output of load_stage.
+        plant (str, optional): Plant_code of the units to keep. Defaults to
+            every plant in the extracts.
 
-# Filter for units that came off line on today's date
-filtered_unit_status = filtered_unit_status[
-    filtered_unit_status["Unit_end_of_line_date_b"] == date_refs["today"]
-]
+    Returns:
+        dict: unit_status sorted by sequence, plus the matching req_comps and
+        unit_checklist_summary rows, all with plain (non categorical) columns.
 
-# Get a unique list of 'Unit_serial_number' values from filtered_unit_status
-unique_unit_serial_numbers = (
-    filtered_unit_status["Unit_serial_number"].unique().tolist()
-)
+    Raises:
+        ValueError: If the day has units but none of them is at plant.
+    """
+    unit_status = data_frames["cls_unit_status.txt"]
+    req_comps = data_frames["cls_req_comps.txt"]
+    unit_checklist_summary = data_frames["cls_unit_checklist_summary.txt"]
+
+    # Keep the plant's units, the checklists are matched on serial number below
+    if plant is not None:
+        plant = plant.strip()
+        plant_units = unit_status[unit_status["Plant_code"].str.strip() == plant]
+        if plant_units.empty and not unit_status.empty:
+            raise ValueError(
+                f"Plant {plant!r} matches none of the {len(unit_status)} units, "
+                f"the extracts have plants "
+                f"{sorted(unit_status['Plant_code'].dropna().unique())}"
+            )
+        unit_status = plant_units
+        req_comps = req_comps[req_comps["Plant_code"].str.strip() == plant]
+
+    # Use the unique serial numbers of the day to filter the other DataFrames
+    unique_unit_serial_numbers = unit_status["Unit_serial_number"].unique().tolist()
+    with measure("filter/req_comps", rows_in=len(req_comps)) as step:
+        req_comps = req_comps[
+            req_comps["Unit_serial_number"].isin(unique_unit_serial_numbers)
+        ]
+        step["rows_out"] = len(req_comps)
+    with measure(
+        "filter/unit_checklist_summary", rows_in=len(unit_checklist_summary)
+    ) as step:
+        unit_checklist_summary = unit_checklist_summary[
+            unit_checklist_summary["Unit_serial_number"].isin(
+                unique_unit_serial_numbers
+            )
+        ]
+        step["rows_out"] = len(unit_checklist_summary)
+
+    # pd.crosstab expands categorical keys to every category, so the day's rows
+    # are converted back to plain values before they are cross-tabulated
+    unit_status = decategorize(unit_status)
+    req_comps = decategorize(req_comps)
+    unit_checklist_summary = decategorize(unit_checklist_summary)
+
+    # sort the units by sequence number
+    unit_status = unit_status.sort_values(by="Sequence", ascending=True)
+
+    return {
+        "unit_status": unit_status,
+        "req_comps": req_comps,
+        "unit_checklist_summary": unit_checklist_summary,
+    }
+
+
+def partition_by_day(data_frames: dict) -> dict:
+    """
+    Split loaded extracts into one set of frames per end of line date.
 
-# Example of using the unique list to filter another DataFrame
-req_comps = req_comps[req_comps["Unit_serial_number"].isin(unique_unit_serial_numbers)]
-# Example of using the unique list to filter another DataFrame
-unit_checklist_summary = unit_checklist_summary[
-    unit_checklist_summary["Unit_serial_number"].isin(unique_unit_serial_numbers)
-]
+    Each unit goes to the day of its Unit_end_of_line_date, together with its
+    required components and checklist rows, so every day can be filtered and
+    built on its own without carrying the rows of the other days.
 
-# sort the units by sequence number
-filtered_unit_status.sort_values(by="Sequence", ascending=True, inplace=True)
+    Args:
+        data_frames (dict): Output of load_stage for a range of days.
 
-# Strip whitespace and convert 'Validation_date' to datetime in a single step
-filtered_unit_status["Validation_date"] = pd.to_datetime(
-    filtered_unit_status["Validation_date"].str.strip(), errors="coerce"
-)
+    Returns:
+        dict: Date -> dict of file name -> DataFrame, in date order, with the
+        same keys as data_frames apart from cls_email_addresses.txt.
+    """
+    unit_status = data_frames["cls_unit_status.txt"]
+    if unit_status.empty:
+        return {}
+    days = unit_status["Unit_end_of_line_date"].dt.normalize()
+
+    # The day of every unit, to route the rows of the other extracts
+    day_of_unit = (
+        pd.DataFrame(
+            {"Unit_serial_number": unit_status["Unit_serial_number"], "day": days}
+        )
+        .drop_duplicates("Unit_serial_number")
+        .set_index("Unit_serial_number")["day"]
+    )
 
-# Create a copy of the DataFrame and initialize the invalid rows DataFrame
-modified_df = filtered_unit_status.copy()
+    file_names = [
+        "cls_unit_status.txt",
+        "cls_req_comps.txt",
+        "cls_unit_checklist_summary.txt",
+    ]
+    partitions = {}
+    for file_name in file_names:
+        df = data_frames[file_name]
+        if df.empty:
+            continue
+        for day, day_df in df.groupby(
+            df["Unit_serial_number"].map(day_of_unit), observed=True, sort=True
+        ):
+            partitions.setdefault(day.date(), {})[file_name] = day_df
+
+    # A day needs every extract, even one without rows for its units
+    return {
+        day: {
+            file_name: frames.get(file_name, data_frames[file_name].iloc[:0])
+            for file_name in file_names
+        }
+        for day, frames in sorted(partitions.items())
+    }
 
 
-# Extract the validation date for Work_station_order 182 for each Unit_serial_number group
-modified_df["Date_182"] = pd.to_datetime(
-    modified_df.groupby("Unit_serial_number")["Validation_date"].transform(
-        lambda x: x[modified_df["Work_station_order"] == 182].max()
-    )
-)
+def late_signoff_stage(unit_status: pd.DataFrame) -> tuple:
+    """
+    Split the late sign-offs out of the unit status rows.
 
-# Check that both columns are of datetime type before comparison
-if pd.api.types.is_datetime64_any_dtype(
-    modified_df["Validation_date"]
-) and pd.api.types.is_datetime64_any_dtype(modified_df["Date_182"]):
-    invalid_rows_df = modified_df[
-        (modified_df["Work_station_order"] < 182)
-        & (modified_df["Validation_date"] > modified_df["Date_182"])
-    ]
-else:
-    print("One of the columns is not in datetime format.")
+    Args:
+        unit_status (pd.DataFrame): Sorted unit status rows from filter_stage.
 
-# Set invalid entries to NaN for specified columns directly in modified_df
-modified_df.loc[
-    invalid_rows_df.index, ["Employee_clock_number", "Employee_name", "Validation_date"]
-] = [np.nan, np.nan, pd.NaT]
+    Returns:
+        tuple: The unit status rows with the late sign-offs blanked out, and a
+        dict of Late_SignOffs sheet name -> DataFrame, one per gate station.
+    """
+    # Find the sign-offs recorded after each gate station, for every gate in one pass
+    late_signoffs = find_late_signoffs(unit_status, LATE_SIGNOFF_GATES)
+
+    # Blank out the late sign-offs so they show up as missing on the crosstabs
+    late_index = (
+        unit_status.index[:0]
+        .append([df.index for df in late_signoffs.values()])
+        .unique()
+    )
+    cols_to_update = ["Employee_clock_number", "Employee_name", "Validation_date"]
+    unit_status = unit_status.copy()
+    unit_status.loc[late_index, cols_to_update] = [np.nan, np.nan, pd.NaT]
+
+    # One Late_SignOffs sheet per gate, suffixed with the gate order when there are several
+    late_signoff_sheets = {}
+    for gate, late_df in late_signoffs.items():
+        sheet_name = (
+            "Late_SignOffs" if len(late_signoffs) == 1 else f"Late_SignOffs_{gate}"
+        )
+        late_signoff_sheets[sheet_name] = late_df.drop(
+            columns=COLUMNS_TO_DROP, errors="ignore"
+        )
 
-# Drop the helper column Date_182 if it's no longer needed
-modified_df.drop(columns=["Date_182"], inplace=True)
+    # Reset the index to get back to the original structure
+    return unit_status.reset_index(drop=True), late_signoff_sheets
 
-# List of columns to potentially drop
-columns_to_drop = [
-    "Plant_code",
-    "Assembly_line_number",
-    "Assembly_line_description",
-    "Zone_number",
-    "Work_station_order",
-    "Work_station_number",
-    "Unit_end_of_line_date_b",
-]
 
-# Drop columns directly, ignoring any that don't exist
-invalid_rows_df.drop(columns=columns_to_drop, inplace=True, errors="ignore")
+def partition_families(frames: dict, families: dict = None) -> dict:
+    """
+    Split rows of several frames into product families in one pass.
 
-# Update 'Employee_clock_number', 'Employee_name', and 'Validation_date' for invalid rows in a single step
-cols_to_update = ["Employee_clock_number", "Employee_name", "Validation_date"]
-filtered_unit_status.loc[invalid_rows_df.index, cols_to_update] = modified_df.reindex(
-    invalid_rows_df.index
-)[cols_to_update]
+    The distinct serial numbers of all the frames are classified and
+    shortened once, then each frame is split with a single stable sort on
+    the family codes, so the cost per row does not grow with the number of
+    families. Rows whose serial number matches no family are left out.
 
-# Reset the index to get back to the original structure
-filtered_unit_status.reset_index(drop=True, inplace=True)
+    Args:
+        frames (dict): Name -> DataFrame with a Unit_serial_number column.
+        families (dict, optional): Family -> {"prefixes": [...]}. Defaults to
+            the families in CONFIG_FILE.
 
-# Convert 'Component_serial_number' to string, strip spaces, and calculate length in one step
-req_comps["Component_serial_number"] = (
-    req_comps["Component_serial_number"].astype(str).str.strip()
-)
-req_comps["Component_serial_number_len"] = req_comps[
-    "Component_serial_number"
-].str.len()
-
-# Update 'Display_order' based on 'Component_descp' values using a dictionary
-display_order_mapping = {
-    "Novatel": "999",
-    "CAN Diagnostics": "998",
-    "Davachi": "997",
-    "ESOM Vehicle Snapshot": "996",
-}
-# Update 'Display_order' only where 'Component_descp' matches the mapping keys
-for descp, display_order in display_order_mapping.items():
-    req_comps.loc[req_comps["Component_descp"] == descp, "Display_order"] = (
-        display_order
+    Returns:
+        dict: Family -> name -> the family's rows of that frame, in their
+        original order and with the prefix dropped from Unit_serial_number.
+    """
+    if families is None:
+        families = current_config(CONFIG_FILE).families
+    serial_codes, serials = pd.factorize(
+        pd.concat(
+            [df["Unit_serial_number"] for df in frames.values()], ignore_index=True
+        )
     )
+    serials = pd.Series(serials)
+
+    # The first family whose prefix matches wins
+    serial_families = np.full(len(serials), len(families))
+    for position, definition in enumerate(families.values()):
+        for prefix in definition["prefixes"]:
+            matches = serials.str.startswith(prefix).to_numpy(dtype=bool)
+            serial_families[matches & (serial_families == len(families))] = position
+    short_serials = serials.str[SERIAL_PREFIX_LENGTH:].array
+
+    partitions = {family: {} for family in families}
+    offset = 0
+    for name, df in frames.items():
+        codes = serial_codes[offset : offset + len(df)]
+        offset += len(df)
+        row_families = np.where(codes >= 0, serial_families[codes], len(families))
+        order = np.argsort(row_families, kind="stable")
+        bounds = np.searchsorted(row_families[order], np.arange(len(families) + 1))
+        for position, family in enumerate(families):
+            rows = order[bounds[position] : bounds[position + 1]]
+            partitions[family][name] = df.iloc[rows].assign(
+                Unit_serial_number=short_serials.take(codes[rows])
+            )
+    return partitions
+
+
+def _key_codes(df: pd.DataFrame, index_columns: list) -> tuple:
+    """
+    Factorize the crosstab row keys of a table into one code per row.
 
-# Assign 'Yes' where 'Component_serial_number_len' is greater than 0
-req_comps["Test"] = np.where(
-    req_comps.get("Component_serial_number_len", 0) > 0, "Yes", None
-)
+    Each column is factorized in sorted order and the codes are combined
+    in mixed radix, so ordering the combined codes orders the rows like a
+    sorted groupby on the same columns. Rows with a missing key get -1.
 
-# Assign 'Yes' where 'Status' equals 1 in 'unit_checklist_summary'
-unit_checklist_summary["Test_Status"] = np.where(
-    unit_checklist_summary.get("Status", 0) == 1, "Yes", None
-)
+    Returns:
+        tuple: The row codes, and the sorted unique values of each column.
+    """
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    uniques = []
+    for column in index_columns:
+        column_codes, column_uniques = pd.factorize(df[column], sort=True)
+        codes = codes * max(len(column_uniques), 1) + column_codes
+        missing |= column_codes < 0
+        uniques.append(column_uniques)
+    codes[missing] = -1
+    return codes, uniques
+
+
+def count_crosstabs(tables: dict) -> dict:
+    """
+    Count the non-empty values of each index row for every unit, for
+    several tables in one pass.
 
-# create two dataframes from the original filtered unit status to break out the cabs and the tractors on different tabs
-cab_unit_status = filtered_unit_status[
-    ~filtered_unit_status["Unit_serial_number"].str.startswith("Z")
-]
+    The unit serial numbers of all the tables are factorized together and
+    the row keys of each table once, then every table is counted into a
+    dense int8 matrix with np.bincount over the combined codes. The result
+    matches pd.crosstab(aggfunc="count") with the cells of units that have
+    no row for a key set to 1, like the report has always shown them.
 
-filtered_unit_status = filtered_unit_status[
-    filtered_unit_status["Unit_serial_number"].str.startswith("Z")
-]
-cab_req_comps = req_comps[~req_comps["Unit_serial_number"].str.startswith("Z")]
-unit_req_comps = req_comps[req_comps["Unit_serial_number"].str.startswith("Z")]
-cab_checklist_summary = unit_checklist_summary[
-    ~unit_checklist_summary["Unit_serial_number"].str.startswith("Z")
-]
-unit_checklist_summary = unit_checklist_summary[
-    unit_checklist_summary["Unit_serial_number"].str.startswith("Z")
-]
-
-# slice the unit serial number to only have the values after the 5th character. We do this so that it will sort the columns index in the dataframe correctly
-filtered_unit_status["Unit_serial_number"] = (
-    filtered_unit_status.Unit_serial_number.str[5:]
-)
-cab_unit_status["Unit_serial_number"] = cab_unit_status.Unit_serial_number.str[5:]
+    Args:
+        tables (dict): Sheet name -> (DataFrame with a Unit_serial_number
+            column, columns that make up the crosstab rows, column whose
+            non-empty values are counted).
 
-cab_req_comps["Unit_serial_number"] = cab_req_comps.Unit_serial_number.str[5:]
-unit_req_comps["Unit_serial_number"] = req_comps.Unit_serial_number.str[5:]
-cab_checklist_summary["Unit_serial_number"] = (
-    cab_checklist_summary.Unit_serial_number.str[5:]
-)
-unit_checklist_summary["Unit_serial_number"] = (
-    unit_checklist_summary.Unit_serial_number.str[5:]
-)
+    Returns:
+        dict: Sheet name -> DataFrame of index rows x Unit_serial_number
+        columns, in the order of tables.
+    """
+    with measure("crosstab/units") as step:
+        serial_codes, serials = pd.factorize(
+            pd.concat(
+                [df["Unit_serial_number"] for df, _, _ in tables.values()],
+                ignore_index=True,
+            ),
+            sort=True,
+        )
+        step["rows_out"] = len(serials)
+
+    crosstabs = {}
+    offset = 0
+    for sheet_name, (df, index_columns, value_column) in tables.items():
+        with measure(f"crosstab/{sheet_name}", rows_in=len(df)) as step:
+            unit_codes = serial_codes[offset : offset + len(df)]
+            offset += len(df)
+            key_codes, key_uniques = _key_codes(df, index_columns)
+            keep = (key_codes >= 0) & (unit_codes >= 0)
+            counted = df[value_column].notna().to_numpy()[keep]
+
+            # Only the keys and units that occur in the table become rows and columns
+            rows, row_positions = np.unique(key_codes[keep], return_inverse=True)
+            units, unit_positions = np.unique(unit_codes[keep], return_inverse=True)
+            cells = row_positions * len(units) + unit_positions
+            size = len(rows) * len(units)
+            present = np.bincount(cells, minlength=size)
+            counts = np.bincount(cells[counted], minlength=size)
+            matrix = np.where(present > 0, counts, 1).reshape(len(rows), len(units))
+            if matrix.size and matrix.max() > np.iinfo(np.int8).max:
+                matrix = matrix.astype(np.int32)
+            else:
+                matrix = matrix.astype(np.int8)
+
+            # Split the combined row codes back into the values of each key
+            levels = []
+            for uniques in reversed(key_uniques):
+                levels.insert(0, uniques.take(rows % max(len(uniques), 1)))
+                rows = rows // max(len(uniques), 1)
+            crosstabs[sheet_name] = pd.DataFrame(
+                matrix,
+                index=pd.MultiIndex.from_arrays(levels, names=index_columns),
+                columns=pd.Index(serials.take(units), name="Unit_serial_number"),
+            )
+            step["rows_out"] = len(matrix)
+    return crosstabs
+
+
+def completion_percent(crosstab: pd.DataFrame) -> np.ndarray:
+    """Return the percentage of each row's cells equal to 1, rounded to int."""
+    if crosstab.shape[1] == 0:
+        return np.zeros(len(crosstab), dtype=int)
+    matrix = crosstab.to_numpy()
+    return np.round((matrix == 1).sum(axis=1) / matrix.shape[1] * 100).astype(int)
+
+
+def readiness_summary(sheets: dict, families: list) -> pd.DataFrame:
+    """
+    Score every unit on the share of its stations, required components and
+    checks that are done.
 
-# create a list of checks for cabs according to the plants specificiations
-cab_options = [
-    "CAB OPERATOR 1",
-    "CAB OPERATOR 2",
-    "CAB OPERATOR 7",
-    "CAB OPERATOR 8",
-    "CAB OPERATOR 9",
-    "CAB OPERATOR 10",
-    "CAB OPERATOR 11",
-    "CAB OPERATOR 12",
-    "CAB OPERATOR 13",
-    "CAB OPERATOR 14",
-    "CAB OPERATOR 15",
-    "CAB OPERATOR 16",
-    "CAB OPERATOR 18",
-    "CAB OPERATOR 21",
-    "CAB SEAT/ARU OP. 1",
-    "CH26 FIREWALL SUB",
-    "CAB LINE TEST",
-    "CAB POWER UP",
-    "CAB COMPLETE",
-]
+    A unit missing from a sheet has none of that sheet's rows done, so the
+    gap shows up as 0 rather than being left out of its score.
 
-# filter the data by the list created above
-cab_checklist_summary = cab_checklist_summary[
-    cab_checklist_summary["Check_description"].isin(cab_options)
-]
+    Args:
+        sheets (dict): Crosstab sheets from count_crosstabs, before the "%"
+            columns are added.
+        families (list): Product families to score the units of.
 
-# create a list of checks for tractors according to the plants specificiations
-tractor_options = [
-    "CAB OPERATOR 1",
-    "CAB OPERATOR 2",
-    "CAB OPERATOR 7",
-    "CAB OPERATOR 8",
-    "CAB OPERATOR 9",
-    "CAB OPERATOR 10",
-    "CAB OPERATOR 11",
-    "CAB OPERATOR 12",
-    "CAB OPERATOR 13",
-    "CAB OPERATOR 14",
-    "CAB OPERATOR 15",
-    "CAB OPERATOR 16",
-    "CAB OPERATOR 18",
-    "CAB OPERATOR 21",
-    "CAB SEAT/ARU OP. 1",
-    "CH26 FIREWALL SUB",
-    "CAB LINE TEST",
-    "CAB POWER UP",
-    "CAB COMPLETE",
-    "TRANNY LOAD",
-    "ENGINE SUB",
-    "CHASSIS STATION 7",
-    "CHASSIS STATION 9",
-    "Masking",
-    "FINAL LINE STATION 02",
-    "FINAL LINE STATION 03",
-    "FINAL LINE STATION 04",
-    "FINAL LINE STATION 07",
-    "FINAL LINE STATION 08",
-    "FINAL LINE STATION 11",
-    "FINAL LINE STATION 11.5",
-    "FINAL LINE STATION 12",
-    "FINAL LINE STATION 13",
-    "FINAL LINE STATION 14",
-    "FINAL LINE STATION 15.5",
-    "FINAL LINE STATION 16",
-    "FINAL LINE STATION 17",
-    "FINAL LINE STATION 17.5",
-    "FINAL LINE STATION 3.5",
-    "QAA - Engine Oil Check",
-    "QAA - Inside man",
-    "QAA - Outside man",
-    "FINAL LINE RADIATOR SUB",
-    "HOOD SUB",
-    "FTQ - Mark, Torque, Mark",
-    "FINAL Quality Gate 2",
-    "Wash Tractor Complete",
-]
+    Returns:
+        pd.DataFrame: One row per unit, indexed by rank and unit and sorted
+        from the least to the most ready, with the percentage done of each
+        sheet and a Readiness column over all of its sheets' rows.
+    """
+    scores = []
+    for unit_type in families:
+        columns = {
+            "Stations": unit_type,
+            "Req_Comps": f"{unit_type}_Req_Comps",
+            "Checklist": f"{unit_type}_Checklist",
+        }
+        crosstabs = {
+            column: sheets[sheet_name]
+            for column, sheet_name in columns.items()
+            if len(sheets[sheet_name])
+        }
+        units = pd.Index(
+            sorted(set().union(*(crosstab.columns for crosstab in crosstabs.values())))
+        )
+        if units.empty:
+            continue
+        done = pd.DataFrame(
+            {
+                column: (crosstab == 1).sum(axis=0).reindex(units, fill_value=0)
+                for column, crosstab in crosstabs.items()
+            }
+        )
+        totals = pd.Series(
+            {column: len(crosstab) for column, crosstab in crosstabs.items()}
+        )
+        score = (done / totals * 100).round().astype(int)
+        score["Readiness"] = (done.sum(axis=1) / totals.sum() * 100).round().astype(int)
+        score.index = unit_type + " " + units
+        scores.append(score)
+
+    if not scores:
+        return pd.DataFrame()
+    summary = pd.concat(scores).sort_values(["Readiness"], kind="stable")
+    summary.index = pd.MultiIndex.from_arrays(
+        [np.arange(1, len(summary) + 1), summary.index], names=["Rank", "Unit"]
+    )
+    return summary
 
-# filter the data by the list created above
-unit_checklist_summary = unit_checklist_summary[
-    unit_checklist_summary["Check_description"].isin(tractor_options)
-]
-# Define Item_order mappings
-item_order_mapping = {
-    "CAB OPERATOR 1": 1,
-    "CAB OPERATOR 2": 2,
-    "CAB OPERATOR 7": 3,
-    "CAB OPERATOR 8": 4,
-    "CAB OPERATOR 9": 5,
-    "CAB OPERATOR 10": 6,
-    "CAB OPERATOR 11": 7,
-    "CAB OPERATOR 12": 8,
-    "CAB OPERATOR 13": 9,
-    "CAB OPERATOR 14": 10,
-    "CAB OPERATOR 15": 11,
-    "CAB OPERATOR 16": 12,
-    "CAB OPERATOR 18": 13,
-    "CAB OPERATOR 21": 14,
-    "CAB SEAT/ARU OP. 1": 15,
-    "CH26 FIREWALL SUB": 16,
-    "CAB LINE TEST": 17,
-    "CAB POWER UP": 18,
-    "CAB COMPLETE": 19,
-    "TRANNY LOAD": 20,
-    "ENGINE SUB": 21,
-    "CHASSIS STATION 7": 22,
-    "CHASSIS STATION 9": 23,
-    "Masking": 24,
-    "FINAL LINE STATION 02": 25,
-    "FINAL LINE STATION 03": 26,
-    "FINAL LINE STATION 04": 27,
-    "FINAL LINE STATION 07": 28,
-    "FINAL LINE STATION 08": 29,
-    "FINAL LINE STATION 11": 30,
-    "FINAL LINE STATION 11.5": 31,
-    "FINAL LINE STATION 12": 32,
-    "FINAL LINE STATION 13": 33,
-    "FINAL LINE STATION 14": 34,
-    "FINAL LINE STATION 15.5": 35,
-    "FINAL LINE STATION 16": 36,
-    "FINAL LINE STATION 17": 37,
-    "FINAL LINE STATION 17.5": 38,
-    "FINAL LINE STATION 3.5": 39,
-    "QAA - Engine Oil Check": 40,
-    "QAA - Inside man": 41,
-    "QAA - Outside man": 42,
-    "FINAL LINE RADIATOR SUB": 43,
-    "HOOD SUB": 44,
-    "FTQ - Mark, Torque, Mark": 45,
-    "FINAL Quality Gate 2": 46,
-    "Wash Tractor Complete": 47,
-}
 
-# Apply Item_order mappings to both cab_checklist_summary and unit_checklist_summary
-cab_checklist_summary["Item_order"] = (
-    cab_checklist_summary["Check_description"]
-    .map(item_order_mapping)
-    .fillna(cab_checklist_summary["Item_order"])
-)
-unit_checklist_summary["Item_order"] = (
-    unit_checklist_summary["Check_description"]
-    .map(item_order_mapping)
-    .fillna(unit_checklist_summary["Item_order"])
-)
+def crosstab_stage(
+    unit_status: pd.DataFrame,
+    req_comps: pd.DataFrame,
+    unit_checklist_summary: pd.DataFrame,
+) -> dict:
+    """
+    Build the crosstab for every sheet of the report.
 
-# create a crosstab with the merged dataframe
-crosstab_unit_status = pd.crosstab(
-    index=[
-        filtered_unit_status.Work_station_order,
-        filtered_unit_status.Work_station_description,
-    ],
-    columns=filtered_unit_status.Unit_serial_number,
-    values=filtered_unit_status.Employee_name,
-    aggfunc="count",
-)
-crosstab_cab_status = pd.crosstab(
-    index=[
-        cab_unit_status.Work_station_order,
-        cab_unit_status.Work_station_description,
-    ],
-    columns=cab_unit_status.Unit_serial_number,
-    values=cab_unit_status.Employee_name,
-    aggfunc="count",
-)
+    Args:
+        unit_status (pd.DataFrame): Unit status rows from late_signoff_stage.
+        req_comps (pd.DataFrame): Required component rows from filter_stage.
+        unit_checklist_summary (pd.DataFrame): Checklist rows from filter_stage.
 
-# Check if 'Test' column exists in the DataFrame
-if "Test" in cab_req_comps.columns:
-    print("Column 'Test' is present. Proceeding with cab_req_comps crosstab.")
-    crosstab_cab_req_comps = pd.crosstab(
-        index=[cab_req_comps.Display_order, cab_req_comps.Component_descp],
-        columns=cab_req_comps.Unit_serial_number,
-        values=cab_req_comps.Test,
-        aggfunc="count",
-    )
-else:
-    print("Column 'Test' is not present. Skipping crosstab.")
-
-# Check if 'Test' column exists in the DataFrame
-if "Test" in unit_req_comps.columns:
-    print("Column 'Test' is present. Proceeding with unit_req_comps crosstab.")
-    crosstab_unit_req_comps = pd.crosstab(
-        index=[unit_req_comps.Display_order, unit_req_comps.Component_descp],
-        columns=unit_req_comps.Unit_serial_number,
-        values=unit_req_comps.Test,
-        aggfunc="count",
+    Returns:
+        dict: Sheet name -> DataFrame, in the order of SHEET_LAYOUTS.
+    """
+    # Convert 'Component_serial_number' to string, strip spaces, and calculate length in one step
+    req_comps = req_comps.copy()
+    req_comps["Component_serial_number"] = (
+        req_comps["Component_serial_number"].astype(str).str.strip()
     )
-else:
-    print("Column 'Test' is not present. Skipping crosstab.")
+    req_comps["Component_serial_number_len"] = req_comps[
+        "Component_serial_number"
+    ].str.len()
 
-# Check if 'Test_Status' column exists in cab_checklist_summary
-if "Test_Status" in cab_checklist_summary.columns:
-    print(
-        "Column 'Test_Status' is present in cab_checklist_summary. Proceeding with crosstab."
-    )
-    cab_checklist_summary_crosstab = pd.crosstab(
-        index=[
-            cab_checklist_summary.Item_order,
-            cab_checklist_summary.Check_description,
-        ],
-        columns=cab_checklist_summary.Unit_serial_number,
-        values=cab_checklist_summary.Test_Status,
-        aggfunc="count",
-    )
-else:
-    print(
-        "Column 'Test_Status' is not present in cab_checklist_summary. Skipping crosstab."
-    )
+    config = current_config(CONFIG_FILE)
 
-# Check if 'Test_Status' column exists in unit_checklist_summary
-if "Test_Status" in unit_checklist_summary.columns:
-    print(
-        "Column 'Test_Status' is present in unit_checklist_summary. Proceeding with crosstab."
-    )
-    unit_checklist_summary = pd.crosstab(
-        index=[
-            unit_checklist_summary.Item_order,
-            unit_checklist_summary.Check_description,
-        ],
-        columns=unit_checklist_summary.Unit_serial_number,
-        values=unit_checklist_summary.Test_Status,
-        aggfunc="count",
-    )
-else:
-    print(
-        "Column 'Test_Status' is not present in unit_checklist_summary. Skipping crosstab."
+    # Update 'Display_order' only where 'Component_descp' has an override
+    component_codes = config.codes(config.components, req_comps["Component_descp"])
+    has_order = component_codes < len(config.components)
+    req_comps.loc[has_order, "Display_order"] = config.component_orders[
+        component_codes[has_order]
+    ]
+
+    # Assign 'Yes' where 'Component_serial_number_len' is greater than 0
+    req_comps["Test"] = np.where(
+        req_comps.get("Component_serial_number_len", 0) > 0, "Yes", None
     )
 
-# Replace NaN values with 1 if the variable exists
-if "crosstab_unit_status" in locals():
-    crosstab_unit_status = crosstab_unit_status.replace(np.nan, 1)
+    # Assign 'Yes' where 'Status' equals 1 in 'unit_checklist_summary'
+    # Look up every check once, the families filter and order them by its code
+    unit_checklist_summary = unit_checklist_summary.assign(
+        Test_Status=np.where(unit_checklist_summary.get("Status", 0) == 1, "Yes", None),
+        Check_code=config.codes(
+            config.checks, unit_checklist_summary["Check_description"]
+        ),
+    )
 
-if "crosstab_cab_status" in locals():
-    crosstab_cab_status = crosstab_cab_status.replace(np.nan, 1)
+    # break out the product families on different tabs
+    families = partition_families(
+        {
+            "unit_status": unit_status,
+            "req_comps": req_comps,
+            "checklist": unit_checklist_summary,
+        },
+        config.families,
+    )
 
-if "crosstab_cab_req_comps" in locals():
-    crosstab_cab_req_comps = crosstab_cab_req_comps.replace(np.nan, 1)
+    # create the crosstabs, counting the signed off cells of each unit
+    station_columns = ["Work_station_order", "Work_station_description"]
+    component_columns = ["Display_order", "Component_descp"]
+    check_columns = ["Item_order", "Check_description"]
+    tables = {}
+    for family, frames in families.items():
+        # filter the checklist by the checks of the family and apply the Item_order mapping
+        checklist = frames["checklist"]
+        check_codes = checklist["Check_code"].to_numpy()
+        checklist = checklist[config.family_checks[family][check_codes]]
+        check_codes = checklist["Check_code"].to_numpy()
+        checklist = checklist.assign(
+            Item_order=pd.Series(
+                config.check_orders[check_codes], index=checklist.index
+            )
+            .fillna(checklist["Item_order"])
+            .astype(checklist["Item_order"].dtype)
+        )
+        tables[family] = (frames["unit_status"], station_columns, "Employee_name")
+        tables[f"{family}_Req_Comps"] = (frames["req_comps"], component_columns, "Test")
+        tables[f"{family}_Checklist"] = (checklist, check_columns, "Test_Status")
 
-if "crosstab_unit_req_comps" in locals():
-    crosstab_unit_req_comps = crosstab_unit_req_comps.replace(np.nan, 1)
+    # Sheets keep the order of SHEET_LAYOUTS, new families go at the end
+    order = [name for name in SHEET_LAYOUTS if name in tables]
+    order += [name for name in tables if name not in order]
+    sheets = count_crosstabs({name: tables[name] for name in order})
 
-if "cab_checklist_summary" in locals():
-    cab_checklist_summary = cab_checklist_summary.replace(np.nan, 1)
+    # Score the units before the row percentages are added to the sheets
+    readiness = readiness_summary(sheets, list(config.families))
 
-if "unit_checklist_summary" in locals():
-    unit_checklist_summary = unit_checklist_summary.replace(np.nan, 1)
+    # Add the percentage of completed units as the first column of every sheet
+    for crosstab in sheets.values():
+        crosstab.insert(0, "%", completion_percent(crosstab))
 
-# Specific value to count
-value_to_count = 1.0
+    sheets["Readiness"] = readiness
+    return sheets
 
-# Add a new column that counts the occurrences of the specific value in each row
-crosstab_unit_status["Count"] = crosstab_unit_status.apply(
-    lambda row: (row == value_to_count).sum(), axis=1
-)
 
-# Calculate the TotalCount excluding the "Count" column
-crosstab_unit_status["TotalCount"] = crosstab_unit_status.drop(columns=["Count"]).apply(
-    lambda row: row.count(), axis=1
-)
+def write_crosstab(workbook, dataframe: pd.DataFrame, worksheet, zero_format):
+    """
+    Write a crosstab's headers and values with borders and flag the zeros.
 
-# Calculate the percentage and assign to a new column
-crosstab_unit_status["%"] = (
-    ((crosstab_unit_status["Count"] / crosstab_unit_status["TotalCount"]) * 100)
-    .round()
-    .astype(int)
-)
+    Args:
+        workbook: xlsxwriter Workbook that owns the worksheet.
+        dataframe (pd.DataFrame): Crosstab to write, next to its index columns.
+        worksheet: xlsxwriter Worksheet to write to.
+        zero_format: Format applied to cells equal to 0.
+    """
+    # manually adding the data and formatting for the dataframe
+    row_idx, col_idx = dataframe.shape
+    for r in range(row_idx):
+        if r == 1:
+            header_format = workbook.add_format(
+                {
+                    "bold": True,
+                    "bottom": 2,
+                    "align": "center",
+                    "text_wrap": True,
+                    "bg_color": "#D9D9D9",
+                    "border": 1,
+                }
+            )
+
+            for col_num, data in enumerate(dataframe.columns.values):
+                worksheet.write(0, col_num + 2, data, header_format)
+        for c in range(col_idx):
+            worksheet.write(
+                r + 1,
+                c + 2,
+                dataframe.values[r, c],
+                workbook.add_format(
+                    {"border": 1, "align": "center"},
+                ),
+            )
+            if r == 1 and c == 1:
+                worksheet.conditional_format(
+                    1,
+                    1,
+                    row_idx - 0,
+                    col_idx - -1,
+                    {
+                        "type": "cell",
+                        "criteria": "=",
+                        "value": 0,
+                        "format": zero_format,
+                    },
+                )
 
-# Extract the list of column names
-cols = crosstab_unit_status.columns.tolist()
 
-# Remove the "%" column from its current position
-cols.remove("%")
+def add_formats(workbook) -> dict:
+    """
+    Create every format the report uses once per workbook.
 
-# Insert the "%" column to be the third column
-cols.insert(0, "%")
+    Args:
+        workbook: xlsxwriter Workbook to add the formats to.
 
-# Rearrange the DataFrame columns using the reordered list
-crosstab_unit_status = crosstab_unit_status[cols]
+    Returns:
+        dict: Format name -> xlsxwriter Format.
+    """
+    return {
+        # Cells equal to 0 are flagged red by the conditional format
+        "zero": workbook.add_format({"bg_color": "red", "font_color": "white"}),
+        "column": workbook.add_format({"align": "center", "bold": False}),
+        "label": workbook.add_format(
+            {
+                "bold": True,
+                "align": "center",
+                "bg_color": "#D9D9D9",
+                "border": 1,
+            }
+        ),
+        "header": workbook.add_format(
+            {
+                "bold": True,
+                "bottom": 2,
+                "align": "center",
+                "text_wrap": True,
+                "bg_color": "#D9D9D9",
+                "border": 1,
+            }
+        ),
+        "cell": workbook.add_format({"border": 1, "align": "center"}),
+        # Same look as the index and header cells written by DataFrame.to_excel
+        "index": workbook.add_format(
+            {"bold": True, "border": 1, "align": "center", "valign": "top"}
+        ),
+        "datetime": workbook.add_format({"num_format": "YYYY-MM-DD HH:MM:SS"}),
+    }
+
+
+def _cell_value(value):
+    """
+    Convert a DataFrame value into one xlsxwriter can write.
 
-# Drop the "Count" and "TotalCount" columns
-crosstab_unit_status = crosstab_unit_status.drop(columns=["Count", "TotalCount"])
+    Args:
+        value: Value taken from a DataFrame or its index.
 
+    Returns:
+        The value as a plain Python object, or None for missing values.
+    """
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
 
-# change directory to the Reports_PD folder
-current_dir = os.getcwd()
-# desktop = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
-os.chdir(current_dir + "\Reports")
 
-# create a todays date/time variable to use in naming the file
-todays_date = str(datetime.now().strftime("%Y-%m-%d_%H_%M")) + ".xlsx"
+def write_crosstab_rows(worksheet, dataframe: pd.DataFrame, label: str, formats):
+    """
+    Write a crosstab and its two index columns one whole row at a time.
 
-# List of DataFrame variables to check
-dataframes = [
-    "crosstab_unit_status",
-    "crosstab_cab_status",
-    "crosstab_unit_req_comps",
-    "crosstab_cab_req_comps",
-    "cab_checklist_summary",
-    "unit_checklist_summary",
-    "invalid_rows_df",
-]
+    Rows are written strictly top to bottom, so the sheet can be streamed
+    with the constant_memory workbook option.
 
-# Check each DataFrame and print whether it exists and is not empty
-for df_name in dataframes:
-    if df_name in locals():
-        if not locals()[df_name].empty:
-            print(f"{df_name}: True (exists and is not empty)")
-        else:
-            print(f"{df_name}: False (exists but is empty)")
-    else:
-        print(f"{df_name}: False (does not exist)")
-
-# Check if any DataFrame exists and is not empty
-run_main = (
-    ("crosstab_unit_status" in locals() and crosstab_unit_status.empty is False)
-    or ("crosstab_cab_status" in locals() and crosstab_cab_status.empty is False)
-    or (
-        "crosstab_unit_req_comps" in locals() and crosstab_unit_req_comps.empty is False
+    Args:
+        worksheet: xlsxwriter Worksheet to write to.
+        dataframe (pd.DataFrame): Crosstab with a two level row index.
+        label (str): Header of the description column.
+        formats (dict): Formats from add_formats.
+    """
+    row_idx, col_idx = dataframe.shape
+    worksheet.write(0, 0, dataframe.index.names[0], formats["index"])
+    worksheet.write_string(0, 1, label, formats["label"])
+    worksheet.write_row(0, 2, dataframe.columns.tolist(), formats["header"])
+
+    values = dataframe.to_numpy(dtype=float).tolist()
+    for r, (keys, row) in enumerate(zip(dataframe.index, values), start=1):
+        worksheet.write_row(r, 0, [_cell_value(key) for key in keys], formats["index"])
+        worksheet.write_row(r, 2, row, formats["cell"])
+
+    # One conditional format covers the whole sheet
+    worksheet.conditional_format(
+        1,
+        1,
+        row_idx,
+        col_idx + 1,
+        {"type": "cell", "criteria": "==", "value": 0, "format": formats["zero"]},
     )
-    or ("crosstab_cab_req_comps" in locals() and crosstab_cab_req_comps.empty is False)
-    or ("cab_checklist_summary" in locals() and cab_checklist_summary.empty is False)
-    or ("unit_checklist_summary" in locals() and unit_checklist_summary.empty is False)
-    or ("invalid_rows_df" in locals() and invalid_rows_df.empty is False)
-)
-
-# Only create the writer and save the file if there is data to write
-if run_main:
-    # Create a Pandas Excel writer using XlsxWriter as the engine.
-    writer = pd.ExcelWriter("RAC_Unit_EOL_Report_" + todays_date, engine="xlsxwriter")
 
-    # Check if the variable exists and is not empty
-    if "crosstab_unit_status" in locals() and crosstab_unit_status.empty is False:
-        crosstab_unit_status.to_excel(writer, sheet_name="Tractor", startrow=0)
 
-    if "crosstab_cab_status" in locals() and crosstab_cab_status.empty is False:
-        crosstab_cab_status.to_excel(writer, sheet_name="Cab", startrow=0)
+def write_frame_rows(worksheet, dataframe: pd.DataFrame, formats):
+    """
+    Write a DataFrame laid out like DataFrame.to_excel, one row at a time.
 
-    if "crosstab_unit_req_comps" in locals() and crosstab_unit_req_comps.empty is False:
-        crosstab_unit_req_comps.to_excel(
-            writer, sheet_name="Tractor_Req_Comps", startrow=0
-        )
+    Args:
+        worksheet: xlsxwriter Worksheet to write to.
+        dataframe (pd.DataFrame): Frame to write, index in the first column.
+        formats (dict): Formats from add_formats.
+    """
+    worksheet.write_row(0, 1, dataframe.columns.tolist(), formats["index"])
+    rows = dataframe.astype(object).itertuples(index=False)
+    for r, (index_value, row) in enumerate(zip(dataframe.index, rows), start=1):
+        worksheet.write(r, 0, _cell_value(index_value), formats["index"])
+        for c, value in enumerate(row, start=1):
+            value = _cell_value(value)
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                worksheet.write_datetime(r, c, value, formats["datetime"])
+            else:
+                worksheet.write(r, c, value)
+
+
+def set_page_layout(worksheet, landscape: bool, print_area: str, print_scale: int):
+    """
+    Apply the shared print setup of the report sheets.
 
-    if "crosstab_cab_req_comps" in locals() and crosstab_cab_req_comps.empty is False:
-        crosstab_cab_req_comps.to_excel(writer, sheet_name="Cab_Req_Comps", startrow=0)
+    Args:
+        worksheet: xlsxwriter Worksheet to set up.
+        landscape (bool): Print in landscape rather than portrait.
+        print_area (str): Cell range to print.
+        print_scale (int): Print scale in percent.
+    """
+    worksheet.set_column("A:A", None, None, {"hidden": True})
+    worksheet.hide_gridlines(2)
+    if landscape:
+        worksheet.set_landscape()
+    else:
+        worksheet.set_portrait()
+    worksheet.center_horizontally()
+    worksheet.center_vertically()
+    worksheet.print_area(print_area)
+    worksheet.set_header("&L&G", {"image_left": THUMBNAIL})
+    worksheet.set_print_scale(print_scale)
+    worksheet.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
+    worksheet.set_footer("&L&F&C&D&R&P")
 
-    if "cab_checklist_summary" in locals() and cab_checklist_summary.empty is False:
-        cab_checklist_summary.to_excel(writer, sheet_name="Cab_Checklist", startrow=0)
 
-    if "unit_checklist_summary" in locals() and unit_checklist_summary.empty is False:
-        unit_checklist_summary.to_excel(
-            writer, sheet_name="Tractor_Checklist", startrow=0
-        )
+def sheet_layout(sheet_name: str) -> dict:
+    """
+    Return the layout of a crosstab sheet.
 
-    if "invalid_rows_df" in locals() and invalid_rows_df.empty is False:
-        invalid_rows_df.to_excel(writer, sheet_name="Late_SignOffs", startrow=0)
+    Sheets of a family without its own SHEET_LAYOUTS entries get the layout
+    of the same Tractor sheet.
+    """
+    if sheet_name in SHEET_LAYOUTS:
+        return SHEET_LAYOUTS[sheet_name]
+    for suffix in ["_Req_Comps", "_Checklist"]:
+        if sheet_name.endswith(suffix):
+            return SHEET_LAYOUTS["Tractor" + suffix]
+    return SHEET_LAYOUTS["Tractor"]
 
-    # Get the xlsxwriter objects from the dataframe writer object.
-    workbook = writer.book
 
-    # Check if the variable exists and is not empty before assigning the worksheet.
-    if "crosstab_unit_status" in locals() and crosstab_unit_status.empty is False:
-        worksheet1 = writer.sheets["Tractor"]
+def set_crosstab_columns(worksheet, formats: dict):
+    """
+    Set the column widths of a crosstab sheet.
 
-    if "crosstab_cab_status" in locals() and crosstab_cab_status.empty is False:
-        worksheet2 = writer.sheets["Cab"]
+    Args:
+        worksheet: xlsxwriter Worksheet to set up.
+        formats (dict): Formats from add_formats.
+    """
+    worksheet.set_column("B:B", 30, formats["column"])
+    worksheet.set_column("C:IA", 5, formats["column"])
 
-    if "crosstab_unit_req_comps" in locals() and crosstab_unit_req_comps.empty is False:
-        worksheet3 = writer.sheets["Tractor_Req_Comps"]
 
-    if "crosstab_cab_req_comps" in locals() and crosstab_cab_req_comps.empty is False:
-        worksheet4 = writer.sheets["Cab_Req_Comps"]
+def set_late_signoff_columns(worksheet, formats: dict):
+    """
+    Set the column widths of a late sign-off sheet.
 
-    if "cab_checklist_summary" in locals() and cab_checklist_summary.empty is False:
-        worksheet5 = writer.sheets["Cab_Checklist"]
+    Args:
+        worksheet: xlsxwriter Worksheet to set up.
+        formats (dict): Formats from add_formats.
+    """
+    for columns, width in LATE_SIGNOFF_WIDTHS.items():
+        worksheet.set_column(columns, width, formats["column"])
 
-    if "unit_checklist_summary" in locals() and unit_checklist_summary.empty is False:
-        worksheet6 = writer.sheets["Tractor_Checklist"]
 
-    if "invalid_rows_df" in locals() and invalid_rows_df.empty is False:
-        worksheet7 = writer.sheets["Late_SignOffs"]
+def write_workbook_fast(
+    sheets: dict, late_signoff_sheets: dict, report_path: Path, constant_memory: bool
+):
+    """
+    Write the report workbook directly with xlsxwriter, row by row.
 
-    # Initialize variables to default values in case the DataFrames don't exist
-    max_row, max_col = 0, 0
-    max_row_1, max_col_1 = 0, 0
-    max_row_2, max_col_2 = 0, 0
-    max_row_3, max_col_3 = 0, 0
-    max_row_4, max_col_4 = 0, 0
-    max_row_5, max_col_5 = 0, 0
-    max_row_6, max_col_6 = 0, 0
-    max_row_7, max_col_7 = 0, 0
+    Every format is created once for the workbook and each crosstab row is
+    written with two write_row calls, which keeps the sheets valid when
+    constant_memory flushes every finished row to disk.
 
-    # Check if the variable exists and is not empty, then get its shape
-    if "crosstab_unit_status" in locals() and crosstab_unit_status.empty is False:
-        (max_row, max_col) = crosstab_unit_status.shape
+    Args:
+        sheets (dict): Non-empty crosstab sheet name -> DataFrame.
+        late_signoff_sheets (dict): Non-empty Late_SignOffs sheet name -> DataFrame.
+        report_path (Path): Workbook to create.
+        constant_memory (bool): Use the xlsxwriter constant_memory option.
+    """
+    with xlsxwriter.Workbook(
+        str(report_path), {"constant_memory": constant_memory}
+    ) as workbook:
+        formats = add_formats(workbook)
+
+        for sheet_name, df in sheets.items():
+            with measure(f"render/{sheet_name}", rows_in=len(df)):
+                layout = sheet_layout(sheet_name)
+                worksheet = workbook.add_worksheet(sheet_name)
+                set_crosstab_columns(worksheet, formats)
+                write_crosstab_rows(worksheet, df, layout["label"], formats)
+                set_page_layout(
+                    worksheet,
+                    layout["landscape"],
+                    layout["print_area"],
+                    layout["print_scale"],
+                )
 
-    if "crosstab_cab_status" in locals() and crosstab_cab_status.empty is False:
-        (max_row_1, max_col_1) = crosstab_cab_status.shape
+        # Late sign-off sheets, one per gate station
+        for sheet_name, late_df in late_signoff_sheets.items():
+            with measure(f"render/{sheet_name}", rows_in=len(late_df)):
+                worksheet = workbook.add_worksheet(sheet_name)
+                set_late_signoff_columns(worksheet, formats)
+                write_frame_rows(worksheet, late_df, formats)
+                set_page_layout(worksheet, True, "B1:K20", 65)
+
+
+def write_workbook(
+    sheets: dict,
+    late_signoff_sheets: dict,
+    report_path: Path,
+    mode: str = RENDER_MODE,
+    constant_memory: bool = True,
+) -> Path:
+    """
+    Write the report sheets to an Excel workbook.
 
-    if "crosstab_cab_req_comps" in locals() and crosstab_cab_req_comps.empty is False:
-        (max_row_2, max_col_2) = crosstab_cab_req_comps.shape
+    Args:
+        sheets (dict): Non-empty crosstab sheet name -> DataFrame.
+        late_signoff_sheets (dict): Non-empty Late_SignOffs sheet name -> DataFrame.
+        report_path (Path): Workbook to create.
+        mode (str, optional): "fast" or "classic", see RENDER_MODE.
+        constant_memory (bool, optional): Stream each fast mode sheet to disk
+            as it is written instead of holding the workbook in memory.
+            Defaults to True.
 
-    if "crosstab_unit_req_comps" in locals() and crosstab_unit_req_comps.empty is False:
-        (max_row_3, max_col_3) = crosstab_unit_req_comps.shape
+    Returns:
+        Path: report_path.
+    """
+    if mode == "fast":
+        write_workbook_fast(sheets, late_signoff_sheets, report_path, constant_memory)
+        return report_path
 
-    # Ensure the variable is not rechecked
-    if "crosstab_cab_req_comps" in locals() and crosstab_cab_req_comps.empty is False:
-        (max_row_4, max_col_4) = crosstab_cab_req_comps.shape
+    # Create a Pandas Excel writer using XlsxWriter as the engine.
+    with pd.ExcelWriter(report_path, engine="xlsxwriter") as writer:
+        for sheet_name, df in {**sheets, **late_signoff_sheets}.items():
+            with measure(f"render/{sheet_name}", rows_in=len(df)):
+                df.to_excel(writer, sheet_name=sheet_name, startrow=0)
+
+        # Get the xlsxwriter objects from the dataframe writer object.
+        workbook = writer.book
+
+        formats = add_formats(workbook)
+
+        for sheet_name, df in sheets.items():
+            layout = sheet_layout(sheet_name)
+            worksheet = writer.sheets[sheet_name]
+            set_crosstab_columns(worksheet, formats)
+            worksheet.write_string("B1", layout["label"], formats["label"])
+            write_crosstab(workbook, df, worksheet, formats["zero"])
+            set_page_layout(
+                worksheet,
+                layout["landscape"],
+                layout["print_area"],
+                layout["print_scale"],
+            )
+
+        # Late sign-off sheets, one per gate station
+        for sheet_name in late_signoff_sheets:
+            worksheet = writer.sheets[sheet_name]
+            set_late_signoff_columns(worksheet, formats)
+            set_page_layout(worksheet, True, "B1:K20", 65)
+
+    return report_path
+
+
+def _html_cell(value, flag_zeros: bool) -> str:
+    """
+    Render one DataFrame value as an HTML table cell.
 
-    if "cab_checklist_summary" in locals() and cab_checklist_summary.empty is False:
-        (max_row_5, max_col_5) = cab_checklist_summary.shape
+    Args:
+        value: Value taken from a DataFrame or its index.
+        flag_zeros (bool): Highlight cells equal to 0 like the workbook does.
 
-    if "unit_checklist_summary" in locals() and unit_checklist_summary.empty is False:
-        (max_row_6, max_col_6) = unit_checklist_summary.shape
+    Returns:
+        str: The <td> element.
+    """
+    value = _cell_value(value)
+    style = "border:1px solid #999999;padding:2px 6px;text-align:center;"
+    if value is None:
+        return f'<td style="{style}"></td>'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if flag_zeros and value == 0:
+        style += "background-color:red;color:white;"
+    return f'<td style="{style}">{escape(str(value))}</td>'
+
+
+def frame_to_html(title: str, dataframe: pd.DataFrame, flag_zeros: bool) -> str:
+    """
+    Render a DataFrame as a titled HTML table with inline styles for email.
 
-    if "invalid_rows_df" in locals() and invalid_rows_df.empty is False:
-        (max_row_7, max_col_7) = invalid_rows_df.shape
+    Args:
+        title (str): Heading shown above the table.
+        dataframe (pd.DataFrame): Frame to render, its index as the first column.
+        flag_zeros (bool): Highlight cells equal to 0.
 
-    # conditional formatting
-    format2 = workbook.add_format({"bg_color": "green"})
-    format3 = workbook.add_format({"bg_color": "red", "font_color": "white"})
-    format4 = workbook.add_format({"bg_color": "orange"})
-    cell_format = workbook.add_format({"align": "center", "bold": False})
-    cell_format1 = workbook.add_format({"align": "left"})
-    cell_format2 = workbook.add_format({"num_format": "mm/dd/yyyy"})
-    cell_format3 = workbook.add_format({"align": "center", "font_color": "white"})
-    cell_format4 = workbook.add_format(
-        {
-            "bold": True,
-            "align": "center",
-            "bg_color": "#D9D9D9",
-            "border": 1,
-        }
+    Returns:
+        str: HTML fragment with the heading and the table.
+    """
+    header_style = "border:1px solid #999999;padding:2px 6px;background-color:#D9D9D9;"
+    header = "".join(
+        f'<th style="{header_style}">{escape(str(name))}</th>'
+        for name in [dataframe.index.name or ""] + dataframe.columns.tolist()
     )
-    cell_format5 = workbook.add_format(
-        {
-            "bold": True,
-            "align": "center",
-            "bg_color": "purple",
-            "font_color": "white",
-        }
+    rows = [
+        "<tr>"
+        + _html_cell(index_value, False)
+        + "".join(_html_cell(value, flag_zeros) for value in row)
+        + "</tr>"
+        for index_value, row in zip(
+            dataframe.index, dataframe.astype(object).itertuples(index=False)
+        )
+    ]
+    return (
+        f"<h3>{escape(title)}</h3>"
+        '<table style="border-collapse:collapse;width:auto;">'
+        f"<tr>{header}</tr>{''.join(rows)}</table>"
     )
 
-    # Check if the DataFrame exists and is not empty, then apply formatting
-    if (
-        "crosstab_unit_status" in locals()
-        and crosstab_unit_status.empty is False
-        and "worksheet1" in locals()
-    ):
-        worksheet1.set_column("B:B", 30, cell_format)
-        worksheet1.set_column("C:IA", 5, cell_format)
-        worksheet1.write_string("B1", "Work_station_description", cell_format4)
-
-    if (
-        "crosstab_cab_status" in locals()
-        and crosstab_cab_status.empty is False
-        and "worksheet2" in locals()
-    ):
-        worksheet2.set_column("B:B", 30, cell_format)
-        worksheet2.set_column("C:IA", 5, cell_format)
-        worksheet2.write_string("B1", "Work_station_description", cell_format4)
-
-    if (
-        "crosstab_unit_req_comps" in locals()
-        and crosstab_unit_req_comps.empty is False
-        and "worksheet3" in locals()
-    ):
-        worksheet3.set_column("B:B", 30, cell_format)
-        worksheet3.set_column("C:IA", 5, cell_format)
-        worksheet3.write_string("B1", "Work_station_description", cell_format4)
-
-    if (
-        "crosstab_cab_req_comps" in locals()
-        and crosstab_cab_req_comps.empty is False
-        and "worksheet4" in locals()
-    ):
-        worksheet4.set_column("B:B", 30, cell_format)
-        worksheet4.set_column("C:IA", 5, cell_format)
-        worksheet4.write_string("B1", "Work_station_description", cell_format4)
-
-    if (
-        "cab_checklist_summary" in locals()
-        and cab_checklist_summary.empty is False
-        and "worksheet5" in locals()
-    ):
-        worksheet5.set_column("B:B", 30, cell_format)
-        worksheet5.set_column("C:IA", 5, cell_format)
-        worksheet5.write_string("B1", "Check_description", cell_format4)
-
-    if (
-        "unit_checklist_summary" in locals()
-        and unit_checklist_summary.empty is False
-        and "worksheet6" in locals()
-    ):
-        worksheet6.set_column("B:B", 30, cell_format)
-        worksheet6.set_column("C:IA", 5, cell_format)
-        worksheet6.write_string("B1", "Check_description", cell_format4)
-
-    if (
-        "invalid_rows_df" in locals()
-        and invalid_rows_df.empty is False
-        and "worksheet7" in locals()
-    ):
-        worksheet7.set_column("B:B", 19, cell_format)
-        worksheet7.set_column("C:C", 9, cell_format)
-        worksheet7.set_column("D:D", 22, cell_format)
-        worksheet7.set_column("E:E", 22, cell_format)
-        worksheet7.set_column("F:F", 22, cell_format)
-        worksheet7.set_column("G:G", 17, cell_format)
-        worksheet7.set_column("H:H", 24, cell_format)
-        worksheet7.set_column("I:I", 24, cell_format)
-        worksheet7.set_column("J:J", 16, cell_format)
-        worksheet7.set_column("K:K", 18, cell_format)
-        worksheet7.set_column("L:L", 18, cell_format)
-
-    def get_crosstab(dataframe, worksheet):
-        # manually adding the data and formatting for the dataframe
-        row_idx, col_idx = dataframe.shape
-        for r in range(row_idx):
-            if r == 1:
-                header_format = workbook.add_format(
-                    {
-                        "bold": True,
-                        "bottom": 2,
-                        "align": "center",
-                        "text_wrap": True,
-                        "bg_color": "#D9D9D9",
-                        "border": 1,
-                    }
-                )
 
-                for col_num, data in enumerate(dataframe.columns.values):
-                    worksheet.write(0, col_num + 2, data, header_format)
-            for c in range(col_idx):
-                worksheet.write(
-                    r + 1,
-                    c + 2,
-                    dataframe.values[r, c],
-                    workbook.add_format(
-                        {"border": 1, "align": "center"},
-                    ),
-                )
-                if r == 1 and c == 1:
-                    worksheet.conditional_format(
-                        1,
-                        1,
-                        row_idx - 0,
-                        col_idx - -1,
-                        {
-                            "type": "cell",
-                            "criteria": "=",
-                            "value": 0,
-                            "format": format3,
-                        },
-                    )
+# Output backends by format name. Each one takes the non-empty crosstab and
+# late sign-off sheets plus the report path without a suffix, and returns the
+# list of files it wrote.
+RENDERERS = {}
 
-    # Check if the DataFrame exists and is not empty, then apply the function
-    if (
-        "crosstab_unit_status" in locals()
-        and crosstab_unit_status.empty is False
-        and "worksheet1" in locals()
-    ):
-        get_crosstab(crosstab_unit_status, worksheet1)
 
-    if (
-        "crosstab_cab_status" in locals()
-        and crosstab_cab_status.empty is False
-        and "worksheet2" in locals()
-    ):
-        get_crosstab(crosstab_cab_status, worksheet2)
+def renderer(name: str):
+    """
+    Register the decorated function as the output backend for a format.
 
-    if (
-        "crosstab_unit_req_comps" in locals()
-        and crosstab_unit_req_comps.empty is False
-        and "worksheet3" in locals()
-    ):
-        get_crosstab(crosstab_unit_req_comps, worksheet3)
+    Args:
+        name (str): Format name used in OUTPUT_FORMATS.
+    """
 
-    if (
-        "crosstab_cab_req_comps" in locals()
-        and crosstab_cab_req_comps.empty is False
-        and "worksheet4" in locals()
-    ):
-        get_crosstab(crosstab_cab_req_comps, worksheet4)
+    def register(func):
+        RENDERERS[name] = func
+        return func
 
-    if (
-        "cab_checklist_summary" in locals()
-        and cab_checklist_summary.empty is False
-        and "worksheet5" in locals()
-    ):
-        get_crosstab(cab_checklist_summary, worksheet5)
+    return register
 
-    if (
-        "unit_checklist_summary" in locals()
-        and unit_checklist_summary.empty is False
-        and "worksheet6" in locals()
-    ):
-        get_crosstab(unit_checklist_summary, worksheet6)
 
-    # Check if the DataFrame exists and is not empty before applying operations on the worksheet
-    if (
-        "crosstab_unit_status" in locals()
-        and crosstab_unit_status.empty is False
-        and "worksheet1" in locals()
-    ):
-        worksheet1.set_column("A:A", None, None, {"hidden": True})
-        worksheet1.hide_gridlines(2)
-        worksheet1.set_landscape()
-        worksheet1.center_horizontally()
-        worksheet1.center_vertically()
-        worksheet1.print_area("B1:Q27")  # Cells B1 to Q27.
-        worksheet1.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
-        )
-        worksheet1.set_print_scale(105)
-        worksheet1.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet1.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "crosstab_cab_status" in locals()
-        and crosstab_cab_status.empty is False
-        and "worksheet2" in locals()
-    ):
-        worksheet2.set_column("A:A", None, None, {"hidden": True})
-        worksheet2.hide_gridlines(2)
-        worksheet2.set_landscape()
-        worksheet2.center_horizontally()
-        worksheet2.center_vertically()
-        worksheet2.print_area("B1:Q27")  # Cells B1 to Q27.
-        worksheet2.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+@renderer("xlsx")
+def render_xlsx(sheets: dict, late_signoff_sheets: dict, report_stem: Path) -> list:
+    """
+    Write the report as one Excel workbook.
+    """
+    return [
+        write_workbook(
+            sheets,
+            late_signoff_sheets,
+            report_stem.with_name(report_stem.name + ".xlsx"),
         )
-        worksheet2.set_print_scale(105)
-        worksheet2.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet2.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "crosstab_unit_req_comps" in locals()
-        and crosstab_unit_req_comps.empty is False
-        and "worksheet3" in locals()
-    ):
-        worksheet3.set_column("A:A", None, None, {"hidden": True})
-        worksheet3.hide_gridlines(2)
-        worksheet3.set_portrait()
-        worksheet3.center_horizontally()
-        worksheet3.center_vertically()
-        worksheet3.print_area("B1:Q56")  # Cells B1 to Q27.
-        worksheet3.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+    ]
+
+
+@renderer("html")
+def render_html(sheets: dict, late_signoff_sheets: dict, report_stem: Path) -> list:
+    """
+    Write the report as an HTML fragment to inline in the email body.
+    """
+    # Only the description level of the crosstab index is shown, like the
+    # workbook where the order column is hidden
+    tables = [
+        frame_to_html(sheet_name, df.droplevel(0), True)
+        for sheet_name, df in sheets.items()
+    ] + [
+        frame_to_html(
+            sheet_name, df.reset_index(drop=True).set_index(df.columns[0]), False
         )
-        worksheet3.set_print_scale(80)
-        worksheet3.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet3.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "crosstab_cab_req_comps" in locals()
-        and crosstab_cab_req_comps.empty is False
-        and "worksheet4" in locals()
-    ):
-        worksheet4.set_column("A:A", None, None, {"hidden": True})
-        worksheet4.hide_gridlines(2)
-        worksheet4.set_portrait()
-        worksheet4.center_horizontally()
-        worksheet4.center_vertically()
-        worksheet4.print_area("B1:Q56")  # Cells B1 to Q27.
-        worksheet4.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+        for sheet_name, df in late_signoff_sheets.items()
+    ]
+    html_path = report_stem.with_name(report_stem.name + ".html")
+    html_path.write_text("\n".join(tables), encoding="utf-8")
+    return [html_path]
+
+
+@renderer("csv")
+def render_csv(sheets: dict, late_signoff_sheets: dict, report_stem: Path) -> list:
+    """
+    Write each sheet of the report to its own CSV file.
+    """
+    paths = []
+    for sheet_name, df in {**sheets, **late_signoff_sheets}.items():
+        csv_path = report_stem.with_name(f"{report_stem.name}_{sheet_name}.csv")
+        df.to_csv(csv_path)
+        paths.append(csv_path)
+    return paths
+
+
+@renderer("parquet")
+def render_parquet(sheets: dict, late_signoff_sheets: dict, report_stem: Path) -> list:
+    """
+    Write each sheet of the report to its own Parquet file.
+    """
+    # Needs pyarrow, the same optional dependency cls_loader uses for snapshots
+    paths = []
+    for sheet_name, df in {**sheets, **late_signoff_sheets}.items():
+        parquet_path = report_stem.with_name(f"{report_stem.name}_{sheet_name}.parquet")
+        df.to_parquet(parquet_path)
+        paths.append(parquet_path)
+    return paths
+
+
+def render_stage(
+    sheets: dict,
+    late_signoff_sheets: dict,
+    report_stem: Path,
+    output_formats: list = None,
+):
+    """
+    Write the non-empty sheets of the report in every requested format.
+
+    Args:
+        sheets (dict): Crosstab sheet name -> DataFrame from crosstab_stage.
+        late_signoff_sheets (dict): Late_SignOffs sheet name -> DataFrame.
+        report_stem (Path): Path of the report files without a suffix.
+        output_formats (list, optional): Names from RENDERERS. Defaults to
+            OUTPUT_FORMATS.
+
+    Returns:
+        dict: Format -> list of files written, or None when every sheet is
+        empty and nothing was written.
+    """
+    output_formats = output_formats or OUTPUT_FORMATS
+    unknown = [name for name in output_formats if name not in RENDERERS]
+    if unknown:
+        raise ValueError(
+            f"Unknown output format(s) {unknown}, expected one of {list(RENDERERS)}"
         )
-        worksheet4.set_print_scale(80)
-        worksheet4.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet4.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "cab_checklist_summary" in locals()
-        and cab_checklist_summary.empty is False
-        and "worksheet5" in locals()
-    ):
-        worksheet5.set_column("A:A", None, None, {"hidden": True})
-        worksheet5.hide_gridlines(2)
-        worksheet5.set_portrait()
-        worksheet5.center_horizontally()
-        worksheet5.center_vertically()
-        worksheet5.print_area("B1:Q56")  # Cells B1 to Q27.
-        worksheet5.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+
+    # Check each DataFrame and print whether it is empty
+    for sheet_name, df in sheets.items():
+        print(f"{sheet_name}: {df.empty is False}")
+    for sheet_name, late_df in late_signoff_sheets.items():
+        print(f"{sheet_name}: {late_df.empty is False} ({len(late_df)} late sign-offs)")
+
+    sheets = {name: df for name, df in sheets.items() if df.empty is False}
+    late_signoff_sheets = {
+        name: df for name, df in late_signoff_sheets.items() if df.empty is False
+    }
+
+    # Only write the report if there is data to write
+    if not sheets and not late_signoff_sheets:
+        return None
+
+    report_stem.parent.mkdir(parents=True, exist_ok=True)
+    return {
+        name: RENDERERS[name](sheets, late_signoff_sheets, report_stem)
+        for name in output_formats
+    }
+
+
+def deliver_stage(
+    email_addresses: pd.DataFrame,
+    outputs: dict,
+    definition: dict,
+    skip_recipients: set = None,
+    status_callback=None,
+) -> list:
+    """
+    Write the contact list of a report and email the report to it.
+
+    Args:
+        email_addresses (pd.DataFrame): Rows of cls_email_addresses.txt.
+        outputs (dict): Format -> files from render_stage, or None to skip
+            sending. HTML output is inlined in the body, the rest is attached.
+        definition (dict): Entry of REPORT_DEFINITIONS.
+        skip_recipients (set, optional): Addresses that already got the report.
+        status_callback (optional): Called with each recipient's send status.
+
+    Returns:
+        list: One send status dict per recipient mailed.
+
+    Raises:
+        ValueError: If the report has a plant and no contact matches it.
+    """
+    # Filtering on the report code of this report, and its plant if it has one
+    email_addresses = email_addresses.loc[
+        email_addresses["Report_code"] == definition["report_code"]
+    ].dropna()
+    plant = definition["plant"]
+    if plant is not None:
+        plant = plant.strip()
+        email_addresses = email_addresses.loc[
+            email_addresses["Plant"].str.strip() == plant
+        ]
+        if email_addresses.empty:
+            raise ValueError(
+                f"No contacts with plant {plant!r} and report code "
+                f"{definition['report_code']!r} in cls_email_addresses.txt"
+            )
+
+    # Add 'First_Name' column, select and reorder columns, then export directly
+    email_addresses = email_addresses.assign(
+        First_Name=email_addresses["Email_address"].str.split(".", n=1).str[0]
+    )[["First_Name", "Email_address"]]
+
+    # Export to a txt file with the specified format
+    email_addresses.to_csv(
+        definition["contacts_file"], index=False, sep="\t", header=None
+    )
+
+    # calling email function from email_func_multiple.py
+    # if outputs is not None:
+    #     main(
+    #         "mycontacts_rac_test.txt",
+    #         "templates\\message_rac_unit_eol_crosstab.html",
+    #         "Racine Unit End Of Line Report",
+    #         "RAC_Unit_EOL_Report_",
+    #         "\\Reports\\",
+    #         r"\\s1racft1\ftp\PAS\CLS\cls_unit_checklist_details.txt",
+    #     )  # used for testing
+
+    # If any DataFrame exists and is not empty, run the main function
+    statuses = []
+    if outputs is not None:
+        attachments = [
+            str(path)
+            for name, paths in outputs.items()
+            if name != "html"
+            for path in paths
+        ]
+        report_tables = "\n".join(
+            path.read_text(encoding="utf-8") for path in outputs.get("html", [])
         )
-        worksheet5.set_print_scale(80)
-        worksheet5.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet5.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "unit_checklist_summary" in locals()
-        and unit_checklist_summary.empty is False
-        and "worksheet6" in locals()
-    ):
-        worksheet6.set_column("A:A", None, None, {"hidden": True})
-        worksheet6.hide_gridlines(2)
-        worksheet6.set_portrait()
-        worksheet6.center_horizontally()
-        worksheet6.center_vertically()
-        worksheet6.print_area("B1:Q56")  # Cells B1 to Q27.
-        worksheet6.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+        statuses = main(
+            definition["contacts_file"],
+            "templates\\message_rac_unit_eol_crosstab.html",
+            definition["subject"],
+            definition["report_prefix"],
+            "\\Racine\\Reports\\",
+            r"\\s1racft1\ftp\PAS\CLS\cls_unit_checklist_details.txt",
+            attachments=attachments,
+            template_fields={"REPORT_TABLES": report_tables},
+            single_envelope=SINGLE_ENVELOPE,
+            compression=ATTACHMENT_COMPRESSION,
+            max_attachment_mb=ATTACHMENT_BUDGET_MB,
+            skip_recipients=skip_recipients,
+            status_callback=status_callback,
+        )  # used for production
+    else:
+        print("No DataFrames exist or all are empty. Skipping main function.")
+    return statuses
+
+
+def sheets_stage(name: str, definition: dict, data_frames: dict) -> tuple:
+    """
+    Filter the extracts to one report's units and build its sheets.
+
+    Args:
+        name (str): Key of the report in REPORT_DEFINITIONS.
+        definition (dict): Entry of REPORT_DEFINITIONS.
+        data_frames (dict): Output of load_stage or a day of partition_by_day.
+
+    Returns:
+        tuple: Crosstab sheet name -> DataFrame, and Late_SignOffs sheet
+        name -> DataFrame.
+    """
+    with measure(f"{name}/filter") as step:
+        filtered = filter_stage(data_frames, definition["plant"])
+        step["rows_out"] = len(filtered["unit_status"])
+
+    with measure(f"{name}/late_signoff", rows_in=len(filtered["unit_status"])) as step:
+        unit_status, late_signoff_sheets = late_signoff_stage(filtered["unit_status"])
+        step["rows_out"] = sum(len(df) for df in late_signoff_sheets.values())
+
+    with measure(f"{name}/crosstab") as step:
+        sheets = crosstab_stage(
+            unit_status,
+            filtered["req_comps"],
+            filtered["unit_checklist_summary"],
         )
-        worksheet6.set_print_scale(80)
-        worksheet6.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet6.set_footer("&L&F&C&D&R&P")
-
-    if (
-        "invalid_rows_df" in locals()
-        and invalid_rows_df.empty is False
-        and "worksheet7" in locals()
+        step["rows_out"] = sum(len(df) for df in sheets.values())
+    return sheets, late_signoff_sheets
+
+
+def record_outputs(report_prefix: str, outputs: dict, sheet_names: list):
+    """Record written report files in the manifest and drop reports past retention."""
+    record_report(REPORTS_DIR, report_prefix, outputs, sheet_names)
+    prune_reports(REPORTS_DIR, report_prefix, keep_days=REPORT_RETENTION_DAYS)
+
+
+def _written_sheets(sheets: dict, late_signoff_sheets: dict) -> list:
+    """Return the names of the sheets render_stage writes."""
+    return [
+        sheet_name
+        for sheet_name, df in {**sheets, **late_signoff_sheets}.items()
+        if not df.empty
+    ]
+
+
+def build_report(
+    name: str,
+    definition: dict,
+    data_frames: dict,
+    checkpoint: RunCheckpoint,
+    send: bool = True,
+    output_formats=None,
+) -> dict:
+    """
+    Build one report from the loaded extracts and email it.
+
+    Args:
+        name (str): Key of the report in REPORT_DEFINITIONS.
+        definition (dict): Entry of REPORT_DEFINITIONS.
+        data_frames (dict): Output of load_stage, shared by all reports.
+        checkpoint (RunCheckpoint): Checkpoint of the run.
+        send (bool, optional): Email the report once it is written.
+        output_formats (list, optional): Names from RENDERERS.
+
+    Returns:
+        dict: Format -> files written, or None if there was no data.
+    """
+    report_prefix = definition["report_prefix"]
+
+    if checkpoint.done(f"{name}.crosstab"):
+        with measure(f"{name}/crosstab/checkpoint"):
+            sheets, late_signoff_sheets = checkpoint.load(f"{name}.crosstab")
+    else:
+        sheets, late_signoff_sheets = sheets_stage(name, definition, data_frames)
+        checkpoint.save(f"{name}.crosstab", (sheets, late_signoff_sheets))
+
+    # A written report is reused as long as its files are still there
+    outputs = (
+        checkpoint.load(f"{name}.render") if checkpoint.done(f"{name}.render") else None
+    )
+    if outputs is not None and not all(
+        Path(path).exists() for paths in outputs.values() for path in paths
     ):
-        worksheet7.set_column("A:A", None, None, {"hidden": True})
-        worksheet7.hide_gridlines(2)
-        worksheet7.set_landscape()
-        worksheet7.center_horizontally()
-        worksheet7.center_vertically()
-        worksheet7.print_area("B1:K20")  # Cells B1 to Q27.
-        worksheet7.set_header(
-            "&L&G",
-            {
-                "image_left": r"C:\Users\A0313FC\OneDrive - CNH Industrial\Desktop\Python\Wichita\cnh_thumbnail.png"
-            },
+        checkpoint.discard(f"{name}.render")
+    if not checkpoint.done(f"{name}.render"):
+        # create a todays date/time variable to use in naming the files
+        todays_date = datetime.now().strftime("%Y-%m-%d_%H_%M")
+        with measure(f"{name}/render"):
+            outputs = render_stage(
+                sheets,
+                late_signoff_sheets,
+                REPORTS_DIR / (report_prefix + todays_date),
+                output_formats,
+            )
+
+        # Record the run in the reports manifest and drop reports past retention
+        if outputs is not None:
+            record_outputs(
+                report_prefix, outputs, _written_sheets(sheets, late_signoff_sheets)
+            )
+        checkpoint.save(f"{name}.render", outputs)
+
+    if send:
+        # Every send status is saved as it happens, so a retry only mails
+        # the contacts that did not get the report yet
+        with measure(f"{name}/deliver") as step:
+            statuses = deliver_stage(
+                data_frames["cls_email_addresses.txt"],
+                outputs,
+                definition,
+                skip_recipients=checkpoint.handled_recipients(name),
+                status_callback=partial(checkpoint.record_status, scope=name),
+            )
+
+            # Attachments left out for the budget go in the run's metrics too
+            skipped = sorted(
+                {file for s in statuses for file in s.get("skipped_attachments", [])}
+            )
+            if skipped:
+                step["skipped_attachments"] = skipped
+                print(
+                    f"Warning: report {name} was emailed without {skipped}, "
+                    f"they did not fit the attachment budget."
+                )
+        failed = [s["email"] for s in statuses if s["status"] == "failed"]
+        if failed:
+            raise RuntimeError(
+                f"Could not email the report to {len(failed)} recipients: {failed}"
+            )
+    return outputs
+
+
+def run_report(
+    report_date: date = None,
+    send: bool = True,
+    output_formats=None,
+    definitions: dict = None,
+    run_id: str = None,
+) -> dict:
+    """
+    Build the unit end of line reports and email them.
+
+    The extracts are loaded once and every report in definitions is built
+    from the same frames. A report that fails does not stop the others.
+
+    The loaded frames, the crosstabs, the written reports and every send
+    status are checkpointed, so a retry after a failure resumes from the
+    last completed stage and only mails the contacts that were missed. Only
+    a retry that passes the same run_id resumes; any other run loads the
+    current extracts. Raises RuntimeError if a report failed or some
+    contacts could not be reached.
+
+    Args:
+        report_date (date, optional): Day the report covers. Defaults to today.
+        send (bool, optional): Email the reports once they are written.
+            Defaults to True.
+        output_formats (list, optional): Names from RENDERERS. Defaults to
+            OUTPUT_FORMATS.
+        definitions (dict, optional): Reports to build. Defaults to
+            REPORT_DEFINITIONS.
+        run_id (str, optional): Shared by the attempts of one scheduled run.
+            Defaults to a new run.
+
+    Returns:
+        dict: Report name -> format -> files written, or None for a report
+        with no data.
+    """
+    date_refs = get_date_refs(report_date)
+    definitions = REPORT_DEFINITIONS if definitions is None else definitions
+
+    # Print date references for verification
+    for name, date_val in date_refs.items():
+        print(f"{name.capitalize()} : {date_val}")
+
+    # A retry of a failed attempt of the same run resumes from its last stage
+    run_id = run_id or datetime.now().strftime("%H%M%S")
+    checkpoint = RunCheckpoint(
+        "RAC_Unit_EOL_Crosstab", f"{date_refs['today'].isoformat()}_{run_id}"
+    )
+
+    # Time every stage and write the run's metrics to the log when it ends
+    with RunMetrics("RAC_Unit_EOL_Crosstab"):
+        if checkpoint.done("load"):
+            with measure("load/checkpoint"):
+                data_frames = checkpoint.load("load")
+        else:
+            with measure("load") as step:
+                data_frames = load_stage(date_refs)
+                step["rows_out"] = sum(len(df) for df in data_frames.values())
+            checkpoint.save("load", data_frames)
+
+        results, errors = {}, {}
+        for name, definition in definitions.items():
+            try:
+                results[name] = build_report(
+                    name, definition, data_frames, checkpoint, send, output_formats
+                )
+            except Exception as e:
+                print(f"Error: report {name} failed: {e!r}")
+                errors[name] = e
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} of {len(definitions)} reports failed: {errors}"
+            )
+
+    checkpoint.complete()
+    return results
+
+
+def backfill_prefix(definition: dict) -> str:
+    """Return the file and manifest prefix of a report's backfilled days."""
+    return f"{definition['report_prefix']}backfill_"
+
+
+def _backfill_day(
+    day_frames: dict, definitions: dict, report_stems: dict, output_formats
+) -> dict:
+    """
+    Build and write the reports of one backfilled day, in a pool process.
+
+    Returns:
+        dict: Report name -> (format -> files written, names of the sheets
+        written), or None for a report with no data.
+    """
+    results = {}
+    for name, definition in definitions.items():
+        sheets, late_signoff_sheets = sheets_stage(name, definition, day_frames)
+        outputs = render_stage(
+            sheets, late_signoff_sheets, report_stems[name], output_formats
         )
-        worksheet7.set_print_scale(65)
-        worksheet7.set_margins(left=0.45, right=0.45, top=0.75, bottom=0.25)
-        worksheet7.set_footer("&L&F&C&D&R&P")
-
-    # Close the Pandas Excel writer and output the Excel file.
-    writer.close()
-
-# change the directory back to the main past dues folder
-os.chdir(current_dir)
-
-# calling email function from email_func_multiple.py
-# if run_main:
-#     main(
-#         "mycontacts_rac_test.txt",
-#         "templates\\message_rac_unit_eol_crosstab.html",
-#         "Racine Unit End Of Line Report",
-#         "RAC_Unit_EOL_Report_",
-#         "\\Reports\\",
-#         r"\\s1racft1\ftp\PAS\CLS\cls_unit_checklist_details.txt",
-#     )  # used for testing
-# else:
-#     print("No DataFrames exist or all are empty. Skipping main function.")
-
-# If any DataFrame exists and is not empty, run the main function
-if run_main:
-    main(
-        "mycontacts_rac_unit_eol_crosstab.txt",
-        "templates\\message_rac_unit_eol_crosstab.html",
-        "Racine Unit End Of Line Report",
-        "RAC_Unit_EOL_Report_",
-        "\\Racine\\Reports\\",
-        r"\\s1racft1\ftp\PAS\CLS\cls_unit_checklist_details.txt",
-    )  # used for production
-else:
-    print("No DataFrames exist or all are empty. Skipping main function.")
+        results[name] = None
+        if outputs is not None:
+            results[name] = outputs, _written_sheets(sheets, late_signoff_sheets)
+    return results
+
+
+def backfill_reports(
+    first: date,
+    last: date = None,
+    output_formats=None,
+    definitions: dict = None,
+    workers: int = None,
+) -> dict:
+    """
+    Regenerate the reports of a past day or range of days.
+
+    The extracts are parsed once for the whole range and split by end of
+    line date, then the days are built and written in parallel across a
+    process pool, so a month takes little longer than a single load. The
+    reports are recorded in the manifest under their backfill_prefix, so
+    latest_report() of the daily prefix never returns them, and are not
+    emailed. Raises
+    RuntimeError if any day failed, after every other day was written.
+
+    Args:
+        first (date): First day to regenerate.
+        last (date, optional): Last day to regenerate. Defaults to first.
+        output_formats (list, optional): Names from RENDERERS. Defaults to
+            OUTPUT_FORMATS.
+        definitions (dict, optional): Reports to build. Defaults to
+            REPORT_DEFINITIONS.
+        workers (int, optional): Processes to build the days with. Defaults
+            to BACKFILL_WORKERS.
+
+    Returns:
+        dict: Date -> report name -> format -> files written, or None for a
+        report with no data. Days without any units are left out.
+    """
+    last = last or first
+    if last < first:
+        raise ValueError(f"Backfill range ends ({last}) before it starts ({first})")
+    definitions = REPORT_DEFINITIONS if definitions is None else definitions
+    print(f"Backfilling reports from {first} through {last}")
+
+    # The files of a backfill are named after the day they report on
+    run_time = datetime.now().strftime("%Y-%m-%d_%H_%M")
+
+    with RunMetrics("RAC_Unit_EOL_Backfill"):
+        with measure("load") as step:
+            data_frames = load_stage(get_date_refs(first), through=last)
+            step["rows_out"] = sum(len(df) for df in data_frames.values())
+
+        with measure("partition") as step:
+            days = partition_by_day(data_frames)
+            step["days"] = len(days)
+        del data_frames
+        print(f"Found units on {len(days)} day(s)")
+
+        def report_stems(day):
+            return {
+                name: REPORTS_DIR
+                / f"{backfill_prefix(definition)}{day:%Y-%m-%d}_{run_time}"
+                for name, definition in definitions.items()
+            }
+
+        results, errors = {}, {}
+        workers = min(workers or BACKFILL_WORKERS or os.cpu_count(), len(days) or 1)
+        with measure("build_days", days=len(days), workers=workers):
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    day: pool.submit(
+                        _backfill_day,
+                        day_frames,
+                        definitions,
+                        report_stems(day),
+                        output_formats,
+                    )
+                    for day, day_frames in days.items()
+                }
+                for day, future in futures.items():
+                    try:
+                        day_results = future.result()
+                    except Exception as e:
+                        print(f"Error: backfill of {day} failed: {e!r}")
+                        errors[day] = e
+                        continue
+
+                    # The manifest is only written from this process
+                    results[day] = {}
+                    for name, written in day_results.items():
+                        outputs = None
+                        if written is not None:
+                            outputs, sheet_names = written
+                            record_outputs(
+                                backfill_prefix(definitions[name]), outputs, sheet_names
+                            )
+                        results[day][name] = outputs
+                    print(f"Backfilled {day}")
+
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} of {len(days)} days failed to backfill: {errors}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--date",
+        type=date.fromisoformat,
+        help="Day to report on (YYYY-MM-DD). Defaults to today",
+    )
+    parser.add_argument(
+        "--through",
+        type=date.fromisoformat,
+        help="Backfill every day from --date through this one, without emailing",
+    )
+    parser.add_argument(
+        "--no-send", action="store_true", help="Write the report without emailing it"
+    )
+    args = parser.parse_args()
+
+    if args.through is not None:
+        if args.date is None:
+            parser.error("--through needs a --date to start from")
+        backfill_reports(args.date, args.through)
+    else:
+        run_report(args.date, send=not args.no_send)
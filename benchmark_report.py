@@ -0,0 +1,302 @@
+"""
+Report Benchmark Module
+
+This module times and memory-profiles each stage of the unit end of line
+report on synthetic extracts from cls_generator: load, filter, late sign-off,
+crosstab, Excel render and email build. Each stage is run repeat times for
+its best wall time, then once more under tracemalloc for the peak memory it
+allocates. Results can be saved as JSON and compared against a saved
+baseline; a stage that got slower or bigger than the tolerance allows is
+listed and the exit status is 1, so a regression shows up before it reaches
+the scheduled run. Nothing is sent by email.
+
+Run it with:  python benchmark_report.py [--scales 1 10 100] [--repeat 3]
+              [--save results.json] [--baseline results.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+import cls_loader
+import RAC_Unit_EOL_Crosstab as report
+from cls_generator import generate_cls_extracts
+from email_func_multiple import build_attachments, build_message, read_template
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+TEMPLATE = TEMPLATE_DIR / "message_rac_unit_eol_crosstab.html"
+
+# A stage only counts as a regression past the tolerance and these floors, so
+# timer noise on the millisecond stages is not reported
+MIN_SECONDS_CHANGE = 0.1
+MIN_MB_CHANGE = 1.0
+
+
+def _write_placeholder_png(path: Path) -> Path:
+    """Write a 1x1 white PNG, used when the report's thumbnail is not reachable."""
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"\x00\xff\xff\xff"))
+        + chunk(b"IEND", b"")
+    )
+    return path
+
+
+def _measure(func, repeat: int, setup=None) -> tuple:
+    """
+    Run func repeat times for its best wall time and once under tracemalloc.
+
+    Args:
+        func: Stage to run, without arguments.
+        repeat (int): Number of timed runs.
+        setup (optional): Called before every run, outside the timing.
+
+    Returns:
+        tuple: The stage's result, the best seconds and the peak MB allocated.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        # The stages print their progress, which is not part of the benchmark
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, best, peak / 2**20
+
+
+def build_emails(email_addresses: pd.DataFrame, attachments: list) -> list:
+    """
+    Build the report email for every contact, as deliver_stage would send it.
+
+    Args:
+        email_addresses (pd.DataFrame): Rows of cls_email_addresses.txt.
+        attachments (list): Files attached to every message.
+
+    Returns:
+        list: The message text of each contact.
+    """
+    contacts = email_addresses.loc[
+        email_addresses["Report_code"] == "UNITEOL", "Email_address"
+    ].dropna()
+    message_template = read_template(TEMPLATE)
+    parts, _ = build_attachments(
+        attachments, report.ATTACHMENT_COMPRESSION, report.ATTACHMENT_BUDGET_MB
+    )
+    return [
+        build_message(
+            "Racine Unit End Of Line Report",
+            email,
+            message_template.safe_substitute(
+                REPORT_TABLES="", PERSON_NAME=email.split(".", 1)[0].title()
+            ),
+            parts,
+        )
+        for email in contacts
+    ]
+
+
+def benchmark_scale(
+    scale: float, workdir: Path, repeat: int = 3, report_date: date = None
+) -> dict:
+    """
+    Benchmark every stage of the report on extracts of one size.
+
+    The extracts are generated under workdir once per scale and reused by
+    later runs with the same workdir. The load stage starts without a
+    snapshot every time, so it always measures a full parse.
+
+    Args:
+        scale (float): Multiple of a normal day's volume.
+        workdir (Path): Folder for the extracts, snapshots and reports.
+        repeat (int, optional): Timed runs per stage. Defaults to 3.
+        report_date (date, optional): Day the report covers. Defaults to today.
+
+    Returns:
+        dict: Stage name -> {"seconds", "peak_mb"}, plus the row counts of
+        the generated extracts under "rows".
+    """
+    report_date = report_date or date.today()
+    data_dir = workdir / f"cls_{scale:g}x_{report_date:%Y%m%d}"
+    rows_file = data_dir / "rows.json"
+    if rows_file.exists():
+        rows = json.loads(rows_file.read_text())
+    else:
+        print(f"Generating {scale:g}x extracts in {data_dir} ...")
+        rows = generate_cls_extracts(data_dir, scale, report_date)
+        rows_file.write_text(json.dumps(rows))
+
+    # Keep the snapshots away from the real ones and drop them before each load
+    snapshot_dir = workdir / "snapshots"
+    cls_loader.SNAPSHOT_DIR = snapshot_dir
+    reports_dir = workdir / "Reports"
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    if not Path(report.THUMBNAIL).exists():
+        report.THUMBNAIL = str(_write_placeholder_png(workdir / "thumbnail.png"))
+
+    date_refs = report.get_date_refs(report_date)
+    results = {}
+
+    def record(stage, func, setup=None):
+        result, seconds, peak_mb = _measure(func, repeat, setup)
+        results[stage] = {"seconds": round(seconds, 4), "peak_mb": round(peak_mb, 2)}
+        return result
+
+    data_frames = record(
+        "load",
+        lambda: report.load_stage(date_refs, data_dir),
+        setup=lambda: shutil.rmtree(snapshot_dir, ignore_errors=True),
+    )
+    filtered = record("filter", lambda: report.filter_stage(data_frames))
+    unit_status, late_signoff_sheets = record(
+        "late_signoff", lambda: report.late_signoff_stage(filtered["unit_status"])
+    )
+    sheets = record(
+        "crosstab",
+        lambda: report.crosstab_stage(
+            unit_status, filtered["req_comps"], filtered["unit_checklist_summary"]
+        ),
+    )
+    report_files = record(
+        "excel_render",
+        lambda: report.render_xlsx(
+            sheets, late_signoff_sheets, reports_dir / f"benchmark_{scale:g}x"
+        ),
+    )
+    record(
+        "email_build",
+        lambda: build_emails(
+            data_frames["cls_email_addresses.txt"],
+            [str(path) for path in report_files]
+            + [str(data_dir / "cls_unit_checklist_details.txt")],
+        ),
+    )
+
+    results["rows"] = rows
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare benchmark results with a baseline.
+
+    Args:
+        results (dict): Scale -> stage results from benchmark_scale.
+        baseline (dict): The same structure from an earlier run.
+        tolerance (float): Allowed relative increase, e.g. 0.25 for 25%.
+
+    Returns:
+        list: One message per stage and measure that regressed.
+    """
+    floors = {"seconds": MIN_SECONDS_CHANGE, "peak_mb": MIN_MB_CHANGE}
+    regressions = []
+    for scale, stages in results.items():
+        for stage, measures in stages.items():
+            before = baseline.get(scale, {}).get(stage)
+            if stage == "rows" or before is None:
+                continue
+            for measure, floor in floors.items():
+                old, new = before[measure], measures[measure]
+                if new > old * (1 + tolerance) and new - old > floor:
+                    regressions.append(
+                        f"{scale}x {stage} {measure}: {old} -> {new} "
+                        f"(+{(new - old) / old:.0%})"
+                    )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="Folder to keep the generated extracts in between runs",
+    )
+    parser.add_argument("--save", type=Path, help="Write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="Compare with these results")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="rac_benchmark_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    try:
+        for scale in args.scales:
+            stages = benchmark_scale(scale, workdir, args.repeat)
+            results[f"{scale:g}"] = stages
+            table = pd.DataFrame(
+                {stage: v for stage, v in stages.items() if stage != "rows"}
+            ).T
+            # The stages run one after another, so their peaks do not add up
+            table.loc["total"] = [table["seconds"].sum(), table["peak_mb"].max()]
+            print(
+                f"\n{scale:g}x ({stages['rows']['cls_unit_status.txt']} unit status rows)"
+            )
+            print(table.to_string())
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {
+                    "created": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "render_mode": report.RENDER_MODE,
+                    "results": results,
+                },
+                indent=1,
+            )
+        )
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Synthetic CLS Extract Generator Module
+
+This module writes made-up but realistic copies of the CLS extracts the
+reports read from the Alstar share: cls_unit_status.txt, cls_req_comps.txt,
+cls_unit_checklist_summary.txt, cls_unit_checklist_details.txt and
+cls_email_addresses.txt. The files use the real pipe-delimited layout,
+station, component and check lists, serial number prefixes and date formats,
+so the report pipeline can be run and benchmarked without the production
+share. scale multiplies the number of units built per day; 1 is a normal
+day, 10 and 100 are stress sizes. The output is the same for the same seed.
+
+Run it on its own with:  python cls_generator.py <folder> [scale] [YYYY-MM-DD]
+"""
+
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+from RAC_Unit_EOL_Crosstab import CONFIG_FILE, LATE_SIGNOFF_GATES
+from report_config import current_config
+
+# Units built on a normal day, and the days either side of the report date the
+# extracts hold (the share keeps the last few days of history)
+UNITS_PER_DAY = 60
+DAYS_BEFORE = 4
+DAYS_AFTER = 1
+
+# One in every CAB_EVERY units is a cab built for stock, the rest are tractors
+CAB_EVERY = 3
+
+# Serial number prefixes, the crosstabs drop the first 5 characters
+TRACTOR_PREFIX = "ZERF0"
+CAB_PREFIX = "HCAB2"
+
+# Stations on the line that the report does not show, so the row filters have
+# something to drop
+OTHER_STATIONS = [f"ASSEMBLY STATION {n:02d}" for n in range(1, 21)]
+
+# Components scanned on every unit besides the ones with a Display_order
+# override in the report's config
+COMPONENTS = [
+    "Engine",
+    "Transmission",
+    "Front Axle",
+    "Rear Axle",
+    "Hydraulic Pump",
+    "Cab",
+    "ROPS",
+    "Radiator",
+]
+
+# Checks on the units' checklists that no report sheet includes
+OTHER_CHECKS = ["TORQUE AUDIT", "PAINT AUDIT", "LABEL AUDIT"]
+
+FIRST_NAMES = ["JOHN", "JANE", "RICK", "MARIA", "LUIS", "ANNA", "MIKE", "SARA"]
+LAST_NAMES = ["SMITH", "DOE", "ROE", "NOWAK", "GARCIA", "MILLER", "LEE", "BROWN"]
+
+# Share of the sign-offs recorded late (after the unit passed the gate) and
+# share of the stations skipped on completed units
+LATE_RATE = 0.03
+MISSING_RATE = 0.02
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _stations() -> list:
+    """
+    Return (order, number, description, zone) for every station on the line.
+
+    The report's stations keep their order with UNIT BUILT on the first late
+    sign-off gate, the other stations are spread between them.
+    """
+    reported = sorted(current_config(CONFIG_FILE).work_stations)
+    # UNIT BUILT and the stations after it in the line follow the gate
+    after_gate = [
+        "FINAL Quality Gate 2",
+        "Hood & Model Decals",
+        "QAA - Susp Axle Calibrtn",
+        "Trans Oil Level Check",
+        "Wash Tractor Complete",
+        "CAB WATER TEST",
+    ]
+    before_gate = [
+        s for s in reported if s not in after_gate and s != "UNIT BUILT"
+    ] + OTHER_STATIONS
+    random.Random(0).shuffle(before_gate)
+
+    gate = LATE_SIGNOFF_GATES[0]
+    line = before_gate + ["UNIT BUILT"] + after_gate
+    first_order = gate - 2 * len(before_gate)
+    stations = []
+    for i, description in enumerate(line):
+        order = first_order + 2 * i
+        zone = 1 + i * 3 // len(line)
+        stations.append((order, order * 10, description, zone))
+    return stations
+
+
+def _date_text(value: datetime, padding: str = " ") -> str:
+    """Format a date the way the extract does, with its trailing padding."""
+    return "" if value is None else value.strftime(DATE_FORMAT) + padding
+
+
+def _units(report_date: date, scale: float, rng: random.Random) -> list:
+    """Return (serial, sequence, end of line datetime) for every unit."""
+    per_day = max(1, round(UNITS_PER_DAY * scale))
+    units = []
+    sequence = 100000
+    for day_offset in range(-DAYS_BEFORE, DAYS_AFTER + 1):
+        day = report_date + timedelta(days=day_offset)
+        start = datetime.combine(day, time(6, 0))
+        # End of line times are spread over two 8 hour shifts
+        step = timedelta(hours=16) / per_day
+        for n in range(per_day):
+            sequence += 1
+            prefix = CAB_PREFIX if sequence % CAB_EVERY == 0 else TRACTOR_PREFIX
+            serial = f"{prefix}{sequence % 100000:05d}"
+            units.append((serial, sequence, start + step * n))
+    rng.shuffle(units)
+    return units
+
+
+def _write(path: Path, rows) -> int:
+    """Write pipe-delimited rows to path, returning the number of rows."""
+    count = 0
+    with open(path, "w", encoding="latin1", newline="\n") as f:
+        for row in rows:
+            f.write("|".join(row) + "\n")
+            count += 1
+    return count
+
+
+def generate_cls_extracts(
+    directory: Path,
+    scale: float = 1,
+    report_date: date = None,
+    report_time: time = time(15, 35),
+    seed: int = 0,
+) -> dict:
+    """
+    Write a synthetic set of CLS extracts to a folder.
+
+    Units finishing after report_time on the report date are still on the
+    line, so only the stations they have already reached are signed off.
+
+    Args:
+        directory (Path): Folder to write the extracts to, created if needed.
+        scale (float, optional): Multiple of a normal day's volume.
+            Defaults to 1.
+        report_date (date, optional): Day the report will cover. Defaults to
+            today.
+        report_time (time, optional): Time the report runs. Defaults to 15:35.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict: File name -> number of rows written.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    report_date = report_date or date.today()
+    report_moment = datetime.combine(report_date, report_time)
+    rng = random.Random(seed)
+
+    config = current_config(CONFIG_FILE)
+    components = COMPONENTS + list(config.display_orders)
+    stations = _stations()
+    gate_position = next(
+        i for i, station in enumerate(stations) if station[0] == LATE_SIGNOFF_GATES[0]
+    )
+    employees = [
+        (str(rng.randint(10000, 99999)), f"{last}, {first}")
+        for last in LAST_NAMES
+        for first in FIRST_NAMES
+    ]
+    units = _units(report_date, scale, rng)
+
+    def unit_status_rows():
+        for serial, sequence, end_of_line in units:
+            set_date = _date_text(end_of_line - timedelta(days=1), "  ")
+            complete = end_of_line <= report_moment
+            prefix = [
+                "RAC",
+                serial,
+                str(sequence),
+                set_date,
+                _date_text(end_of_line),
+                _date_text(end_of_line + timedelta(hours=2)) if complete else "",
+                "1",
+                "MAIN LINE",
+            ]
+            # Stations are reached at a steady pace until end of line
+            built = end_of_line - timedelta(minutes=30)
+            pace = timedelta(hours=8) / len(stations)
+            for position, (order, number, description, zone) in enumerate(stations):
+                reached = built - pace * (gate_position - position)
+                signed = reached <= report_moment and rng.random() >= MISSING_RATE
+                if signed and position < gate_position and rng.random() < LATE_RATE:
+                    reached = built + timedelta(minutes=rng.randint(5, 90))
+                if position == gate_position:
+                    signed = built <= report_moment
+                clock, name = rng.choice(employees) if signed else ("", "")
+                yield prefix + [
+                    str(zone),
+                    f"ZONE {zone}",
+                    str(order),
+                    str(number),
+                    description,
+                    clock,
+                    name,
+                    _date_text(reached) if signed else " ",
+                ]
+
+    def req_comps_rows():
+        for serial, sequence, end_of_line in units:
+            for display_order, description in enumerate(components, start=1):
+                scanned = (
+                    end_of_line <= report_moment or rng.random() < 0.5
+                ) and rng.random() >= MISSING_RATE
+                component_serial = f"{rng.randint(0, 99999999):08d}" if scanned else " "
+                yield [
+                    "RAC",
+                    serial,
+                    str(sequence),
+                    "1",
+                    f"C{display_order:03d}",
+                    description,
+                    str(display_order),
+                    component_serial,
+                ]
+
+    def checklist_rows(with_details: bool):
+        for serial, sequence, end_of_line in units:
+            # The summary and the details draw the same statuses for a unit
+            unit_rng = random.Random(seed * 1_000_003 + sequence)
+            family = "Cab" if serial.startswith(CAB_PREFIX) else "Tractor"
+            checks = config.families[family]["checks"]
+            for item_order, description in enumerate(checks + OTHER_CHECKS, start=1):
+                done = (
+                    end_of_line <= report_moment or unit_rng.random() < 0.5
+                ) and unit_rng.random() >= MISSING_RATE
+                row = [
+                    serial,
+                    "7",
+                    str(item_order),
+                    str(item_order),
+                    str(40 + item_order % 12),
+                    f"WS{item_order % 12:02d}",
+                    description,
+                    "1" if done else "0",
+                ]
+                if with_details:
+                    clock, name = unit_rng.choice(employees) if done else ("", "")
+                    row += [
+                        clock,
+                        name,
+                        _date_text(end_of_line - timedelta(hours=1)) if done else " ",
+                    ]
+                yield row
+
+    def email_rows():
+        for last in LAST_NAMES:
+            first = FIRST_NAMES[len(last) % len(FIRST_NAMES)]
+            yield ["RAC", "UNITEOL", f"{first.lower()}.{last.lower()}@cnhind.com"]
+        yield ["RAC", "OTHER", "other.report@cnhind.com"]
+        yield ["WIC", "UNITEOL", "other.plant@cnhind.com"]
+
+    return {
+        "cls_unit_status.txt": _write(
+            directory / "cls_unit_status.txt", unit_status_rows()
+        ),
+        "cls_req_comps.txt": _write(directory / "cls_req_comps.txt", req_comps_rows()),
+        "cls_unit_checklist_summary.txt": _write(
+            directory / "cls_unit_checklist_summary.txt", checklist_rows(False)
+        ),
+        "cls_unit_checklist_details.txt": _write(
+            directory / "cls_unit_checklist_details.txt", checklist_rows(True)
+        ),
+        "cls_email_addresses.txt": _write(
+            directory / "cls_email_addresses.txt", email_rows()
+        ),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python cls_generator.py <folder> [scale] [YYYY-MM-DD]")
+        sys.exit(1)
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    report_date = date.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else None
+    rows = generate_cls_extracts(sys.argv[1], scale, report_date)
+    for file_name, count in rows.items():
+        print(f"{file_name}: {count} rows")
@@ -0,0 +1,781 @@
+"""
+CLS Extract Loader Module
+
+This module loads the pipe-delimited CLS extracts published to the Alstar
+share. Each parsed extract is kept as a local columnar snapshot keyed on the
+source path, size and modification time, so reruns and retries against an
+unchanged file skip the text parsing completely. Large extracts can be
+streamed in chunks through a RowFilter so only the rows a report needs are
+ever held in memory. Columns are typed from COLUMN_DTYPES and DATE_FORMATS
+rather than inferred, and memory_report shows the footprint of each frame
+and any drift between the extracts and that schema. load_datasets fetches
+several extracts concurrently, since each one is a separate read over SMB.
+"""
+
+import hashlib
+import io
+import json
+import os
+import pandas as pd
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from run_metrics import measure
+
+try:
+    import pyarrow  # noqa: F401  (needed by pandas for Feather and Arrow strings)
+
+    SNAPSHOT_FORMAT = "feather"
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    SNAPSHOT_FORMAT = "pickle"
+    STRING_DTYPE = "string"
+
+# Define constants for file locations and column names
+CURRENT_DIR = Path.cwd()
+PROD_DIR = Path(r"\\s1racft1\ftp\PAS\CLS")
+SNAPSHOT_DIR = CURRENT_DIR / "temp" / "cls_snapshots"
+
+# Column name definitions
+COLUMN_NAMES = {
+    "cls_unit_status.txt": [
+        "Plant_code",
+        "Unit_serial_number",
+        "Sequence",
+        "Unit_set_date",
+        "Unit_end_of_line_date",
+        "Unit_complete_date",
+        "Assembly_line_number",
+        "Assembly_line_description",
+        "Zone_number",
+        "Zone_description",
+        "Work_station_order",
+        "Work_station_number",
+        "Work_station_description",
+        "Employee_clock_number",
+        "Employee_name",
+        "Validation_date",
+    ],
+    "cls_req_comps.txt": [
+        "Plant_code",
+        "Unit_serial_number",
+        "Alstar_seq",
+        "Assembly_line_number",
+        "Component_code",
+        "Component_descp",
+        "Display_order",
+        "Component_serial_number",
+    ],
+    "cls_unit_checklist_summary.txt": [
+        "Unit_serial_number",
+        "Checklist_id",
+        "Checklist_item_id",
+        "Item_order",
+        "Workstation_id",
+        "Workstation_name",
+        "Check_description",
+        "Status",
+    ],
+    "cls_email_addresses.txt": ["Plant", "Report_code", "Email_address"],
+}
+
+
+# Column dtypes per file. Repetitive text is categorical, codes and orders are
+# nullable 32-bit integers, and serial numbers are Arrow-backed strings when
+# pyarrow is available. Columns not listed keep pandas' inferred dtype.
+COLUMN_DTYPES = {
+    "cls_unit_status.txt": {
+        "Plant_code": "category",
+        "Unit_serial_number": STRING_DTYPE,
+        "Sequence": "Int32",
+        "Assembly_line_number": "category",
+        "Assembly_line_description": "category",
+        "Zone_number": "category",
+        "Zone_description": "category",
+        "Work_station_order": "Int32",
+        "Work_station_number": "Int32",
+        "Work_station_description": "category",
+        "Employee_clock_number": "category",
+        "Employee_name": "category",
+    },
+    "cls_req_comps.txt": {
+        "Plant_code": "category",
+        "Unit_serial_number": STRING_DTYPE,
+        "Alstar_seq": "Int32",
+        "Assembly_line_number": "category",
+        "Component_code": "category",
+        "Component_descp": "category",
+        "Display_order": "Int32",
+    },
+    "cls_unit_checklist_summary.txt": {
+        "Unit_serial_number": STRING_DTYPE,
+        "Checklist_id": "Int32",
+        "Checklist_item_id": "Int32",
+        "Item_order": "Int32",
+        "Workstation_id": "Int32",
+        "Workstation_name": "category",
+        "Check_description": "category",
+    },
+    "cls_email_addresses.txt": {
+        "Plant": "category",
+        "Report_code": "category",
+        "Email_address": STRING_DTYPE,
+    },
+}
+
+# Fixed formats of the date columns. Values that do not match are parsed with
+# format inference instead and reported, so a format change in the extract
+# shows up in the log rather than as silently missing dates.
+DATE_FORMATS = {
+    "cls_unit_status.txt": {
+        "Unit_set_date": "%Y-%m-%d %H:%M:%S",
+        "Unit_end_of_line_date": "%Y-%m-%d %H:%M:%S",
+        "Unit_complete_date": "%Y-%m-%d %H:%M:%S",
+        "Validation_date": "%Y-%m-%d %H:%M:%S",
+    },
+}
+
+
+class RowFilter:
+    """
+    Row predicate applied to each chunk of an extract while it is streamed.
+
+    Args:
+        isin (dict): Column name -> collection of values to keep.
+        dates (dict): Column name -> date to keep, or a (first, last) tuple
+            of dates to keep every day in between, both included. The column
+            is stripped of whitespace, parsed as a datetime and compared on
+            its date part.
+    """
+
+    def __init__(self, isin: dict = None, dates: dict = None):
+        self.isin = {column: set(values) for column, values in (isin or {}).items()}
+        self.dates = dict(dates or {})
+
+    @property
+    def key(self) -> str:
+        """Return a stable fingerprint of the filter, used to key snapshots."""
+        spec = {
+            "isin": {c: sorted(map(str, v)) for c, v in self.isin.items()},
+            "dates": {c: str(d) for c, d in self.dates.items()},
+        }
+        return hashlib.sha1(
+            json.dumps(spec, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        mask = pd.Series(True, index=df.index)
+        for column, values in self.isin.items():
+            mask &= df[column].isin(values)
+        for column, value in self.dates.items():
+            if isinstance(value, tuple):
+                first, last = (pd.Timestamp(day) for day in value)
+                mask &= _as_datetime(df[column]).dt.normalize().between(first, last)
+            else:
+                mask &= _as_datetime(df[column]).dt.date == value
+        return df[mask]
+
+
+def _as_datetime(series: pd.Series) -> pd.Series:
+    """Return a column as datetimes, parsing stripped text when needed."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series.astype(str).str.strip(), errors="coerce")
+
+
+def _parse_dates(series: pd.Series, fmt: str, column: str) -> pd.Series:
+    """
+    Parse a text column of dates with a fixed format.
+
+    Values that do not match the format are parsed with per-value inference
+    and counted in a warning, so the report keeps working when the extract
+    format drifts but the drift is visible.
+    """
+    text = series.astype("string").str.strip()
+    parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+    mismatched = parsed.isna() & text.fillna("").ne("")
+    if mismatched.any():
+        print(
+            f"Warning: {mismatched.sum()} {column} values do not match {fmt}, "
+            "inferring their format instead."
+        )
+        parsed[mismatched] = pd.to_datetime(
+            text[mismatched], format="mixed", errors="coerce"
+        )
+    return parsed
+
+
+def _apply_schema(df: pd.DataFrame, file_name: str, categorize: bool = True):
+    """
+    Convert the columns of a parsed extract to the dtypes declared for it.
+
+    A column that cannot be converted keeps its inferred dtype and is
+    reported, rather than failing the whole load.
+
+    Args:
+        df (pd.DataFrame): Parsed rows of the extract.
+        file_name (str): Name of the extract, used to look up its schema.
+        categorize (bool): Also convert the categorical columns. Chunks are
+            parsed without it and categorized once after they are combined,
+            because combining categoricals with different categories would
+            turn them back into plain objects.
+
+    Returns:
+        pd.DataFrame: The converted DataFrame.
+    """
+    converted = {}
+    for column, fmt in DATE_FORMATS.get(file_name, {}).items():
+        if column in df and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            converted[column] = _parse_dates(df[column], fmt, column)
+
+    for column, dtype in COLUMN_DTYPES.get(file_name, {}).items():
+        if column not in df or df[column].dtype == dtype:
+            continue
+        if dtype == "category" and not categorize:
+            continue
+        try:
+            converted[column] = df[column].astype(dtype)
+        except (TypeError, ValueError) as e:
+            print(
+                f"Warning: {file_name} column {column} could not be read as "
+                f"{dtype} ({e}), keeping {df[column].dtype}."
+            )
+
+    return df.assign(**converted) if converted else df
+
+
+def _schema_key(file_name: str) -> str:
+    """Return a fingerprint of the declared schema of a file, used to key snapshots."""
+    spec = [COLUMN_DTYPES.get(file_name), DATE_FORMATS.get(file_name)]
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _parse(
+    source,
+    file_name: str,
+    read_options: dict,
+    row_filter: RowFilter = None,
+    chunksize: int = None,
+    drop_last_row: bool = False,
+) -> pd.DataFrame:
+    """
+    Parse delimited text, optionally streaming it in chunks through row_filter.
+
+    With a chunksize only one chunk (plus the one held back to honour
+    drop_last_row) is in memory at a time besides the rows that survived the
+    filter, so peak memory follows the filtered result rather than the file.
+
+    Args:
+        source: Path or file-like object to parse.
+        file_name (str): Name of the extract, used to look up its schema.
+        read_options (dict): Keyword arguments for pd.read_csv.
+        row_filter (RowFilter): Predicate applied to the parsed rows.
+        chunksize (int): Number of rows to parse per chunk.
+        drop_last_row (bool): Discard the last row of the input, which is a
+            partially written line.
+
+    Returns:
+        pd.DataFrame: The parsed rows that passed the filter.
+    """
+
+    def prepare(chunk):
+        chunk = _apply_schema(chunk, file_name, categorize=False)
+        return chunk if row_filter is None else row_filter(chunk)
+
+    if chunksize is None:
+        df = pd.read_csv(source, **read_options)
+        if drop_last_row and not df.empty:
+            df = df.iloc[:-1]
+        return _apply_schema(prepare(df).reset_index(drop=True), file_name)
+
+    kept = []
+    pending = None
+    with pd.read_csv(source, chunksize=chunksize, **read_options) as reader:
+        for chunk in reader:
+            if pending is not None:
+                kept.append(prepare(pending))
+            pending = chunk
+    if pending is not None:
+        if drop_last_row:
+            pending = pending.iloc[:-1]
+        kept.append(prepare(pending))
+
+    kept = [chunk for chunk in kept if not chunk.empty]
+    if not kept:
+        return _apply_schema(pd.DataFrame(columns=read_options.get("names")), file_name)
+    return _apply_schema(pd.concat(kept, ignore_index=True), file_name)
+
+
+def _snapshot_paths(file_path: Path, variant: str) -> tuple[str, Path]:
+    """
+    Return the snapshot file stem and metadata path for a source file.
+
+    The name is derived from the source path and the parse variant (separator,
+    encoding and row filter), so the same file read differently gets its own
+    snapshot. Each write stores its data under a new name below the stem.
+    """
+    key = hashlib.sha1(f"{file_path}|{variant}".encode("utf-8")).hexdigest()
+    stem = f"{Path(file_path.name).stem}-{key[:12]}"
+    return stem, SNAPSHOT_DIR / f"{stem}.json"
+
+
+def _source_signature(file_path: Path) -> dict:
+    """Return the size and modification time that identify a source file version."""
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_snapshot_meta(file_path: Path, variant: str):
+    """Return the metadata of the stored snapshot of a source file, or None."""
+    _, meta_path = _snapshot_paths(file_path, variant)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if (
+        meta.get("source") != str(file_path)
+        or meta.get("format") != SNAPSHOT_FORMAT
+        or "data" not in meta
+        or "rows" not in meta
+    ):
+        return None
+    return meta
+
+
+def _read_snapshot(meta: dict, file_name: str):
+    """
+    Return the snapshot DataFrame that a snapshot's metadata points to.
+
+    Feather reads string[pyarrow] columns back as plain strings, so the
+    extract's schema is applied again. Returns None when the data cannot be
+    read or does not hold the number of rows the metadata recorded, so the
+    caller reloads the source in full.
+    """
+    data_path = SNAPSHOT_DIR / meta["data"]
+    try:
+        if SNAPSHOT_FORMAT == "feather":
+            df = pd.read_feather(data_path)
+        else:
+            df = pd.read_pickle(data_path)
+    except Exception as e:
+        print(f"Warning: could not read snapshot {data_path}: {e}")
+        return None
+    if len(df) != meta["rows"]:
+        print(
+            f"Warning: snapshot {data_path} holds {len(df)} rows, "
+            f"expected {meta['rows']}; ignoring it."
+        )
+        return None
+    return _apply_schema(df, file_name)
+
+
+def _write_snapshot(
+    file_path: Path,
+    variant: str,
+    signature: dict,
+    df: pd.DataFrame,
+    tail: dict = None,
+) -> None:
+    """
+    Persist a parsed DataFrame as the snapshot of its source file.
+
+    The data is written to a file of its own, named after this write, and
+    the metadata that points to it (with its row count) replaces the old
+    metadata last. Replacing the metadata is the single commit point: until
+    it succeeds, readers keep using the previous data file, which is left in
+    place, so a failed or interrupted write can never pair new data with old
+    metadata. Data files no longer referenced are removed afterwards.
+    The optional tail (offset and last-line checksum) lets a later incremental
+    load resume from the end of the rows already in the snapshot.
+    """
+    stem, meta_path = _snapshot_paths(file_path, variant)
+    # Unique per process and write, so concurrent writers never share a file
+    token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    data_name = f"{stem}.{token}.{SNAPSHOT_FORMAT}"
+    meta = {
+        "source": str(file_path),
+        "format": SNAPSHOT_FORMAT,
+        "data": data_name,
+        "rows": len(df),
+        **signature,
+    }
+    if tail is not None:
+        meta.update(tail)
+
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        if SNAPSHOT_FORMAT == "feather":
+            df.to_feather(SNAPSHOT_DIR / data_name)
+        else:
+            df.to_pickle(SNAPSHOT_DIR / data_name)
+
+        tmp_meta_path = meta_path.with_name(f"{meta_path.name}.{token}.tmp")
+        with open(tmp_meta_path, "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_meta_path, meta_path)
+    except Exception as e:
+        print(f"Warning: could not write snapshot for {file_path}: {e}")
+        for path in [
+            SNAPSHOT_DIR / data_name,
+            meta_path.with_name(f"{meta_path.name}.{token}.tmp"),
+        ]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        return
+
+    # Drop the data of earlier writes; one still open by a reader is left for later
+    for old_path in SNAPSHOT_DIR.glob(f"{stem}.*.{SNAPSHOT_FORMAT}"):
+        if old_path.name != data_name:
+            try:
+                old_path.unlink()
+            except OSError:
+                pass
+
+
+def _tail_marker(offset: int, last_line: bytes) -> dict:
+    """Return the snapshot fields that mark where the parsed rows of a file end."""
+    return {
+        "offset": offset,
+        "tail_len": len(last_line),
+        "tail_sha1": hashlib.sha1(last_line).hexdigest(),
+    }
+
+
+def _find_tail(
+    file_path: Path, size: int, block_size: int = 65536
+) -> tuple[int, bytes]:
+    """
+    Return the end offset and bytes of the last complete line of a file.
+
+    The file is scanned backwards from size, so only the last few blocks are
+    read no matter how large the file is. A file without a complete line
+    returns (0, b"").
+    """
+    data = b""
+    position = size
+    with open(file_path, "rb") as f:
+        while position > 0:
+            read_from = max(0, position - block_size)
+            f.seek(read_from)
+            data = f.read(position - read_from) + data
+            position = read_from
+            end = data.rfind(b"\n")
+            if end == -1:
+                continue
+            start = data.rfind(b"\n", 0, end)
+            if start != -1 or position == 0:
+                last_line = data[start + 1 : end + 1]
+                return position + end + 1, last_line
+    return 0, b""
+
+
+def _read_appended(
+    file_path: Path,
+    variant: str,
+    meta: dict,
+    signature: dict,
+    read_options: dict,
+    row_filter: RowFilter = None,
+    chunksize: int = None,
+):
+    """
+    Merge the rows appended to a file since its snapshot into that snapshot.
+
+    Only the bytes after the stored offset are parsed. Returns None when the
+    snapshot has no tail marker, or when the file was truncated or rotated
+    (it shrank, or the stored last line no longer matches), so the caller
+    falls back to a full reload.
+    """
+    offset = meta.get("offset")
+    tail_len = meta.get("tail_len")
+    if offset is None or tail_len is None or signature["size"] < offset:
+        return None
+
+    with open(file_path, "rb") as f:
+        f.seek(offset - tail_len)
+        last_line = f.read(tail_len)
+        if hashlib.sha1(last_line).hexdigest() != meta.get("tail_sha1"):
+            return None
+        appended = f.read(signature["size"] - offset)
+
+    # Only complete lines are consumed; a partially written row is picked up next time
+    end = appended.rfind(b"\n") + 1
+    previous = _read_snapshot(meta, file_path.name)
+    if previous is None:
+        return None
+
+    if end == 0:
+        df = previous
+    else:
+        new_rows = _parse(
+            io.BytesIO(appended[:end]),
+            file_path.name,
+            read_options,
+            row_filter,
+            chunksize,
+        )
+        if new_rows.empty:
+            df = previous
+        elif previous.empty:
+            df = new_rows
+        else:
+            # Categories of the new rows differ from the snapshot's, so re-apply them
+            df = _apply_schema(
+                pd.concat([previous, new_rows], ignore_index=True), file_path.name
+            )
+        start = appended.rfind(b"\n", 0, end - 1) + 1
+        last_line = appended[start:end]
+        print(f"Appended {len(new_rows)} new rows from {file_path.name}.")
+
+    _write_snapshot(
+        file_path, variant, signature, df, _tail_marker(offset + end, last_line)
+    )
+    return df
+
+
+def load_data(
+    file_name: str,
+    directory: Path = PROD_DIR,
+    sep: str = "|",
+    encoding: str = "latin1",
+    use_snapshot: bool = True,
+    incremental: bool = False,
+    row_filter: RowFilter = None,
+    chunksize: int = None,
+) -> pd.DataFrame:
+    """
+    Load a dataset from a specified file in a given directory.
+
+    When use_snapshot is True the parsed frame is cached under SNAPSHOT_DIR and
+    reused for as long as the source file keeps the same size and mtime.
+
+    When incremental is True the file is treated as append-only: if it grew
+    since the snapshot was taken, only the appended rows are parsed and merged
+    into the snapshot. A truncated or rotated file triggers a full reload.
+
+    When a row_filter is given only the matching rows are kept, and with a
+    chunksize the file is streamed so the unfiltered rows are never all held
+    in memory. The snapshot then holds the filtered rows for that filter.
+
+    Columns are converted to the dtypes in COLUMN_DTYPES and DATE_FORMATS.
+
+    Args:
+        file_name (str): Name of the file to load.
+        directory (Path): Directory path where the file is located.
+        sep (str): Column separator in the file.
+        encoding (str): File encoding type.
+        use_snapshot (bool): Reuse and refresh the local snapshot of the file.
+        incremental (bool): Parse only rows appended since the last snapshot.
+        row_filter (RowFilter): Predicate applied to the rows as they are parsed.
+        chunksize (int): Number of rows to parse per chunk.
+
+    Returns:
+        pd.DataFrame: Loaded data as a DataFrame. Returns an empty DataFrame if the file is not found.
+    """
+    file_path = directory / file_name
+    col_names = COLUMN_NAMES.get(file_name, None)
+    # Text columns are read as text, so their values do not depend on whether
+    # a chunk happens to hold only numbers or blanks
+    text_columns = {
+        column: str
+        for column, dtype in COLUMN_DTYPES.get(file_name, {}).items()
+        if dtype in ("category", STRING_DTYPE)
+    }
+    read_options = {
+        "sep": sep,
+        "header": None,
+        "names": col_names,
+        "encoding": encoding,
+        "dtype": text_columns or None,
+    }
+    variant = "|".join(
+        [
+            sep,
+            encoding,
+            _schema_key(file_name),
+            row_filter.key if row_filter is not None else "",
+        ]
+    )
+
+    try:
+        signature = _source_signature(file_path)
+    except FileNotFoundError:
+        print(f"Error: {file_path} not found.")
+        return pd.DataFrame()  # Return an empty DataFrame in case of error
+
+    meta = _read_snapshot_meta(file_path, variant) if use_snapshot else None
+
+    if meta is not None:
+        if meta.get("size") == signature["size"] and (
+            meta.get("mtime_ns") == signature["mtime_ns"]
+        ):
+            df = _read_snapshot(meta, file_name)
+            if df is not None:
+                print(f"Loaded {file_name} from snapshot.")
+                return df
+        elif incremental:
+            try:
+                df = _read_appended(
+                    file_path,
+                    variant,
+                    meta,
+                    signature,
+                    read_options,
+                    row_filter,
+                    chunksize,
+                )
+            except FileNotFoundError:
+                print(f"Error: {file_path} not found.")
+                return pd.DataFrame()  # Return an empty DataFrame in case of error
+            if df is not None:
+                return df
+            print(f"{file_name} could not be resumed, reloading it in full.")
+
+    try:
+        tail = None
+        partial_row = b""
+        if incremental:
+            offset, last_line = _find_tail(file_path, signature["size"])
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                partial_row = f.read(signature["size"] - offset)
+            tail = _tail_marker(offset, last_line)
+
+        # A partially written last row is dropped; it is parsed once it is complete
+        df = _parse(
+            file_path,
+            file_name,
+            read_options,
+            row_filter,
+            chunksize,
+            drop_last_row=bool(partial_row.strip()),
+        )
+    except FileNotFoundError:
+        print(f"Error: {file_path} not found.")
+        return pd.DataFrame()  # Return an empty DataFrame in case of error
+
+    # Only snapshot the file if it did not change while it was being parsed
+    if use_snapshot:
+        try:
+            unchanged = _source_signature(file_path) == signature
+        except FileNotFoundError:
+            unchanged = False
+        if unchanged:
+            _write_snapshot(file_path, variant, signature, df, tail)
+
+    return df
+
+
+def _timed_load(file_name: str, directory: Path, options: dict):
+    """Load one dataset and return it with the seconds it took."""
+    start = time.perf_counter()
+    with measure(f"load/{file_name}") as step:
+        df = load_data(file_name, directory, **options)
+        step["rows_out"] = len(df)
+    return df, time.perf_counter() - start
+
+
+def load_datasets(
+    file_names: list,
+    directory: Path = PROD_DIR,
+    options: dict = None,
+    max_workers: int = 4,
+    timings: dict = None,
+) -> dict:
+    """
+    Load several datasets concurrently with a bounded thread pool.
+
+    Each file is a separate network read, so the reads overlap instead of
+    queueing behind each other. A file that fails to load for any reason
+    yields an empty DataFrame without affecting the others.
+
+    Args:
+        file_names (list): Names of the files to load.
+        directory (Path): Directory path where the files are located.
+        options (dict): File name -> extra keyword arguments for load_data.
+        max_workers (int): Maximum number of files read at the same time.
+        timings (dict): If given, filled with file name -> seconds taken.
+
+    Returns:
+        dict: File name -> loaded DataFrame, in the order of file_names.
+    """
+    options = options or {}
+    workers = max(1, min(max_workers, len(file_names)))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cls") as executor:
+        futures = {
+            file_name: executor.submit(
+                _timed_load, file_name, directory, options.get(file_name, {})
+            )
+            for file_name in file_names
+        }
+
+        data_frames = {}
+        for file_name, future in futures.items():
+            try:
+                df, elapsed = future.result()
+            except Exception as e:
+                print(f"Error: could not load {file_name}: {e}")
+                df, elapsed = pd.DataFrame(), None
+            else:
+                print(f"Loaded {file_name} ({len(df)} rows) in {elapsed:.2f}s.")
+            data_frames[file_name] = df
+            if timings is not None:
+                timings[file_name] = elapsed
+
+    return data_frames
+
+
+def decategorize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return df with its categorical columns turned back into plain values.
+
+    pd.crosstab includes every category of a categorical key, observed or
+    not, so frames are converted before they are cross-tabulated.
+    """
+    columns = df.select_dtypes("category").columns
+    return df.astype({column: object for column in columns})
+
+
+def memory_report(frames: dict) -> pd.DataFrame:
+    """
+    Return the memory footprint of each loaded frame and any schema drift.
+
+    Drift is a frame whose columns differ from COLUMN_NAMES, or a column that
+    did not end up with the dtype declared for it (for example because the
+    extract started sending text in a numeric column).
+
+    Args:
+        frames (dict): File name -> DataFrame, as returned by load_data.
+
+    Returns:
+        pd.DataFrame: One row per file with its row count, deep memory usage
+        in MB and a description of any schema drift.
+    """
+    report = []
+    for file_name, df in frames.items():
+        drift = []
+        expected = COLUMN_NAMES.get(file_name)
+        if expected is not None and not df.empty and list(df.columns) != expected:
+            drift.append("columns differ from COLUMN_NAMES")
+        for column, dtype in COLUMN_DTYPES.get(file_name, {}).items():
+            if column in df and df[column].dtype != dtype:
+                drift.append(f"{column} is {df[column].dtype} not {dtype}")
+        for column in DATE_FORMATS.get(file_name, {}):
+            if column in df and not pd.api.types.is_datetime64_any_dtype(df[column]):
+                drift.append(f"{column} is {df[column].dtype} not datetime")
+
+        report.append(
+            {
+                "file_name": file_name,
+                "rows": len(df),
+                "memory_mb": round(df.memory_usage(deep=True).sum() / 2**20, 3),
+                "schema_drift": "; ".join(drift),
+            }
+        )
+    return pd.DataFrame(report).set_index("file_name")
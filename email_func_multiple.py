@@ -1,13 +1,22 @@
+import base64
+import gzip
+import shutil
 import smtplib
 import datetime as dt
 import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from glob import glob
 from string import Template
-from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-
+from report_manifest import entry_paths, latest_report
+from run_metrics import measure
 
 # change directory to the Reports_PD folder
 current_dir = os.getcwd()
@@ -15,6 +24,31 @@ current_dir = os.getcwd()
 # create a todays date/time variable to use in naming the file
 todays_date = str(dt.datetime.now().strftime("%Y-%m-%d_%H_%M")) + ".xlsx"
 
+SENDER_EMAIL = "System.Reporting@Cnhind.com"
+
+# SMTP servers tried in order until one accepts the messages
+SMTP_SERVERS = [
+    {"host": "mailrac.casecorp.com", "port": 25},
+    # {"host": "SSK1SAP1.cnh1.cnhgroup.cnh.com", "port": 25},
+]
+
+# Number of SMTP connections used in parallel, and the seconds to wait on a
+# server before giving up on it
+MAX_CONNECTIONS = 4
+SMTP_TIMEOUT = 60
+
+# Attachments are read, compressed and encoded in chunks of this many bytes
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+
+# Files that are already compressed, which are attached as they are
+COMPRESSED_SUFFIXES = {".xlsx", ".zip", ".gz", ".parquet", ".png", ".jpg", ".pdf"}
+
+# MIME type of each supported attachment compression
+COMPRESSION_TYPES = {"zip": ("application", "zip"), "gzip": ("application", "gzip")}
+
+# base64 turns every 57 input bytes into one 76 character line plus a newline
+BASE64_LINE_BYTES = 57
+
 
 def get_contacts(filename):
     """
@@ -42,6 +76,287 @@ def read_template(filename):
     return Template(template_file_content)
 
 
+def _encoded_size(size):
+    """
+    Return the size of size bytes once base64 encoded into MIME lines.
+    """
+
+    return -(-size // BASE64_LINE_BYTES) * 77
+
+
+def _compress_into(file, compression, target):
+    """
+    Stream file into the binary file object target, compressed with
+    compression, and return the name of the compressed attachment.
+    """
+
+    name = os.path.basename(file)
+    with open(file, "rb") as source:
+        if compression == "gzip":
+            with gzip.GzipFile(
+                filename=name, mode="wb", fileobj=target, mtime=0, compresslevel=6
+            ) as compressed:
+                shutil.copyfileobj(source, compressed, ATTACHMENT_CHUNK_SIZE)
+            return name + ".gz"
+
+        with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(name, "w", force_zip64=True) as compressed:
+                shutil.copyfileobj(source, compressed, ATTACHMENT_CHUNK_SIZE)
+        return os.path.splitext(name)[0] + ".zip"
+
+
+def _encode_base64(source):
+    """
+    Return the base64 MIME encoding of the binary file object source,
+    reading it a chunk at a time.
+    """
+
+    # A whole number of lines per chunk keeps the pieces joinable
+    chunk_size = ATTACHMENT_CHUNK_SIZE // BASE64_LINE_BYTES * BASE64_LINE_BYTES
+    pieces = []
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        pieces.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(pieces)
+
+
+def build_attachments(
+    filelist, compression=None, max_attachment_mb=None, required=None
+):
+    """
+    Return the MIME parts for the files in filelist, each one read and
+    base64 encoded a single time so every message can share them, and the
+    names of the files that were skipped.
+
+    The files are streamed in chunks rather than read whole. With compression
+    ("zip" or "gzip") files that are not already compressed are packed before
+    they are encoded. max_attachment_mb caps the encoded size of all the
+    attachments together; a file that does not fit in what is left of the
+    budget is skipped rather than sent, unless it is in required, in which
+    case a ValueError is raised since the email would be pointless without it.
+    """
+
+    if compression is not None and compression not in COMPRESSION_TYPES:
+        raise ValueError(
+            f"Unknown compression {compression!r}, expected one of {list(COMPRESSION_TYPES)}"
+        )
+    budget = None if max_attachment_mb is None else max_attachment_mb * 1024 * 1024
+    required = set(required or [])
+
+    parts = []
+    skipped = []
+    for file in filelist:
+        filename = os.path.basename(file)
+        compress = (
+            compression is not None
+            and os.path.splitext(file)[1].lower() not in COMPRESSED_SUFFIXES
+        )
+
+        # Spool the compressed copy to disk once it outgrows memory
+        with tempfile.SpooledTemporaryFile(max_size=8 * ATTACHMENT_CHUNK_SIZE) as spool:
+            if compress:
+                filename = _compress_into(file, compression, spool)
+                size = spool.tell()
+                spool.seek(0)
+            else:
+                size = os.path.getsize(file)
+
+            # Check the budget before anything is encoded
+            encoded_size = _encoded_size(size)
+            if budget is not None and encoded_size > budget:
+                message = (
+                    f"{filename}: {encoded_size / 2**20:.1f} MB encoded is over "
+                    f"the remaining {budget / 2**20:.1f} MB budget."
+                )
+                if file in required:
+                    raise ValueError(f"Cannot attach {message}")
+                print(f"Skipping attachment {message}")
+                skipped.append(filename)
+                continue
+
+            if compress:
+                payload = _encode_base64(spool)
+            else:
+                # Open report file in binary mode
+                with open(file, "rb") as attachment:
+                    payload = _encode_base64(attachment)
+
+        if budget is not None:
+            budget -= len(payload)
+
+        # Add file as application/octet-stream, or as its archive type
+        # Email client can usually download this automatically as attachment
+        part = MIMEBase(
+            *(
+                COMPRESSION_TYPES[compression]
+                if compress
+                else ("application", "octet-stream")
+            )
+        )
+        part.set_payload(payload)
+        part["Content-Transfer-Encoding"] = "base64"
+
+        # Add header as key/value pair to attachment part
+        part.add_header("Content-Disposition", "attachment; filename= %s" % filename)
+        parts.append(part)
+    return parts, skipped
+
+
+def build_message(subject, receiver_email, body, attachment_parts, bcc=True):
+    """
+    Return the message text for one envelope, reusing the encoded
+    attachment parts.
+    """
+
+    # Create a multipart message and set headers
+    message = MIMEMultipart()
+    message["From"] = SENDER_EMAIL
+    message["To"] = receiver_email
+    message["Subject"] = subject
+    if bcc:
+        message["Bcc"] = receiver_email  # Recommended for mass emails
+
+    # Add body to email
+    message.attach(MIMEText(body, "html"))
+    for part in attachment_parts:
+        message.attach(part)
+
+    # convert message to string
+    return message.as_string()
+
+
+class RateLimiter:
+    """
+    Space out sends across threads so no more than max_per_second start
+    in any second.
+    """
+
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def _recipient_status(label, recipient, status, host=None, error=None):
+    return {
+        "name": label,
+        "email": recipient,
+        "status": status,
+        "host": host,
+        "error": None if error is None else str(error),
+    }
+
+
+def send_envelopes(
+    envelopes, smtp_servers=SMTP_SERVERS, rate_limiter=None, status_callback=None
+):
+    """
+    Send (label, recipients, build_text) envelopes over one SMTP connection,
+    moving on to the next server for whatever is left if a connection fails.
+    build_text returns the message text and is only called when the envelope
+    is sent, so the messages are never all held in memory at once. Returns
+    one status dict per recipient: "sent", "refused" or "failed".
+    status_callback, if given, is called with each status as soon as it is
+    known, so a caller can persist which recipients already got the mail.
+    """
+
+    statuses = []
+    pending = list(envelopes)
+    last_error = None
+    for server_info in smtp_servers:
+        if not pending:
+            break
+        host = server_info["host"]
+        try:
+            with smtplib.SMTP(
+                host=host, port=server_info["port"], timeout=SMTP_TIMEOUT
+            ) as server:
+                while pending:
+                    label, recipients, build_text = pending[0]
+                    if rate_limiter is not None:
+                        rate_limiter.wait()
+                    with measure(
+                        "email/send",
+                        envelope=label,
+                        recipients=len(recipients),
+                        host=host,
+                    ) as step:
+                        try:
+                            refused = server.sendmail(
+                                SENDER_EMAIL, recipients, build_text()
+                            )
+                            print(f"Email sent to {label} successfully using {host}")
+                        except smtplib.SMTPRecipientsRefused as e:
+                            # Another server would refuse the addresses as well
+                            print(f"Failed to send email to {label}: {e}")
+                            refused = e.recipients
+                        step["refused"] = len(refused)
+                    envelope_statuses = [
+                        _recipient_status(
+                            label,
+                            recipient,
+                            "refused" if recipient in refused else "sent",
+                            host,
+                            refused.get(recipient),
+                        )
+                        for recipient in recipients
+                    ]
+                    pending.pop(0)
+                    statuses.extend(envelope_statuses)
+                    if status_callback is not None:
+                        for status in envelope_statuses:
+                            status_callback(status)
+        except Exception as e:
+            print(f"Failed to send email using {host}: {e}")
+            last_error = e
+
+    for label, recipients, _ in pending:
+        print(f"Failed to send email to {label} on every server.")
+        for recipient in recipients:
+            status = _recipient_status(label, recipient, "failed", error=last_error)
+            statuses.append(status)
+            if status_callback is not None:
+                status_callback(status)
+    return statuses
+
+
+def dispatch(
+    envelopes,
+    smtp_servers=SMTP_SERVERS,
+    max_connections=MAX_CONNECTIONS,
+    max_per_second=None,
+    status_callback=None,
+):
+    """
+    Send envelopes over up to max_connections SMTP connections at once, each
+    with its own server failover, optionally capped at max_per_second sends
+    across all connections. Returns one status dict per recipient.
+    status_callback is passed on to send_envelopes and may be called from
+    several threads at once.
+    """
+
+    envelopes = list(envelopes)
+    rate_limiter = RateLimiter(max_per_second) if max_per_second else None
+    workers = max(1, min(max_connections, len(envelopes)))
+
+    # Deal the envelopes out so every connection gets an even share
+    batches = [envelopes[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smtp") as pool:
+        results = pool.map(
+            lambda batch: send_envelopes(
+                batch, smtp_servers, rate_limiter, status_callback
+            ),
+            batches,
+        )
+        return [status for batch_statuses in results for status in batch_statuses]
+
+
 def main(
     contacts_filename,
     message_filename,
@@ -49,98 +364,149 @@ def main(
     file_title,
     file_dir,
     second_file,
+    attachments=None,
+    template_fields=None,
+    single_envelope=False,
+    smtp_servers=None,
+    max_connections=MAX_CONNECTIONS,
+    max_per_second=None,
+    compression=None,
+    max_attachment_mb=None,
+    skip_recipients=None,
+    status_callback=None,
 ):
-    names, emails = get_contacts(contacts_filename)  # read contacts
-    message_template = read_template(message_filename)
-
-    # For each contact, send the email:
-    for name, email in zip(names, emails):
-        # add in the actual person name to the message template
-        # msg = message_template.attach(MIMEText(message_template.safe_substitute({'PERSON_NAME': name}), "html"))
-
-        # print(email)
-
-        subject = message_subject
-        sender_email = "System.Reporting@Cnhind.com"
-        receiver_email = email
-
-        # Create a multipart message and set headers
-        message = MIMEMultipart()
-        message["From"] = sender_email
-        message["To"] = receiver_email
-        message["Subject"] = subject
-        message["Bcc"] = receiver_email  # Recommended for mass emails
+    """
+    Email the latest report to every contact in contacts_filename.
 
-        # Add body to email
-        message.attach(
-            MIMEText(
-                message_template.safe_substitute({"PERSON_NAME": name.title()}), "html"
-            )
+    attachments lists the report files to attach; when it is None the latest
+    report of file_title in the reports folder manifest is attached instead.
+    template_fields fills extra placeholders of the message template, such
+    as an inline HTML copy of the report. The attachments are encoded once
+    and shared by every message. With single_envelope the contacts get one
+    shared message, greeted as a group, in a single envelope. Messages go
+    out over up to max_connections connections in parallel, see dispatch.
+    compression and max_attachment_mb are passed on to build_attachments,
+    with the report files as required: a report over the budget raises
+    ValueError before anything is sent, while the names of other skipped
+    files are listed under "skipped_attachments" in every status.
+    Contacts whose address is in skip_recipients are left out, so a retry
+    does not mail anyone twice, and status_callback is passed on to dispatch.
+    Returns one status dict per recipient.
+    """
+    names, emails = get_contacts(contacts_filename)  # read contacts
+    if skip_recipients:
+        contacts = [
+            (name, email)
+            for name, email in zip(names, emails)
+            if email not in skip_recipients
+        ]
+        print(
+            f"Skipping {len(emails) - len(contacts)} contacts that already got this report."
         )
+        names = [name for name, _ in contacts]
+        emails = [email for _, email in contacts]
+        if not emails:
+            return []
+    message_template = read_template(message_filename)
 
+    if attachments is not None:
+        # The caller passed the report files it just wrote
+        filelist = list(attachments) + [second_file]
+    else:
         # Directory and file title information
         current_dir = r"C:\FritzAutomation\Racine"
         file_dir = r"\reports\\"
         file_title = "RAC_Unit_EOL_Report_"  # Adjust this to your specific prefix
 
-        # Get the latest file in the specified directory that matches the file_title prefix
-        files = glob(os.path.join(current_dir + file_dir, f"{file_title}*"))
-
-        if files:
-            # Find the latest file by modification time
-            latest_file = max(files, key=os.path.getmtime)
+        # Look up the latest report in the manifest the report writer keeps
+        reports_dir = current_dir + file_dir
+        entry = latest_report(reports_dir, file_title)
+        if entry is not None:
+            report_files = entry_paths(reports_dir, entry, "xlsx") or entry_paths(
+                reports_dir, entry
+            )
+            latest_file = str(report_files[0])
             print(f"Latest file found: {latest_file}")
         else:
-            raise FileNotFoundError("No files found with the specified prefix.")
+            # Get the latest file in the specified directory that matches the file_title prefix
+            files = glob(os.path.join(reports_dir, f"{file_title}*"))
 
-        # Update filelist to use the latest file dynamically
-        filelist = [latest_file, second_file]
+            # Regenerated past days are never the latest report
+            files = [
+                path
+                for path in files
+                if not os.path.basename(path).startswith(f"{file_title}backfill_")
+            ]
 
-        for file in filelist:
-            # Open report file in binary mode
-            with open(file, "rb") as attachment:
-                # Add file as application/octet-stream
-                # Email client can usually download this automatically as attachment
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-
-                # Encode file in ASCII characters to send by email
-                encoders.encode_base64(part)
-
-                # Add header as key/value pair to attachment part
-                part.add_header(
-                    "Content-Disposition",
-                    "attachment; filename= %s" % os.path.basename(file),
-                )
+            if files:
+                # Find the latest file by modification time
+                latest_file = max(files, key=os.path.getmtime)
+                print(f"Latest file found: {latest_file}")
+            else:
+                raise FileNotFoundError("No files found with the specified prefix.")
 
-                message.attach(part)
+        # Update filelist to use the latest file dynamically
+        filelist = [latest_file, second_file]
 
-        # Add attachment to message and convert message to string
-        text = message.as_string()
+    # Read and encode the attachments once for all recipients
+    with measure("email/attachments", files=len(filelist)) as step:
+        attachment_parts, skipped = build_attachments(
+            filelist, compression, max_attachment_mb, required=filelist[:-1]
+        )
+        step["attached"] = len(attachment_parts)
 
-        # # Log in to server using secure context and send email
-        # with smtplib.SMTP(host="mailrac.casecorp.com", port=25) as server:
-        #     server.sendmail(sender_email, receiver_email, text)
-        #     server.quit()
+    def render_body(person_name):
+        # add in the actual person name to the message template
+        return message_template.safe_substitute(
+            {**(template_fields or {}), "PERSON_NAME": person_name}
+        )
 
-        smtp_servers = [
-            {"host": "mailrac.casecorp.com", "port": 25},
-            # {"host": "SSK1SAP1.cnh1.cnhgroup.cnh.com", "port": 25},
+    if single_envelope:
+        # One message for everyone, the recipients only appear on the envelope
+        envelopes = [
+            (
+                f"{len(emails)} recipients",
+                emails,
+                partial(
+                    build_message,
+                    message_subject,
+                    SENDER_EMAIL,
+                    render_body("All"),
+                    attachment_parts,
+                    bcc=False,
+                ),
+            )
+        ]
+    else:
+        # For each contact, only the headers and the greeting change
+        envelopes = [
+            (
+                name.title(),
+                [email],
+                partial(
+                    build_message,
+                    message_subject,
+                    email,
+                    render_body(name.title()),
+                    attachment_parts,
+                ),
+            )
+            for name, email in zip(names, emails)
         ]
 
-        for server_info in smtp_servers:
-            try:
-                with smtplib.SMTP(
-                    host=server_info["host"], port=server_info["port"]
-                ) as server:
-                    server.sendmail(sender_email, receiver_email, text)
-                    print(
-                        f"Email sent to {name.title()} successfully using {server_info['host']}"
-                    )
-                    # return  # Exit the function after a successful send
-            except Exception as e:
-                print(f"Failed to send email using {server_info['host']}: {e}")
-                pass
+    statuses = dispatch(
+        envelopes,
+        smtp_servers or SMTP_SERVERS,
+        max_connections=max_connections,
+        max_per_second=max_per_second,
+        status_callback=status_callback,
+    )
+    if skipped:
+        for status in statuses:
+            status["skipped_attachments"] = skipped
+    sent = sum(status["status"] == "sent" for status in statuses)
+    print(f"Email sent to {sent} of {len(statuses)} recipients.")
+    return statuses
 
 
 if __name__ == "__main__":
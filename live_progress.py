@@ -0,0 +1,312 @@
+"""
+Live Unit Progress Module
+
+This module serves the day's unit end of line sheets while the line is
+running, instead of once a day in the 15:35 workbook. A background thread
+checks the CLS extracts every REFRESH_SECONDS. When one of them changed,
+the extracts are reloaded, which only parses the rows appended to
+cls_unit_status.txt and cls_unit_checklist_summary.txt since the last
+refresh, and the report's sheets are rebuilt from the day's rows. The
+service keeps its snapshots in LIVE_SNAPSHOT_DIR, apart from the scheduled
+report's. Every sheet is serialized to JSON once per refresh and a small
+local HTTP server hands out those bytes, so a request never touches pandas
+and is answered in the same time however large the extracts get.
+
+Run it with:  python live_progress.py [--port 8765] [--interval 30]
+
+Endpoints:
+    /               Status of the service and the sheets it serves.
+    /sheets/<name>  One sheet in pandas' "split" layout. Crosstab sheets also
+                    list, per unit, the rows that still lack a sign-off.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+import cls_loader
+from RAC_Unit_EOL_Crosstab import (
+    DATA_FILES,
+    PROD_DIR,
+    REPORT_DEFINITIONS,
+    get_date_refs,
+    load_stage,
+    sheets_stage,
+)
+
+# Local address the service listens on
+LIVE_HOST = "127.0.0.1"
+LIVE_PORT = 8765
+
+# Seconds between checks of the extracts for new rows
+REFRESH_SECONDS = 30
+
+# Entry of REPORT_DEFINITIONS whose sheets are served
+LIVE_REPORT = "RAC_Unit_EOL"
+
+# The service keeps its own snapshots of the extracts, so its refreshes never
+# write the files the scheduled report is reading or writing
+LIVE_SNAPSHOT_DIR = Path.cwd() / "temp" / "live_snapshots"
+
+# Extra load options of the service. Checks are appended to the checklist
+# summary as they are signed off, so the refreshes only parse the new ones.
+LIVE_LOAD_OPTIONS = {"cls_unit_checklist_summary.txt": {"incremental": True}}
+
+logger = logging.getLogger(__name__)
+
+
+def _json_bytes(value) -> bytes:
+    return json.dumps(value, default=str).encode("utf-8")
+
+
+def sheet_document(sheet_name: str, df: pd.DataFrame, updated: str) -> bytes:
+    """
+    Serialize one sheet for the /sheets endpoint.
+
+    Args:
+        sheet_name (str): Name of the sheet.
+        df (pd.DataFrame): The sheet as rendered in the workbook.
+        updated (str): Time the sheet was built.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    document = {
+        "sheet": sheet_name,
+        "updated": updated,
+        "index_names": list(df.index.names),
+    }
+
+    # The rows of every unit still at 0, by the description level of the index
+    if "%" in df.columns:
+        matrix = df.drop(columns="%").to_numpy()
+        rows, units = np.nonzero(matrix == 0)
+        labels = df.index.get_level_values(-1).to_numpy()
+        unit_names = df.columns.drop("%").to_numpy()
+        missing = {}
+        for unit, row in zip(unit_names[units], labels[rows]):
+            missing.setdefault(str(unit), []).append(row)
+        document["missing"] = missing
+
+    # pandas writes the frame itself, which is much faster than json for large sheets
+    frame = df.to_json(orient="split", date_format="iso")
+    return _json_bytes(document)[:-1] + b', "frame": ' + frame.encode("utf-8") + b"}"
+
+
+class LiveProgress:
+    """
+    The latest sheets of a report, rebuilt whenever the extracts change.
+
+    Readers get the serialized documents of the last refresh; a refresh
+    builds a complete new set and swaps it in with one assignment, so a
+    request never sees half of one.
+
+    Args:
+        directory (Path, optional): Folder holding the extracts.
+        report (str, optional): Entry of REPORT_DEFINITIONS to serve.
+        interval (int, optional): Seconds between checks of the extracts.
+    """
+
+    def __init__(
+        self,
+        directory: Path = PROD_DIR,
+        report: str = LIVE_REPORT,
+        interval: int = REFRESH_SECONDS,
+    ):
+        self.directory = Path(directory)
+        self.report = report
+        self.definition = REPORT_DEFINITIONS[report]
+        self.interval = interval
+        self._signature = None
+        self._documents = {}
+        self._version = 0
+        self._status = {
+            "report": report,
+            "report_date": None,
+            "updated": None,
+            "refresh_seconds": None,
+            "error": None,
+            "sheets": {},
+        }
+        self._publish()
+
+    def _publish(self, sheet_documents: dict = None):
+        """Swap in a new set of documents with an up to date status."""
+        documents = dict(self._documents)
+        if sheet_documents is not None:
+            documents = {
+                f"/sheets/{sheet_name}": body
+                for sheet_name, body in sheet_documents.items()
+            }
+            self._status["sheets"] = {
+                sheet_name: f"/sheets/{sheet_name}" for sheet_name in sheet_documents
+            }
+        documents["/"] = _json_bytes(self._status)
+        self._version += 1
+        self._documents = documents
+
+    def _source_signature(self) -> tuple:
+        """Return the size and mtime of every extract, None for missing ones."""
+        signature = []
+        for file_name in DATA_FILES:
+            try:
+                stat = os.stat(self.directory / file_name)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Rebuild the sheets if the extracts or the day changed.
+
+        Args:
+            force (bool, optional): Rebuild even if nothing changed.
+
+        Returns:
+            bool: True if the sheets were rebuilt.
+        """
+        date_refs = get_date_refs()
+        signature = (date_refs["today"], self._source_signature())
+        if signature == self._signature and not force:
+            return False
+
+        start = time.perf_counter()
+        try:
+            data_frames = load_stage(
+                date_refs, self.directory, extra_options=LIVE_LOAD_OPTIONS
+            )
+            sheets, late_signoff_sheets = sheets_stage(
+                self.report, self.definition, data_frames
+            )
+        except Exception as e:
+            # Keep serving the last good sheets and retry on the next check
+            print(f"Error: could not refresh the live sheets: {e!r}")
+            self._status["error"] = repr(e)
+            self._publish()
+            return False
+
+        updated = datetime.now().isoformat(timespec="seconds")
+        sheet_documents = {
+            sheet_name: sheet_document(sheet_name, df, updated)
+            for sheet_name, df in {**sheets, **late_signoff_sheets}.items()
+        }
+        self._signature = signature
+        self._status.update(
+            report_date=date_refs["today"].isoformat(),
+            updated=updated,
+            refresh_seconds=round(time.perf_counter() - start, 3),
+            error=None,
+        )
+        self._publish(sheet_documents)
+        print(
+            f"Refreshed {len(sheet_documents)} live sheets in "
+            f"{self._status['refresh_seconds']}s"
+        )
+        return True
+
+    def run(self, stop: threading.Event):
+        """Refresh every interval seconds until stop is set."""
+        while not stop.wait(self.interval):
+            self.refresh()
+
+    def document(self, path: str) -> tuple:
+        """
+        Return the body and ETag of the document at a path.
+
+        Returns:
+            tuple: The JSON bytes, or None if there is no such document, and
+            the ETag of the current set of documents.
+        """
+        documents, version = self._documents, self._version
+        return documents.get(path), f'"{version}"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answers GET requests from the documents of the server's LiveProgress."""
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path).rstrip("/") or "/"
+        body, etag = self.server.progress.document(path)
+        if body is None:
+            self._send(404, _json_bytes({"error": f"No such document: {path}"}))
+        elif self.headers.get("If-None-Match") == etag:
+            self._send(304, None, etag)
+        else:
+            self._send(200, body, etag)
+
+    def _send(self, code: int, body: bytes, etag: str = None):
+        self.send_response(code)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(
+    host: str = LIVE_HOST,
+    port: int = LIVE_PORT,
+    interval: int = REFRESH_SECONDS,
+    directory: Path = PROD_DIR,
+):
+    """
+    Build the sheets once and serve them, refreshing in the background
+    until interrupted.
+
+    Args:
+        host (str, optional): Address to listen on. Defaults to LIVE_HOST.
+        port (int, optional): Port to listen on. Defaults to LIVE_PORT.
+        interval (int, optional): Seconds between checks of the extracts.
+        directory (Path, optional): Folder holding the extracts.
+    """
+    # Only this process loads extracts, so the snapshot folder is set for all of it
+    cls_loader.SNAPSHOT_DIR = LIVE_SNAPSHOT_DIR
+
+    progress = LiveProgress(directory, interval=interval)
+    progress.refresh()
+
+    stop = threading.Event()
+    refresher = threading.Thread(
+        target=progress.run, args=(stop,), name="live_refresh", daemon=True
+    )
+    refresher.start()
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.progress = progress
+    print(f"Serving live unit progress on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        refresher.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=LIVE_HOST)
+    parser.add_argument("--port", type=int, default=LIVE_PORT)
+    parser.add_argument("--interval", type=int, default=REFRESH_SECONDS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.interval)
@@ -0,0 +1,141 @@
+"""
+Report Config Module
+
+This module loads the station and checklist configuration of a report from
+a versioned JSON file under CONFIG_DIR and compiles it into lookup tables:
+every known check description and component gets an integer code, and the
+per-code arrays answer "is this check on the family's sheet" and "what is
+its order" with one index lookup per row instead of repeated isin and map
+calls. current_config() checks the file on every call and recompiles it
+when it changed, so a long running scheduler picks up an edited config on
+its next run without a restart. A config that fails to load is reported
+and the last good one is kept.
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CONFIG_DIR = Path(__file__).resolve().parent / "config"
+
+# Version of the config file layout this module understands
+CONFIG_VERSION = 1
+
+# Compiled configs by path, with the size and mtime of the file they came from
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+class ReportConfig:
+    """
+    A report's configuration, compiled into lookup tables.
+
+    The lookup arrays have one slot more than their index: values that are
+    not in the config get the code of that last slot, which holds False or
+    NaN, so unknown values need no separate mask.
+
+    Args:
+        raw (dict): Parsed contents of the config file.
+        source (Path, optional): File the config was read from.
+    """
+
+    def __init__(self, raw: dict, source: Path = None):
+        version = raw.get("version")
+        if version != CONFIG_VERSION:
+            raise ValueError(
+                f"{source}: config version {version!r} is not supported, "
+                f"expected {CONFIG_VERSION}"
+            )
+        missing = [
+            key
+            for key in ["work_stations", "display_orders", "item_orders", "families"]
+            if key not in raw
+        ]
+        if missing:
+            raise ValueError(f"{source}: config is missing {missing}")
+        for family, definition in raw["families"].items():
+            if not definition.get("prefixes") or "checks" not in definition:
+                raise ValueError(f"{source}: family {family} needs prefixes and checks")
+
+        self.source = source
+        self.version = version
+        self.work_stations = list(raw["work_stations"])
+        self.display_orders = {
+            name: int(order) for name, order in raw["display_orders"].items()
+        }
+        self.item_orders = {
+            name: int(order) for name, order in raw["item_orders"].items()
+        }
+        self.families = {
+            family: {
+                "prefixes": list(definition["prefixes"]),
+                "checks": list(definition["checks"]),
+            }
+            for family, definition in raw["families"].items()
+        }
+
+        # Components with a Display_order override and their orders
+        self.components = pd.Index(list(self.display_orders))
+        self.component_orders = np.array(
+            list(self.display_orders.values()) + [0], dtype=np.int64
+        )
+
+        # Every check of any family or with an Item_order, with its order
+        # (NaN when it has none) and whether each family's sheet shows it
+        checks = list(self.item_orders)
+        for definition in self.families.values():
+            checks += [check for check in definition["checks"] if check not in checks]
+        self.checks = pd.Index(checks)
+        self.check_orders = np.array(
+            [self.item_orders.get(check, np.nan) for check in checks] + [np.nan]
+        )
+        self.family_checks = {
+            family: np.append(self.checks.isin(definition["checks"]), False)
+            for family, definition in self.families.items()
+        }
+
+    @staticmethod
+    def codes(index: pd.Index, values: pd.Series) -> np.ndarray:
+        """
+        Return the position of each value in index, with unknown values on
+        the extra slot past its end.
+        """
+        codes = index.get_indexer(values)
+        codes[codes < 0] = len(index)
+        return codes
+
+
+def current_config(path: Path) -> ReportConfig:
+    """
+    Return the compiled config in a file, recompiling it if the file changed.
+
+    Args:
+        path (Path): Config file to read.
+
+    Returns:
+        ReportConfig: The config compiled from the current file, or the last
+        good one if the file no longer loads.
+    """
+    path = Path(path)
+    with _configs_lock:
+        cached = _configs.get(path)
+        try:
+            stat = path.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            with open(path, "r", encoding="utf-8") as f:
+                config = ReportConfig(json.load(f), path)
+        except (OSError, ValueError) as e:
+            if cached is None:
+                raise
+            print(f"Error: could not reload {path}, keeping the last good config: {e}")
+            return cached[1]
+
+        if cached is not None:
+            print(f"Reloaded {path.name} (config version {config.version})")
+        _configs[path] = (signature, config)
+        return config
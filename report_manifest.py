@@ -0,0 +1,203 @@
+"""
+Report Manifest Module
+
+This module keeps a small JSON manifest next to the generated reports. Each
+run of a report records its files, creation time, content hashes and sheet
+names, so the mailer and any other consumer can find the latest report of a
+prefix with one dictionary lookup instead of globbing and stat-ing the whole
+reports folder. prune_reports applies a retention policy to the files of a
+prefix, both those in the manifest and older ones written before it existed.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+
+# Serializes manifest updates made from threads of the same process
+_manifest_lock = threading.Lock()
+
+
+def _manifest_path(reports_dir: Path) -> Path:
+    """Return the path of the manifest for a reports folder."""
+    return Path(reports_dir) / MANIFEST_NAME
+
+
+def read_manifest(reports_dir: Path) -> dict:
+    """
+    Return the manifest of a reports folder.
+
+    A missing or unreadable manifest reads as an empty one, so consumers can
+    fall back to scanning the folder.
+    """
+    try:
+        with open(_manifest_path(reports_dir), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"reports": {}}
+    manifest.setdefault("reports", {})
+    return manifest
+
+
+def _write_manifest(reports_dir: Path, manifest: dict) -> None:
+    """Replace the manifest through a temporary file so readers never see half of it."""
+    path = _manifest_path(reports_dir)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_report(
+    reports_dir: Path,
+    prefix: str,
+    outputs: dict,
+    sheets: list,
+    created: datetime = None,
+) -> dict:
+    """
+    Add a report run to the manifest and make it the latest of its prefix.
+
+    Args:
+        reports_dir (Path): Folder the report files were written to.
+        prefix (str): Report file prefix, e.g. "RAC_Unit_EOL_Report_".
+        outputs (dict): Format -> list of files written for the run.
+        sheets (list): Names of the sheets in the report.
+        created (datetime, optional): Time of the run. Defaults to now.
+
+    Returns:
+        dict: The manifest entry that was recorded.
+    """
+    reports_dir = Path(reports_dir)
+    entry = {
+        "created": (created or datetime.now()).isoformat(timespec="seconds"),
+        "sheets": list(sheets),
+        "files": {
+            output_format: [
+                {
+                    # Relative names keep the manifest valid if the folder moves
+                    "name": os.path.relpath(path, reports_dir),
+                    "bytes": os.path.getsize(path),
+                    "sha256": file_sha256(path),
+                }
+                for path in paths
+            ]
+            for output_format, paths in outputs.items()
+        },
+    }
+
+    with _manifest_lock:
+        manifest = read_manifest(reports_dir)
+        manifest["reports"].setdefault(prefix, []).append(entry)
+        _write_manifest(reports_dir, manifest)
+    return entry
+
+
+def latest_report(reports_dir: Path, prefix: str):
+    """
+    Return the manifest entry of the latest run of a report, or None.
+
+    Args:
+        reports_dir (Path): Folder holding the manifest.
+        prefix (str): Report file prefix.
+    """
+    entries = read_manifest(reports_dir)["reports"].get(prefix)
+    return entries[-1] if entries else None
+
+
+def entry_paths(reports_dir: Path, entry: dict, output_format: str = None) -> list:
+    """
+    Return the absolute paths of the files of a manifest entry.
+
+    Args:
+        reports_dir (Path): Folder holding the manifest.
+        entry (dict): Entry from latest_report or record_report.
+        output_format (str, optional): Only return files of this format.
+    """
+    return [
+        Path(reports_dir) / file_info["name"]
+        for name, files in entry["files"].items()
+        if output_format is None or name == output_format
+        for file_info in files
+    ]
+
+
+def prune_reports(
+    reports_dir: Path,
+    prefix: str,
+    keep_days: int = None,
+    keep_last: int = None,
+) -> list:
+    """
+    Delete the report files of a prefix that fall outside the retention policy.
+
+    A run is kept while it is younger than keep_days or among the keep_last
+    latest runs. Files of the prefix that are not in the manifest (written
+    before it existed) are judged by their modification time.
+
+    Args:
+        reports_dir (Path): Folder holding the reports and the manifest.
+        prefix (str): Report file prefix.
+        keep_days (int, optional): Keep runs newer than this many days.
+        keep_last (int, optional): Always keep this many of the latest runs.
+
+    Returns:
+        list: Paths of the files that were deleted.
+    """
+    if keep_days is None and keep_last is None:
+        return []
+
+    reports_dir = Path(reports_dir)
+    if not reports_dir.is_dir():
+        return []
+    cutoff = None if keep_days is None else datetime.now() - timedelta(days=keep_days)
+    removed = []
+
+    with _manifest_lock:
+        manifest = read_manifest(reports_dir)
+        entries = manifest["reports"].get(prefix, [])
+        keep = []
+        for position, entry in enumerate(entries):
+            recent = position >= len(entries) - (keep_last or 0)
+            young = (
+                cutoff is not None
+                and datetime.fromisoformat(entry["created"]) >= cutoff
+            )
+            if recent or young:
+                keep.append(entry)
+                continue
+            for path in entry_paths(reports_dir, entry):
+                if path.exists():
+                    path.unlink()
+                    removed.append(path)
+        manifest["reports"][prefix] = keep
+        _write_manifest(reports_dir, manifest)
+
+        # Untracked files from before the manifest only go by age
+        if cutoff is not None:
+            tracked = {
+                path.name for entry in keep for path in entry_paths(reports_dir, entry)
+            }
+            for path in reports_dir.glob(f"{prefix}*"):
+                if path.name in tracked or not path.is_file():
+                    continue
+                if datetime.fromtimestamp(path.stat().st_mtime) < cutoff:
+                    path.unlink()
+                    removed.append(path)
+
+    for path in removed:
+        print(f"Pruned old report {path.name}")
+    return removed
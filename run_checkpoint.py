@@ -0,0 +1,169 @@
+"""
+Run Checkpoint Module
+
+This module lets a report run pick up where a failed attempt stopped. The
+result of each completed stage is pickled under CHECKPOINT_DIR, keyed on the
+job and a run key, such as the day it reports on and the id the scheduler
+gives the attempts of one run, and every email recipient's send status is
+appended to a log as soon as it is known. When the scheduler retries a run,
+the new attempt loads the finished stages instead of redoing them and skips
+the recipients that were already mailed, so a transient share or SMTP error
+costs seconds and never sends the report twice. A run that finishes removes
+its checkpoint; an unfinished one is only resumed by a retry with the same
+run key within CHECKPOINT_MAX_AGE, so any other run starts from fresh data.
+"""
+
+import json
+import os
+import pickle
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+
+CHECKPOINT_DIR = Path.cwd() / "temp" / "checkpoints"
+
+# Seconds after its first attempt that an unfinished run can still be resumed
+CHECKPOINT_MAX_AGE = 3600
+
+STATE_FILE = "state.json"
+SENDS_FILE = "sends.jsonl"
+
+
+class RunCheckpoint:
+    """
+    Checkpoints of one run of a job.
+
+    Opening a checkpoint resumes the unfinished run with the same job and
+    run key if it is recent enough, and otherwise starts a new one.
+
+    Args:
+        job (str): Name of the job, e.g. "RAC_Unit_EOL_Crosstab".
+        run_key (str): Identifies the run within the job, e.g. the report date
+            and the run id.
+        directory (Path, optional): Folder the checkpoints are kept in.
+        max_age (int, optional): Seconds an unfinished run can be resumed for.
+    """
+
+    def __init__(
+        self,
+        job: str,
+        run_key: str,
+        directory: Path = CHECKPOINT_DIR,
+        max_age: int = CHECKPOINT_MAX_AGE,
+    ):
+        self.job = job
+        self.path = Path(directory) / f"{job}_{run_key}"
+        self._lock = threading.Lock()
+
+        # Drop checkpoints of other runs of the job that were never finished
+        for other in Path(directory).glob(f"{job}_*"):
+            if other != self.path and other.is_dir():
+                age = datetime.now().timestamp() - other.stat().st_mtime
+                if age > max_age:
+                    shutil.rmtree(other, ignore_errors=True)
+
+        state = self._read_state()
+        if state is not None:
+            started = datetime.fromisoformat(state["started"])
+            if (datetime.now() - started).total_seconds() > max_age:
+                state = None
+        if state is not None:
+            self.state = state
+            self.resumed = True
+            print(
+                f"Resuming {job} run {run_key} started at {state['started']}, "
+                f"completed stages: {state['stages'] or 'none'}"
+            )
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.state = {
+                "started": datetime.now().isoformat(timespec="seconds"),
+                "stages": [],
+            }
+            self.resumed = False
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._write_state()
+
+    def _read_state(self):
+        try:
+            with open(self.path / STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_state(self):
+        tmp_path = self.path / (STATE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path / STATE_FILE)
+
+    def done(self, stage: str) -> bool:
+        """Return True if the stage finished in this or an earlier attempt."""
+        return stage in self.state["stages"]
+
+    def save(self, stage: str, value):
+        """
+        Store the result of a finished stage.
+
+        The pickle is written through a temporary file and the stage is only
+        marked done once it is in place, so a crash mid-write never leaves a
+        stage that cannot be loaded.
+        """
+        path = self.path / f"{stage}.pkl"
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if stage not in self.state["stages"]:
+            self.state["stages"].append(stage)
+        self._write_state()
+
+    def load(self, stage: str):
+        """Return the stored result of a finished stage."""
+        with open(self.path / f"{stage}.pkl", "rb") as f:
+            return pickle.load(f)
+
+    def discard(self, stage: str):
+        """Forget a stage, so it runs again."""
+        if stage in self.state["stages"]:
+            self.state["stages"].remove(stage)
+            self._write_state()
+
+    def record_status(self, status: dict, scope: str = None):
+        """
+        Append one recipient's send status; safe to call from any thread.
+
+        scope tells apart the mailings of a run that sends several reports.
+        """
+        line = json.dumps({**status, "scope": scope}, default=str)
+        with self._lock:
+            with open(self.path / SENDS_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def handled_recipients(self, scope: str = None) -> set:
+        """
+        Return the addresses of a scope already dealt with: sent, or refused
+        by the server (which a retry would not change).
+        """
+        handled = set()
+        try:
+            with open(self.path / SENDS_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        status = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    if status.get("scope") == scope and status["status"] in (
+                        "sent",
+                        "refused",
+                    ):
+                        handled.add(status["email"])
+        except FileNotFoundError:
+            pass
+        return handled
+
+    def complete(self):
+        """Remove the checkpoint of a run that finished."""
+        shutil.rmtree(self.path, ignore_errors=True)
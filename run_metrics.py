@@ -0,0 +1,237 @@
+"""
+Run Metrics Module
+
+This module records how long each step of a report run takes, how many rows
+go in and out of it and how much memory the process holds while it runs.
+A run is wrapped in a RunMetrics context; inside it, any code can time a
+step with measure(), so the report and email modules do not have to pass a
+metrics object through every function. Outside a run measure() does
+nothing. When the run ends, one JSON record with every step is appended to
+METRICS_LOG and written to the logging log, so a slow run can be traced to
+the step that caused it.
+
+RSS is sampled by a background thread every SAMPLE_INTERVAL seconds while a
+step is open, which gives a per-step peak even in a long lived worker whose
+process high-water mark never goes down. Steps that overlap in time (such as
+the concurrent dataset loads) share the same samples.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# JSON lines file every finished run is appended to
+METRICS_LOG = Path("logs") / "rac_metrics.jsonl"
+
+# Seconds between RSS samples while a step is running
+SAMPLE_INTERVAL = 0.1
+
+logger = logging.getLogger(__name__)
+
+# The run currently being recorded in this process, if any
+_active_run = None
+
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+
+def _windows_rss() -> int:
+    """Return the working set of the current process on Windows."""
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(
+        ctypes.windll.kernel32.GetCurrentProcess(),
+        ctypes.byref(counters),
+        counters.cb,
+    )
+    return counters.WorkingSetSize
+
+
+def current_rss():
+    """
+    Return the resident set size of the current process in bytes.
+
+    Uses psutil when it is installed, /proc on Linux and the process memory
+    counters on Windows. Returns None where none of them are available.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    if sys.platform == "win32":
+        return _windows_rss()
+    return None
+
+
+def _mb(value):
+    return None if value is None else round(value / 2**20, 1)
+
+
+class RunMetrics:
+    """
+    Collect the step metrics of one run and write them out when it ends.
+
+    Args:
+        job (str): Name of the job, e.g. "RAC_Unit_EOL_Crosstab".
+        log_file (Path, optional): JSON lines file to append the record to.
+            Defaults to METRICS_LOG, None only logs it.
+    """
+
+    def __init__(self, job: str, log_file: Path = METRICS_LOG):
+        self.job = job
+        self.log_file = log_file
+        self.steps = []
+        self.record = None
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            # Between steps there is nothing to sample for
+            with self._lock:
+                if not self._open:
+                    continue
+            rss = current_rss()
+            with self._lock:
+                for step in self._open:
+                    step["_peak"] = max(step["_peak"], rss)
+
+    @contextmanager
+    def step(self, name: str, **fields):
+        """
+        Time a step and record its RSS; the yielded dict takes extra fields.
+
+        Args:
+            name (str): Name of the step, e.g. "crosstab/Tractor".
+            **fields: Extra fields for the record, such as rows_in.
+        """
+        rss = current_rss()
+        start = time.perf_counter()
+        step = {
+            "name": name,
+            "start_s": round(start - self._start, 4),
+            **fields,
+            "_peak": rss or 0,
+        }
+        with self._lock:
+            self._open.append(step)
+        try:
+            yield step
+        except BaseException as e:
+            step["error"] = repr(e)
+            raise
+        finally:
+            step["seconds"] = round(time.perf_counter() - start, 4)
+            end_rss = current_rss()
+            with self._lock:
+                self._open.remove(step)
+                peak = max(step.pop("_peak"), end_rss or 0)
+                if rss is not None:
+                    step["rss_start_mb"] = _mb(rss)
+                    step["rss_end_mb"] = _mb(end_rss)
+                    step["peak_rss_mb"] = _mb(peak)
+                self.steps.append(step)
+
+    def __enter__(self):
+        global _active_run
+        if _active_run is not None:
+            raise RuntimeError(f"{_active_run.job} is already being recorded")
+        _active_run = self
+        self._started = datetime.now()
+        self._start = time.perf_counter()
+        self._rss_start = current_rss()
+        if self._rss_start is not None:
+            self._sampler = threading.Thread(
+                target=self._sample, name="run_metrics", daemon=True
+            )
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        global _active_run
+        _active_run = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+        self.record = {
+            "job": self.job,
+            "started": self._started.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self._start, 3),
+            "status": "ok" if exc is None else "error",
+            "error": None if exc is None else repr(exc),
+            "pid": os.getpid(),
+            "rss_start_mb": _mb(self._rss_start),
+            "peak_rss_mb": max(
+                (step["peak_rss_mb"] for step in self.steps if "peak_rss_mb" in step),
+                default=None,
+            ),
+            # The steps in the order they started, nested steps after their parent
+            "steps": sorted(self.steps, key=lambda step: step["start_s"]),
+        }
+        self.write()
+        return False
+
+    def write(self):
+        """Append the run's record to the log file and the logging log."""
+        line = json.dumps(self.record, default=str)
+        logger.info(f"run metrics {line}")
+        if self.log_file is None:
+            return
+        try:
+            Path(self.log_file).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            # Losing the metrics must never fail the report
+            print(f"Could not write run metrics to {self.log_file}: {e}")
+
+
+@contextmanager
+def measure(name: str, **fields):
+    """
+    Record a step of the active run, or just run the block when there is none.
+
+    Args:
+        name (str): Name of the step.
+        **fields: Extra fields for the record, such as rows_in.
+
+    Yields:
+        dict: The step's record, to add fields such as rows_out to.
+    """
+    run = _active_run
+    if run is None:
+        yield dict(fields)
+        return
+    with run.step(name, **fields) as step:
+        yield step
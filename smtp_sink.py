@@ -0,0 +1,152 @@
+"""
+Local SMTP Sink Module
+
+This module runs a small SMTP server that accepts and keeps every message it
+is sent, so the email dispatch in email_func_multiple.py can be tested and
+benchmarked offline. A per-message delay stands in for the round trip to the
+real relay, and refused addresses exercise the per-recipient status results.
+Point SMTP_SERVERS (or the smtp_servers argument of main) at one or more
+sinks, and at a closed port to exercise failover.
+
+Run it on its own with:  python smtp_sink.py [port] [delay_seconds]
+"""
+
+import socketserver
+import sys
+import threading
+import time
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """
+    Speak just enough SMTP for smtplib: HELO/EHLO, MAIL, RCPT, DATA, RSET,
+    NOOP and QUIT.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        sink = self.server.sink
+        mail_from, rcpt_tos = None, []
+        self.reply("220 smtp_sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command[:4].upper()
+            argument = command.partition(":")[2].strip()
+            address = argument.split(" ")[0].strip("<>")
+
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 smtp_sink")
+            elif verb == "MAIL":
+                mail_from, rcpt_tos = address, []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                if address in sink.refuse:
+                    self.reply("550 Mailbox unavailable")
+                else:
+                    rcpt_tos.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                if not rcpt_tos:
+                    self.reply("503 Need RCPT first")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    # Undo the dot-stuffing done by the client
+                    data.append(data_line[1:] if data_line[:2] == b".." else data_line)
+                if sink.delay:
+                    time.sleep(sink.delay)
+                sink.store(mail_from, rcpt_tos, b"".join(data))
+                mail_from, rcpt_tos = None, []
+                self.reply("250 OK")
+            elif verb == "RSET":
+                mail_from, rcpt_tos = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+    """Threaded TCP server that can rebind a port left in TIME_WAIT."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink:
+    """
+    Threaded SMTP server that keeps every message it accepts in memory.
+
+    Args:
+        host (str, optional): Interface to listen on. Defaults to 127.0.0.1.
+        port (int, optional): Port to listen on, 0 picks a free one.
+        delay (float, optional): Seconds to wait before accepting each message.
+        refuse (set, optional): Recipient addresses answered with a 550.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, refuse=()):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.refuse = set(refuse)
+        self.messages = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def store(self, mail_from, rcpt_tos, data):
+        with self._lock:
+            self.messages.append(
+                {"mail_from": mail_from, "rcpt_tos": list(rcpt_tos), "data": data}
+            )
+
+    @property
+    def server_info(self):
+        """Entry for SMTP_SERVERS pointing at this sink."""
+        return {"host": self.host, "port": self.port}
+
+    def start(self):
+        self._server = _SinkServer((self.host, self.port), _SinkHandler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="smtp_sink", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 2525
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    with SMTPSink(port=port, delay=delay) as sink:
+        print(f"SMTP sink listening on {sink.host}:{sink.port}, Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"Received {len(sink.messages)} messages.")